@@ -0,0 +1,250 @@
+"""
+Speech audio extraction with ffmpeg, streamed through pipes.
+
+Video bytes go into ffmpeg's stdin and compact mono 16 kHz speech audio comes out of
+its stdout, so a recording never has to be written to disk or held in memory whole.
+"""
+import itertools
+import os
+import re
+import struct
+import subprocess
+import tempfile
+import threading
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+SPEECH_SAMPLE_RATE = 16000
+SPEECH_AUDIO_CODEC = os.getenv("SPEECH_AUDIO_CODEC", "opus").lower()
+SPEECH_AUDIO_BITRATE = os.getenv("SPEECH_AUDIO_BITRATE", "24k")
+CHUNK_SIZE = 64 * 1024
+# Bytes read from the start of a download to decide whether it can be piped straight into ffmpeg
+HEAD_SIZE = 256 * 1024
+
+# Silence detection used to pick segment boundaries for long recordings
+SILENCE_NOISE_DB = int(os.getenv("SILENCE_NOISE_DB", "-35"))
+SILENCE_MIN_SECONDS = float(os.getenv("SILENCE_MIN_SECONDS", "0.5"))
+_SILENCE_START_RE = re.compile(r"silence_start:\s*(-?[\d.]+)")
+_SILENCE_END_RE = re.compile(r"silence_end:\s*([\d.]+)")
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):([\d.]+)")
+_PROGRESS_TIME_RE = re.compile(r"time=(\d+):(\d+):([\d.]+)")
+
+# ISO base media (mp4/mov/m4a) boxes we need to see to decide if a file can be read from a pipe
+_ISO_MEDIA_DATA = b"mdat"
+_ISO_MOVIE_HEADER = b"moov"
+
+
+class AudioExtractionError(Exception):
+    """Raised when ffmpeg cannot produce audio from the given input"""
+
+
+def speech_encoding_args() -> List[str]:
+    """ffmpeg output options for mono, 16 kHz, low-bitrate speech audio"""
+    # bitexact output (fixed Ogg serial numbers, no encoder tags) so identical audio hashes identically
+    args = [
+        "-vn", "-ac", "1", "-ar", str(SPEECH_SAMPLE_RATE),
+        "-map_metadata", "-1", "-fflags", "+bitexact", "-flags:a", "+bitexact",
+    ]
+    if SPEECH_AUDIO_CODEC == "mp3":
+        return args + ["-c:a", "libmp3lame", "-b:a", SPEECH_AUDIO_BITRATE, "-f", "mp3"]
+    return args + ["-c:a", "libopus", "-b:a", SPEECH_AUDIO_BITRATE, "-application", "voip", "-f", "ogg"]
+
+
+def intermediate_encoding_args() -> List[str]:
+    """Lossless mono 16 kHz FLAC, used when audio has to be cut into segments before encoding"""
+    return ["-vn", "-ac", "1", "-ar", str(SPEECH_SAMPLE_RATE), "-c:a", "flac", "-f", "flac"]
+
+
+def speech_audio_extension() -> str:
+    return ".mp3" if SPEECH_AUDIO_CODEC == "mp3" else ".ogg"
+
+
+def is_pipe_streamable(head: bytes) -> bool:
+    """
+    Check whether a container can be decoded from a non-seekable pipe.
+    MP4/MOV files whose 'moov' index sits after the media data need seeking, so they
+    must be spooled to a file first. Anything that is not ISO base media is assumed streamable.
+    """
+    if len(head) < 8 or head[4:8] != b"ftyp":
+        return True
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack(">I4s", head[offset:offset + 8])
+        if box_type == _ISO_MOVIE_HEADER:
+            return True
+        if box_type == _ISO_MEDIA_DATA:
+            return False
+        if size == 1 and offset + 16 <= len(head):
+            size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+        if size < 8:
+            return False
+        offset += size
+    # The index was not in the head we have seen, so it is at the end of the file
+    return False
+
+
+def _drain(stream, sink: List[bytes]) -> None:
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        sink.append(chunk)
+
+
+def _feed(source: Iterable[bytes], stdin, errors: List[BaseException]) -> None:
+    try:
+        for chunk in source:
+            if chunk:
+                stdin.write(chunk)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg exited early; its exit status carries the real error
+        pass
+    except Exception as e:
+        errors.append(e)
+    finally:
+        try:
+            stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+
+def _run_ffmpeg(input_args: List[str], output_args: List[str], source: Optional[Iterable[bytes]] = None) -> Iterator[bytes]:
+    command = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error"]
+    if source is None:
+        command.append("-nostdin")
+    command += [*input_args, *output_args, "pipe:1"]
+    try:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE if source is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError as e:
+        raise AudioExtractionError(f"ffmpeg is not installed or not on PATH ({FFMPEG_BINARY})") from e
+
+    stderr_chunks: List[bytes] = []
+    feed_errors: List[BaseException] = []
+    threads = [threading.Thread(target=_drain, args=(process.stderr, stderr_chunks), daemon=True)]
+    if source is not None:
+        threads.append(threading.Thread(target=_feed, args=(source, process.stdin, feed_errors), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    finished = False
+    try:
+        for chunk in iter(lambda: process.stdout.read1(CHUNK_SIZE), b""):
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            # The consumer stopped early (e.g. upload failed); don't leave ffmpeg running
+            process.kill()
+        return_code = process.wait()
+        for thread in threads:
+            thread.join(timeout=5)
+        process.stdout.close()
+
+    if feed_errors:
+        raise AudioExtractionError(f"Reading the video failed: {feed_errors[0]}") from feed_errors[0]
+    if return_code != 0:
+        message = b"".join(stderr_chunks).decode("utf-8", errors="replace").strip()
+        raise AudioExtractionError(f"ffmpeg exited with status {return_code}: {message[-500:]}")
+
+
+def stream_speech_audio(source: Iterable[bytes], output_args: Optional[List[str]] = None) -> Iterator[bytes]:
+    """Pipe video/audio bytes through ffmpeg, yielding encoded speech audio as it is produced"""
+    return _run_ffmpeg(["-i", "pipe:0"], output_args or speech_encoding_args(), source=source)
+
+
+def stream_speech_audio_from_file(path: str, output_args: Optional[List[str]] = None) -> Iterator[bytes]:
+    """Encode speech audio from a local (seekable) media file, yielding encoded chunks"""
+    return _run_ffmpeg(["-i", path], output_args or speech_encoding_args())
+
+
+def speech_audio_from_stream(source: Iterable[bytes], output_args: Optional[List[str]] = None) -> Iterator[bytes]:
+    """
+    Encode speech audio from a streamed download.
+    Streamable containers go straight through ffmpeg's stdin; MP4/MOV files with the
+    index at the end are spooled to a temporary file first because ffmpeg must seek.
+    """
+    source = iter(source)
+    head = bytearray()
+    for chunk in source:
+        head += chunk
+        if len(head) >= HEAD_SIZE:
+            break
+    chunks = itertools.chain([bytes(head)], source)
+    if is_pipe_streamable(bytes(head)):
+        yield from stream_speech_audio(chunks, output_args)
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "source_media")
+        with open(path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        yield from stream_speech_audio_from_file(path, output_args)
+
+
+def encode_audio_to_file(source: Iterable[bytes], path: str, output_args: Optional[List[str]] = None) -> None:
+    """Encode a streamed download into a local audio file"""
+    with open(path, "wb") as f:
+        for chunk in speech_audio_from_stream(source, output_args):
+            f.write(chunk)
+
+
+def _seconds(match) -> float:
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def analyze_silences(path: str) -> Tuple[float, List[Tuple[float, float]]]:
+    """Return the duration of an audio file and its (start, end) silence intervals in seconds"""
+    command = [
+        FFMPEG_BINARY, "-hide_banner", "-nostdin", "-i", path,
+        "-af", f"silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_SECONDS}",
+        "-f", "null", "-"
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, errors="replace")
+    except FileNotFoundError as e:
+        raise AudioExtractionError(f"ffmpeg is not installed or not on PATH ({FFMPEG_BINARY})") from e
+    if result.returncode != 0:
+        raise AudioExtractionError(f"Silence detection failed: {result.stderr.strip()[-500:]}")
+    output = result.stderr
+    duration = 0.0
+    duration_match = _DURATION_RE.search(output)
+    if duration_match:
+        duration = _seconds(duration_match)
+    for progress_match in _PROGRESS_TIME_RE.finditer(output):
+        duration = max(duration, _seconds(progress_match))
+    starts = [max(0.0, float(value)) for value in _SILENCE_START_RE.findall(output)]
+    ends = [float(value) for value in _SILENCE_END_RE.findall(output)]
+    if len(ends) < len(starts):
+        ends.append(duration)
+    return duration, list(zip(starts, ends))
+
+
+def plan_segments(duration: float, silences: List[Tuple[float, float]], target_seconds: float,
+                  search_window: Optional[float] = None) -> List[Tuple[float, float]]:
+    """
+    Split [0, duration] into segments of roughly target_seconds, cutting in the middle of
+    the silence nearest to each boundary (within search_window) so no word is cut in half.
+    A recording with no audio has no segments.
+    """
+    if duration <= 0:
+        return []
+    search_window = search_window if search_window is not None else target_seconds * 0.25
+    midpoints = [(start + end) / 2 for start, end in silences]
+    cuts: List[float] = []
+    position = target_seconds
+    # Don't leave a tiny tail segment at the end
+    while position < duration - target_seconds * 0.25:
+        candidates = [point for point in midpoints if abs(point - position) <= search_window and point > (cuts[-1] if cuts else 0)]
+        cut = min(candidates, key=lambda point: abs(point - position)) if candidates else position
+        cuts.append(cut)
+        position = cut + target_seconds
+    bounds = [0.0] + cuts + [duration]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def stream_speech_audio_segment(path: str, start: float, end: float) -> Iterator[bytes]:
+    """Encode the [start, end) seconds of a local audio file as compact speech audio"""
+    return _run_ffmpeg(["-ss", f"{start:.3f}", "-i", path, "-t", f"{end - start:.3f}"], speech_encoding_args())
@@ -0,0 +1,116 @@
+"""
+Batch exports streamed as one ZIP archive.
+
+Items are rendered concurrently by a few workers; each file is written into the archive
+as soon as it is ready, in the order the renders finish, and the archive bytes go out as
+they are produced. The ZIP is written with data descriptors, so it never has to be
+seeked, and at most a few rendered files are held in memory at a time: workers wait
+while the queue of finished files is full.
+"""
+import asyncio
+import io
+import os
+import re
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Sequence, Set, Tuple
+
+BATCH_EXPORT_CONCURRENCY = int(os.getenv("BATCH_EXPORT_CONCURRENCY", "4"))
+MAX_BATCH_EXPORT_ITEMS = int(os.getenv("MAX_BATCH_EXPORT_ITEMS", "100"))
+ZIP_CHUNK_SIZE = 64 * 1024
+# Formats that are compressed already; deflating them again only costs CPU
+STORED_EXTENSIONS = {"pdf", "docx", "pptx", "png", "zip"}
+
+# (content, format) -> (buffer, MIME type, file extension), e.g. main.render_export
+Renderer = Callable[[str, str], Awaitable[Tuple[io.BytesIO, str, str]]]
+
+
+@dataclass
+class ExportItem:
+    content: str
+    export_format: str
+    filename: str
+
+
+class _Sink:
+    """Write-only target for ZipFile; what it's given is kept until drained"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+
+def member_name(filename: str, extension: str, used: Set[str]) -> str:
+    """A file name inside the archive: no directories, and a " (2)" suffix for repeats"""
+    base = re.sub(r"[\x00-\x1f]", "", os.path.basename(filename.replace("\\", "/"))).strip() or "export"
+    name = f"{base}.{extension}"
+    copy = 2
+    while name.lower() in used:
+        name = f"{base} ({copy}).{extension}"
+        copy += 1
+    used.add(name.lower())
+    return name
+
+
+async def stream_zip(items: Sequence[ExportItem], render: Renderer,
+                     concurrency: int = BATCH_EXPORT_CONCURRENCY) -> AsyncIterator[bytes]:
+    """
+    ZIP archive bytes with one file per item. An item that fails to render becomes
+    "<filename>.error.txt" with the error, so one bad item doesn't lose the others.
+    """
+    concurrency = max(1, min(concurrency, len(items)))
+    finished: "asyncio.Queue[Tuple[ExportItem, Optional[io.BytesIO], str, Optional[Exception]]]" = asyncio.Queue(maxsize=concurrency)
+    remaining = iter(items)
+
+    async def worker() -> None:
+        # Workers share one iterator, so each item is taken exactly once
+        for item in remaining:
+            try:
+                buffer, _, extension = await render(item.content, item.export_format)
+                await finished.put((item, buffer, extension, None))
+            except Exception as e:
+                print(f"Batch export of {item.filename} ({item.export_format}) failed: {e}")
+                await finished.put((item, None, "error.txt", e))
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    sink = _Sink()
+    used: Set[str] = set()
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for _ in range(len(items)):
+                item, buffer, extension, error = await finished.get()
+                if error is not None:
+                    buffer = io.BytesIO(f"Export of {item.filename} as {item.export_format} failed: {error}".encode("utf-8"))
+                info = zipfile.ZipInfo(member_name(item.filename, extension, used), date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                size = buffer.getbuffer().nbytes
+                buffer.seek(0)
+                with archive.open(info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as member:
+                    for chunk in iter(lambda: buffer.read(ZIP_CHUNK_SIZE), b""):
+                        member.write(chunk)
+                        if sink.size >= ZIP_CHUNK_SIZE:
+                            yield sink.drain()
+                buffer.close()
+                if sink.size:
+                    yield sink.drain()
+        # The central directory, written when the archive closes
+        yield sink.drain()
+    finally:
+        # Also reached when the client goes away mid-download
+        for task in workers:
+            task.cancel()
@@ -0,0 +1,254 @@
+"""
+Batch impact analysis: every page of a space modified in a time window.
+
+Pages are found with CQL (lastmodified), each is diffed from its last version before the
+window to its latest one, so every edit made in the window is covered, and analyzed per hunk (see impact_analysis.analyze_diff) on a bounded pool of workers, and
+the results are ranked by risk. Finished pages go to a JSON checkpoint, so an interrupted
+run started again with the same window only analyzes the pages that are left.
+
+    python batch_impact.py SPACE --since 2026-10-18 [--until 2026-10-19] [--output report.json]
+"""
+import asyncio
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from caching import JsonFileCache, LRUCache
+from diff_engine import diff_lines
+from impact_analysis import HUNK_ANALYSIS_CONCURRENCY, analyze_diff
+from page_history import get_page_version, version_before, version_diff
+
+BATCH_IMPACT_CONCURRENCY = int(os.getenv("BATCH_IMPACT_CONCURRENCY", "3"))
+BATCH_IMPACT_MAX_PAGES = int(os.getenv("BATCH_IMPACT_MAX_PAGES", "200"))
+BATCH_IMPACT_CHECKPOINT_DIR = os.getenv(
+    "BATCH_IMPACT_CHECKPOINT_DIR", os.path.join(tempfile.gettempdir(), "batch_impact_checkpoints")
+)
+CQL_PAGE_SIZE = 50
+CQL_DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M")
+# Space keys are letters, digits and a few symbols (personal spaces start with ~); nothing that can end a CQL string
+_SPACE_KEY_RE = re.compile(r"^[A-Za-z0-9_~-]+$")
+
+# (page id, old version, new version) -> page report; version pairs never change
+_page_reports = LRUCache(max_entries=1024)
+
+
+def risk_level(risk_score: int) -> str:
+    return "low" if risk_score <= 3 else "medium" if risk_score <= 6 else "high"
+
+
+def _cql_date(value: str) -> str:
+    """Validate a window bound; CQL accepts "yyyy-MM-dd" and "yyyy-MM-dd HH:mm" """
+    value = value.strip()
+    for date_format in CQL_DATE_FORMATS:
+        try:
+            datetime.strptime(value, date_format)
+            return value
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD or YYYY-MM-DD HH:MM")
+
+
+def _window_start(since: str) -> datetime:
+    """A window bound as an aware datetime, read as UTC"""
+    value = _cql_date(since)
+    for date_format in CQL_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date '{since}'")
+
+
+def _cql_space_key(space_key: str) -> str:
+    if not _SPACE_KEY_RE.match(space_key or ""):
+        raise ValueError(f"Invalid space key '{space_key}'")
+    return space_key
+
+
+def modified_pages(confluence, space_key: str, since: str, until: Optional[str] = None,
+                   max_pages: int = BATCH_IMPACT_MAX_PAGES) -> List[Dict[str, Any]]:
+    """Pages of a space last modified in [since, until), most recently modified first"""
+    cql = f'space = "{_cql_space_key(space_key)}" and type = page and lastmodified >= "{_cql_date(since)}"'
+    if until:
+        cql += f' and lastmodified < "{_cql_date(until)}"'
+    cql += " order by lastmodified desc"
+    pages: List[Dict[str, Any]] = []
+    start = 0
+    while len(pages) < max_pages:
+        response = confluence.cql(cql, start=start, limit=min(CQL_PAGE_SIZE, max_pages - len(pages)), expand="content.version")
+        results = response.get("results", [])
+        if not results:
+            break
+        for result in results:
+            content = result.get("content", result)
+            pages.append({
+                "id": str(content["id"]),
+                "title": content.get("title", result.get("title", "")),
+                "version": content.get("version", {}).get("number"),
+                "url": result.get("url", ""),
+            })
+        start += len(results)
+    return pages[:max_pages]
+
+
+def checkpoint_path(space_key: str, since: str, until: Optional[str] = None) -> str:
+    name = re.sub(r"[^\w.-]+", "_", f"{space_key}_{since}_{until or 'open'}")
+    return os.path.join(BATCH_IMPACT_CHECKPOINT_DIR, f"{name}.json")
+
+
+async def analyze_page(confluence, ai_model, page: Dict[str, Any],
+                       semaphore: Optional[asyncio.Semaphore] = None, since: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Diff a page's current version against its last version before since (the previous
+    version without since) and analyze the change, covering every edit in between.
+    semaphore bounds the model calls, shared with the other pages of a batch.
+    """
+    page_id = page["id"]
+    new_number = page.get("version")
+    if not new_number:
+        new_number = (await asyncio.to_thread(confluence.get_page_by_id, page_id, expand="version"))["version"]["number"]
+    if since:
+        old_number = await asyncio.to_thread(version_before, confluence, page_id, _window_start(since), new_number)
+        # CQL matched the page, so its last edit is in the window even if the clocks disagree
+        old_number = min(old_number, new_number - 1)
+    else:
+        old_number = new_number - 1
+    key = (page_id, old_number, new_number)
+    report = _page_reports.get(key)
+    if report is not None:
+        return report
+
+    new_version = await asyncio.to_thread(get_page_version, confluence, page_id, new_number)
+    if old_number < 1:
+        # A page created in the window: every line is new
+        old_lines = 0
+        diff_result = await asyncio.to_thread(diff_lines, [], new_version.content().splitlines())
+    else:
+        old_lines = len((await asyncio.to_thread(get_page_version, confluence, page_id, old_number)).content().splitlines())
+        diff_result = await asyncio.to_thread(version_diff, confluence, page_id, old_number, new_number)
+    percent_change = round(((diff_result.lines_added + diff_result.lines_removed) / (old_lines or 1)) * 100, 2)
+
+    impact_report = await analyze_diff(diff_result, ai_model, subject="a document", semaphore=semaphore)
+    risk_score = impact_report.risk_score or min(10, max(1, round(percent_change / 10)))
+    report = {
+        "page_id": page_id,
+        "title": new_version.title or page.get("title", ""),
+        "url": page.get("url", ""),
+        "from_version": old_number if old_number >= 1 else None,
+        "to_version": new_number,
+        "edits": new_number - max(old_number, 0),
+        "when": new_version.when,
+        "author": new_version.author,
+        "message": new_version.message,
+        "lines_added": diff_result.lines_added,
+        "lines_removed": diff_result.lines_removed,
+        "percentage_change": percent_change,
+        "impact_analysis": impact_report.impact_analysis,
+        "risk_factors": impact_report.risk_factors,
+        "risk_score": risk_score,
+        "risk_level": risk_level(risk_score),
+    }
+    _page_reports.set(key, report)
+    return report
+
+
+async def run_batch_impact(confluence, ai_model, space_key: str, since: str, until: Optional[str] = None,
+                           concurrency: int = BATCH_IMPACT_CONCURRENCY, max_pages: int = BATCH_IMPACT_MAX_PAGES,
+                           checkpoint: Optional[str] = None, resume: bool = True) -> Dict[str, Any]:
+    """
+    Analyze every page modified in the window and return a report ranked by risk.
+    checkpoint is a JSON file that finished pages are written to as they complete; with
+    resume, pages already in it (at the same version) are not analyzed again.
+    """
+    pages = await asyncio.to_thread(modified_pages, confluence, space_key, since, until, max_pages)
+    if checkpoint and not resume and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    finished = JsonFileCache(checkpoint) if checkpoint else None
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # One pool of model calls for all pages, so pages analyzed at once don't each get HUNK_ANALYSIS_CONCURRENCY
+    model_semaphore = asyncio.Semaphore(HUNK_ANALYSIS_CONCURRENCY)
+    reports: List[Dict[str, Any]] = []
+    failures: List[Dict[str, Any]] = []
+    resumed = 0
+
+    async def run(page: Dict[str, Any]) -> None:
+        nonlocal resumed
+        checkpoint_key = f"{page['id']}:{page.get('version')}"
+        saved = finished.get(checkpoint_key) if finished is not None and page.get("version") else None
+        if saved is not None:
+            resumed += 1
+            reports.append(saved)
+            return
+        async with semaphore:
+            try:
+                report = await analyze_page(confluence, ai_model, page, model_semaphore, since)
+            except Exception as e:
+                print(f"Batch impact analysis failed for page {page['id']} ({page.get('title')}): {e}")
+                failures.append({"page_id": page["id"], "title": page.get("title", ""), "error": str(e)})
+                return
+        reports.append(report)
+        if finished is not None:
+            await asyncio.to_thread(finished.set, f"{page['id']}:{report['to_version']}", report)
+
+    await asyncio.gather(*(run(page) for page in pages))
+
+    # Riskiest first; among equal scores, the larger change first
+    reports.sort(key=lambda report: (-report["risk_score"], -(report["lines_added"] + report["lines_removed"])))
+    counts = {level: sum(1 for report in reports if report["risk_level"] == level) for level in ("high", "medium", "low")}
+    return {
+        "space_key": space_key,
+        "since": since,
+        "until": until,
+        "pages_found": len(pages),
+        "pages_analyzed": len(reports),
+        "pages_resumed": resumed,
+        "risk_counts": counts,
+        "report": reports,
+        "failed": failures,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    import google.generativeai as genai
+    from atlassian import Confluence
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Impact analysis of every page in a space modified in a time window")
+    parser.add_argument("space_key")
+    parser.add_argument("--since", required=True, help="YYYY-MM-DD or 'YYYY-MM-DD HH:MM' (inclusive)")
+    parser.add_argument("--until", help="YYYY-MM-DD or 'YYYY-MM-DD HH:MM' (exclusive, default now)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_IMPACT_CONCURRENCY)
+    parser.add_argument("--max-pages", type=int, default=BATCH_IMPACT_MAX_PAGES)
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: one per space and window)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    genai.configure(api_key=os.getenv("GENAI_API_KEY_1"))
+    model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+    client = Confluence(
+        url=os.getenv("CONFLUENCE_BASE_URL"),
+        username=os.getenv("CONFLUENCE_USER_EMAIL"),
+        password=os.getenv("CONFLUENCE_API_KEY"),
+        timeout=10
+    )
+    result = asyncio.run(run_batch_impact(
+        client, model, args.space_key, args.since, args.until,
+        concurrency=args.concurrency, max_pages=args.max_pages,
+        checkpoint=args.checkpoint or checkpoint_path(args.space_key, args.since, args.until),
+        resume=not args.fresh,
+    ))
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"{result['pages_analyzed']} pages analyzed ({result['pages_resumed']} from checkpoint), "
+              f"{len(result['failed'])} failed; report written to {args.output}")
+    else:
+        print(output)
@@ -0,0 +1,236 @@
+"""Small in-process caches shared by the backend helpers, plus a JSON file cache that survives restarts."""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with an optional per-entry TTL (seconds).
+    With max_bytes, entries are also evicted to keep the total size (sizeof(value), len by
+    default) within that budget; a value larger than the whole budget isn't stored.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, sizeof: Callable[[Any], int] = len):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, key: Hashable) -> Any:
+        value, _, size = self._entries.pop(key)
+        self.total_bytes -= size
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, stored_at, _ = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, time.monotonic(), size)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class JsonFileCache:
+    """
+    Thread-safe string-keyed cache persisted to a JSON file, with an optional TTL (seconds).
+    Values must be JSON serializable. Expiry uses wall-clock time so it holds across restarts.
+    Reads and writes only touch memory; changes are written out by a background timer at
+    most every flush_delay seconds (and at exit), outside the lock, merged with what other
+    processes sharing the file have written since.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_entries: int = 10000,
+                 flush_delay: float = 1.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._entries: Dict[str, Any] = self._load()
+        self._removed: Set[str] = set()  # keys deleted here since the last flush, not to be merged back
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _changed(self) -> None:
+        """Schedule a flush; called with the lock held"""
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        """Write pending changes to the file now"""
+        with self._lock:
+            self._timer = None
+            if not self._dirty:
+                return
+            entries, removed = dict(self._entries), set(self._removed)
+            self._dirty = False
+            self._removed.clear()
+        with self._flush_lock, _file_lock(self.path + ".lock"):
+            # Keep entries other processes wrote since we loaded; the newer of two versions wins
+            merged = {key: entry for key, entry in self._load().items()
+                      if key not in removed and isinstance(entry, list) and len(entry) == 2 and not self._expired(entry[1])}
+            for key, entry in entries.items():
+                if key not in merged or entry[1] >= merged[key][1]:
+                    merged[key] = entry
+            if len(merged) > self.max_entries:
+                newest = sorted(merged.items(), key=lambda item: item[1][1])[-self.max_entries:]
+                merged = dict(newest)
+            self._write(merged)
+        with self._lock:
+            for key, entry in merged.items():
+                if key not in self._entries and key not in self._removed:
+                    self._entries[key] = entry
+
+    def _write(self, entries: Dict[str, Any]) -> None:
+        directory = os.path.dirname(self.path) or "."
+        tmp_path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+            tmp_path = None
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Failed to persist cache {self.path}: {e}")
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+    def _remove(self, key: str) -> Any:
+        """Delete an entry; called with the lock held"""
+        entry = self._entries.pop(key)
+        self._removed.add(key)
+        self._changed()
+        return entry
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, stored_at = entry
+            if self._expired(stored_at):
+                self._remove(key)
+                return default
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._removed.discard(key)
+            self._entries[key] = [value, time.time()]
+            # Drop expired entries, then the oldest ones (dicts keep insertion order)
+            for stale in [k for k, (_, stored_at) in self._entries.items() if self._expired(stored_at)]:
+                self._remove(stale)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._changed()
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                # Another process may have written it to the file; don't merge it back in
+                self._removed.add(key)
+                self._changed()
+                return default
+            return self._remove(key)[0]
+
+    def __contains__(self, key: str) -> bool:
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """Exclusive lock shared by processes (uvicorn workers) writing the same cache file; a no-op without fcntl"""
+    if fcntl is None:
+        yield
+        return
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        handle = open(path, "a")
+    except OSError:
+        yield
+        return
+    with handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
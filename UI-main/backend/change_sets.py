@@ -0,0 +1,249 @@
+"""
+Multi-file change sets for the direct code impact analyzer.
+
+A change set is a list of (path, old code, new code) pairs. It can be given directly,
+parsed from a unified diff / git patch, or read from two refs of a local git checkout.
+Files are diffed in parallel: in a process pool when the change set is large enough to
+pay for it, in-process otherwise.
+"""
+import os
+import re
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+from code_structure import StructuralDiff, normalize_language, normalized_code_lines, structural_diff
+from diff_engine import DiffResult, diff_lines
+
+MAX_CHANGE_SET_FILES = int(os.getenv("MAX_CHANGE_SET_FILES", "200"))
+CHANGE_SET_DIFF_WORKERS = int(os.getenv("CHANGE_SET_DIFF_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Below this many characters in total, diffing in-process beats shipping files to worker processes
+PARALLEL_DIFF_MIN_CHARS = 200_000
+GIT_BINARY = os.getenv("GIT_BINARY", "git")
+GIT_TIMEOUT = 60
+# Local checkouts that git mode may read from (os.pathsep-separated); git mode is off when unset
+GIT_REPO_ROOTS = [root for root in os.getenv("CODE_IMPACT_GIT_ROOTS", "").split(os.pathsep) if root]
+
+_EXTENSION_LANGUAGES = {
+    ".py": "python", ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".cjs": "javascript",
+    ".ts": "typescript", ".tsx": "typescript", ".java": "java",
+}
+_HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_GIT_REF_RE = re.compile(r"^[\w./@^~{}-]+$")
+
+_diff_pool: Optional[ProcessPoolExecutor] = None
+
+
+class ChangeSetError(ValueError):
+    """Raised when a patch or git change set can't be read"""
+
+
+@dataclass
+class FileChange:
+    path: str
+    old_code: str
+    new_code: str
+    status: str = "modified"  # added | deleted | modified | renamed
+    old_path: Optional[str] = None
+    language: Optional[str] = None
+
+    def resolved_language(self) -> str:
+        return normalize_language(self.language or language_for_path(self.path), self.new_code or self.old_code)
+
+
+@dataclass
+class FileDiff:
+    change: FileChange
+    diff: DiffResult
+    old_line_count: int
+    structure: Optional[StructuralDiff] = None
+    language: str = "text"
+
+    def unified(self) -> str:
+        return self.diff.unified(f"a/{self.change.old_path or self.change.path}", f"b/{self.change.path}")
+
+
+@dataclass
+class _PatchFile:
+    old_path: Optional[str] = None
+    new_path: Optional[str] = None
+    status: str = "modified"
+    old_lines: List[str] = field(default_factory=list)
+    new_lines: List[str] = field(default_factory=list)
+
+
+def language_for_path(path: str) -> Optional[str]:
+    return _EXTENSION_LANGUAGES.get(os.path.splitext(path)[1].lower())
+
+
+def _patch_path(value: str) -> Optional[str]:
+    value = value.split("\t")[0].strip()
+    if value == "/dev/null":
+        return None
+    return value[2:] if value[:2] in ("a/", "b/") else value
+
+
+def parse_patch(text: str) -> List[FileChange]:
+    """
+    Split a unified diff (plain or git format) into per-file changes.
+    A patch only carries the changed hunks, so old/new code are the hunks' two sides
+    (context plus removed / added lines), which diff back to the same changes.
+    """
+    files: List[_PatchFile] = []
+    current: Optional[_PatchFile] = None
+    old_remaining = new_remaining = 0
+    for line in text.splitlines():
+        if old_remaining > 0 or new_remaining > 0:
+            marker, content = line[:1], line[1:]
+            if marker in (" ", ""):
+                current.old_lines.append(content)
+                current.new_lines.append(content)
+                old_remaining -= 1
+                new_remaining -= 1
+            elif marker == "-":
+                current.old_lines.append(content)
+                old_remaining -= 1
+            elif marker == "+":
+                current.new_lines.append(content)
+                new_remaining -= 1
+            # "\ No newline at end of file" doesn't count
+            continue
+        if line.startswith("diff --git "):
+            current = _PatchFile()
+            files.append(current)
+            paths = re.match(r"diff --git a/(.*) b/(.*)$", line)
+            if paths:
+                current.old_path, current.new_path = paths.group(1), paths.group(2)
+        elif line.startswith("--- "):
+            # Plain unified diffs have no "diff --git" line; a new "---" after hunks starts the next file
+            if current is None or current.old_lines or current.new_lines:
+                current = _PatchFile()
+                files.append(current)
+            current.old_path = _patch_path(line[4:])
+            if current.old_path is None:
+                current.status = "added"
+        elif line.startswith("+++ ") and current is not None:
+            current.new_path = _patch_path(line[4:])
+            if current.new_path is None:
+                current.status = "deleted"
+        elif line.startswith("new file mode") and current is not None:
+            current.status = "added"
+        elif line.startswith("deleted file mode") and current is not None:
+            current.status = "deleted"
+        elif line.startswith("rename from ") and current is not None:
+            current.old_path, current.status = line[len("rename from "):], "renamed"
+        elif line.startswith("rename to ") and current is not None:
+            current.new_path = line[len("rename to "):]
+        else:
+            header = _HUNK_HEADER_RE.match(line)
+            if header and current is not None:
+                old_remaining = int(header.group(2)) if header.group(2) is not None else 1
+                new_remaining = int(header.group(4)) if header.group(4) is not None else 1
+    changes = []
+    for patch_file in files:
+        path = patch_file.new_path or patch_file.old_path
+        if not path:
+            continue
+        changes.append(FileChange(
+            path=path,
+            old_code="\n".join(patch_file.old_lines),
+            new_code="\n".join(patch_file.new_lines),
+            status=patch_file.status,
+            old_path=patch_file.old_path if patch_file.old_path != path else None,
+        ))
+    if not changes and text.strip():
+        raise ChangeSetError("No file changes found in the patch")
+    return changes
+
+
+def _git(repo_path: str, *args: str) -> bytes:
+    try:
+        result = subprocess.run([GIT_BINARY, "-C", repo_path, *args], capture_output=True, timeout=GIT_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise ChangeSetError(f"git {args[0]} failed: {e}")
+    if result.returncode != 0:
+        raise ChangeSetError(f"git {args[0]} failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+    return result.stdout
+
+
+def _allowed_repo(repo_path: str) -> str:
+    if not GIT_REPO_ROOTS:
+        raise ChangeSetError("Git change sets are disabled; set CODE_IMPACT_GIT_ROOTS to the allowed checkout directories")
+    resolved = os.path.realpath(repo_path)
+    for root in GIT_REPO_ROOTS:
+        root = os.path.realpath(root)
+        if resolved == root or resolved.startswith(root + os.sep):
+            return resolved
+    raise ChangeSetError(f"{repo_path} is not under an allowed git root")
+
+
+def git_change_set(repo_path: str, base_ref: str, head_ref: str,
+                   paths: Optional[Sequence[str]] = None) -> List[FileChange]:
+    """File changes between two refs of a local checkout (binary files are skipped)"""
+    repo_path = _allowed_repo(repo_path)
+    for ref in (base_ref, head_ref):
+        if not _GIT_REF_RE.match(ref) or ref.startswith("-"):
+            raise ChangeSetError(f"Invalid git ref: {ref}")
+    output = _git(repo_path, "diff", "--name-status", "-z", "-M", base_ref, head_ref, "--", *(paths or []))
+    fields = output.decode("utf-8", "replace").split("\0")
+    entries: List[Tuple[str, Optional[str], str]] = []  # (status, old path, new path)
+    index = 0
+    while index < len(fields) and fields[index]:
+        code = fields[index][0]
+        if code in "RC":
+            entries.append(("renamed" if code == "R" else "added", fields[index + 1], fields[index + 2]))
+            index += 3
+        else:
+            status = {"A": "added", "D": "deleted"}.get(code, "modified")
+            entries.append((status, fields[index + 1], fields[index + 1]))
+            index += 2
+    if len(entries) > MAX_CHANGE_SET_FILES:
+        raise ChangeSetError(f"{len(entries)} files changed; at most {MAX_CHANGE_SET_FILES} can be analyzed at once")
+
+    def read(ref: str, path: str) -> Optional[str]:
+        data = _git(repo_path, "show", f"{ref}:{path}")
+        return None if b"\0" in data[:8000] else data.decode("utf-8", "replace")
+
+    def load(entry: Tuple[str, Optional[str], str]) -> Optional[FileChange]:
+        status, old_path, new_path = entry
+        old_code = read(base_ref, old_path) if status != "added" else ""
+        new_code = read(head_ref, new_path) if status != "deleted" else ""
+        if old_code is None or new_code is None:
+            return None
+        return FileChange(new_path, old_code, new_code, status, old_path if old_path != new_path else None)
+
+    # git show is I/O-bound, so threads are enough
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        return [change for change in pool.map(load, entries) if change is not None]
+
+
+def diff_file(change: FileChange, structural: bool = False) -> FileDiff:
+    """Diff one file; structural mode as in the single-file analyzer, when the language supports it"""
+    language = change.resolved_language()
+    structure = None
+    if structural and change.old_code and change.new_code:
+        structure = structural_diff(change.old_code, change.new_code, language)
+    if structure is not None:
+        old_lines, new_lines = normalized_code_lines(change.old_code), normalized_code_lines(change.new_code)
+    else:
+        old_lines, new_lines = change.old_code.splitlines(), change.new_code.splitlines()
+    return FileDiff(change, diff_lines(old_lines, new_lines), len(old_lines), structure, language)
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _diff_pool
+    if _diff_pool is None:
+        _diff_pool = ProcessPoolExecutor(max_workers=CHANGE_SET_DIFF_WORKERS)
+    return _diff_pool
+
+
+def diff_change_set(changes: Sequence[FileChange], structural: bool = False) -> List[FileDiff]:
+    """Diff every file of a change set, in input order"""
+    if len(changes) > MAX_CHANGE_SET_FILES:
+        raise ChangeSetError(f"{len(changes)} files changed; at most {MAX_CHANGE_SET_FILES} can be analyzed at once")
+    total_chars = sum(len(change.old_code) + len(change.new_code) for change in changes)
+    if len(changes) < 2 or CHANGE_SET_DIFF_WORKERS < 2 or total_chars < PARALLEL_DIFF_MIN_CHARS:
+        return [diff_file(change, structural) for change in changes]
+    # Diffing is CPU-bound pure Python, so files are spread over processes rather than threads
+    return list(_pool().map(diff_file, changes, [structural] * len(changes)))
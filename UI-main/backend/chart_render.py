@@ -0,0 +1,285 @@
+"""
+Chart rendering for /create-chart.
+
+Each chart is drawn on its own matplotlib Figure with an Agg canvas, never through
+pyplot's global current-figure state, so concurrent requests can't draw into each
+other's plots and nothing is left registered with pyplot afterwards. Figures are cleared
+as soon as the image is saved. Rendering runs in a worker process, like PDF exports, so
+plotting large tables doesn't hold the event loop or the GIL. Rendered images are cached
+by (data hash, chart type, format, dpi) within a byte budget, so asking for the same chart
+again, or as slides built from a PNG of it, doesn't plot it again. chart_spec describes the
+same chart as a Chart.js config for the browser to draw, with no rendering on the server.
+
+    python chart_render.py [--charts 3000]   # load test: RSS while rendering many charts
+"""
+import asyncio
+import hashlib
+import io
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from matplotlib import rcParams
+from matplotlib.colors import to_hex
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from caching import LRUCache
+
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "2"))
+CHART_TYPES = ("Grouped Bar", "Stacked Bar", "Line", "Pie")
+CHART_FORMAT_MIME = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "svg": "image/svg+xml",
+    "pdf": "application/pdf",
+}
+# Resolution when none is asked for, and for slides when no PNG of the chart is cached yet
+DEFAULT_CHART_DPI = 100
+PPTX_DPI = 300
+MIN_CHART_DPI, MAX_CHART_DPI = 50, 600
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_MB", "64")) * 2 ** 20
+
+# (data hash, chart type, format, dpi) -> image bytes, evicted by total size
+_rendered_charts = LRUCache(max_entries=1024, max_bytes=CHART_CACHE_MAX_BYTES)
+# (data hash, chart type) -> highest dpi a PNG of that chart was rendered at, for slides to reuse
+_png_dpis = LRUCache(max_entries=1024)
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def chart_mime(image_format: str) -> str:
+    return CHART_FORMAT_MIME.get(image_format.lower(), f"image/{image_format.lower()}")
+
+
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """First column is the category; the others are made numeric and rows with no numbers dropped"""
+    df = df.copy()
+    for col in df.columns[1:]:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df.dropna(subset=df.columns[1:], how='all', inplace=True)
+    return df
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    """Hash of a DataFrame's column names and values, the data part of a rendered chart's cache key"""
+    digest = hashlib.sha256(repr([str(column) for column in df.columns]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def draw_chart(fig: Figure, df: pd.DataFrame, chart_type: str) -> None:
+    ax = fig.add_subplot()
+    if chart_type == "Grouped Bar":
+        import seaborn as sns
+
+        melted = df.melt(id_vars=[df.columns[0]], var_name="Group", value_name="Count")
+        sns.barplot(data=melted, x=melted.columns[0], y="Count", hue="Group", ax=ax)
+        ax.set_title("Grouped Bar Chart")
+    elif chart_type in ("Stacked Bar", "Line"):
+        df_plot = df.set_index(df.columns[0]).drop(columns="Total", errors="ignore")
+        if chart_type == "Stacked Bar":
+            df_plot.plot(kind='bar', stacked=True, ax=ax)
+            ax.set_title("Stacked Bar Chart")
+        else:
+            df_plot.plot(marker='o', ax=ax)
+            ax.set_title("Line Chart")
+        ax.set_ylabel("Count")
+    elif chart_type == "Pie":
+        data = df["Total"] if "Total" in df.columns else df.iloc[:, 1:].sum(axis=1)
+        ax.pie(data, labels=df[df.columns[0]], autopct="%1.1f%%", startangle=140)
+        ax.set_title("Pie Chart (Total Responses)")
+        return
+    else:
+        raise ValueError(f"Unsupported chart type '{chart_type}'; expected one of {', '.join(CHART_TYPES)}")
+    ax.tick_params(axis="x", labelrotation=45)
+
+
+def _spec_values(values) -> List[Optional[float]]:
+    # JSON has no NaN; a missing value is a gap (null) in Chart.js
+    return [None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+            for value in pd.Series(values).astype(float).tolist()]
+
+
+def chart_spec(df: pd.DataFrame, chart_type: str) -> Dict[str, Any]:
+    """
+    Chart.js configuration ({type, data, options}) for a prepared DataFrame: the same series
+    as render_chart draws, in the same colors, for the browser to render.
+    """
+    colors = [to_hex(color) for color in rcParams["axes.prop_cycle"].by_key()["color"]]
+    labels = [str(label) for label in df[df.columns[0]]]
+    options: Dict[str, Any] = {"responsive": True, "plugins": {"legend": {"position": "top"}}}
+    if chart_type == "Pie":
+        data = df["Total"] if "Total" in df.columns else df.iloc[:, 1:].sum(axis=1)
+        options["plugins"]["title"] = {"display": True, "text": "Pie Chart (Total Responses)"}
+        return {
+            "type": "pie",
+            "data": {"labels": labels, "datasets": [{
+                "label": "Total", "data": _spec_values(data),
+                "backgroundColor": [colors[index % len(colors)] for index in range(len(labels))],
+            }]},
+            "options": options,
+        }
+    if chart_type not in CHART_TYPES:
+        raise ValueError(f"Unsupported chart type '{chart_type}'; expected one of {', '.join(CHART_TYPES)}")
+    # Grouped bars show every column, like the seaborn plot; stacked bars and lines leave out the Total
+    series = df.columns[1:] if chart_type == "Grouped Bar" else [column for column in df.columns[1:] if column != "Total"]
+    datasets = []
+    for index, column in enumerate(series):
+        color = colors[index % len(colors)]
+        dataset = {"label": str(column), "data": _spec_values(df[column]), "backgroundColor": color, "borderColor": color}
+        if chart_type == "Line":
+            dataset.update({"fill": False, "pointRadius": 4, "spanGaps": False})
+        datasets.append(dataset)
+    title = {"Grouped Bar": "Grouped Bar Chart", "Stacked Bar": "Stacked Bar Chart", "Line": "Line Chart"}[chart_type]
+    stacked = chart_type == "Stacked Bar"
+    options["plugins"]["title"] = {"display": True, "text": title}
+    options["scales"] = {
+        "x": {"stacked": stacked, "ticks": {"maxRotation": 45, "minRotation": 45}},
+        "y": {"stacked": stacked, "beginAtZero": True, "title": {"display": True, "text": "Count"}},
+    }
+    return {"type": "line" if chart_type == "Line" else "bar", "data": {"labels": labels, "datasets": datasets}, "options": options}
+
+
+def render_chart(df: pd.DataFrame, chart_type: str, image_format: str = "png", dpi: int = DEFAULT_CHART_DPI) -> bytes:
+    """Chart image bytes for a prepared DataFrame (see prepare_frame)"""
+    fig = Figure(figsize=(7, 6) if chart_type == "Pie" else (10, 6))
+    FigureCanvasAgg(fig)
+    try:
+        draw_chart(fig, df, chart_type)
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=image_format.lower(), bbox_inches="tight", dpi=dpi or DEFAULT_CHART_DPI)
+        return buffer.getvalue()
+    finally:
+        # Release the artists now instead of whenever the figure is collected
+        fig.clear()
+
+
+def _warm_worker() -> None:
+    # The first seaborn/pandas plot in a process pays for the imports; do it before any request
+    import seaborn  # noqa: F401
+    from pandas.plotting import _matplotlib  # noqa: F401
+
+
+def _worker_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=CHART_RENDER_WORKERS, initializer=_warm_worker)
+    return _pool
+
+
+async def render_chart_async(df: pd.DataFrame, chart_type: str, image_format: str = "png",
+                             dpi: int = DEFAULT_CHART_DPI) -> bytes:
+    """render_chart in a worker process; in-process (off the event loop) if the pool is unavailable"""
+    global _pool
+    if CHART_RENDER_WORKERS > 0:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                _worker_pool(), render_chart, df, chart_type, image_format, dpi
+            )
+        except BrokenProcessPool:
+            print("Chart worker pool broke; rendering in-process")
+            _pool = None
+    return await asyncio.to_thread(render_chart, df, chart_type, image_format, dpi)
+
+
+async def cached_chart(df: pd.DataFrame, chart_type: str, image_format: str = "png", dpi: Optional[int] = None,
+                       data_hash: Optional[str] = None) -> bytes:
+    """render_chart_async through the rendered-chart cache; pass data_hash when it is already known"""
+    data_hash = data_hash or frame_hash(df)
+    # No dpi and the default dpi are the same image, so they share an entry
+    dpi = dpi or DEFAULT_CHART_DPI
+    image_format = image_format.lower()
+    key = (data_hash, chart_type, image_format, dpi)
+    image = _rendered_charts.get(key)
+    if image is None:
+        image = await render_chart_async(df, chart_type, image_format, dpi)
+        _rendered_charts.set(key, image)
+    if image_format == "png" and dpi > _png_dpis.get((data_hash, chart_type), 0):
+        _png_dpis.set((data_hash, chart_type), dpi)
+    return image
+
+
+async def slide_chart_png(df: pd.DataFrame, chart_type: str, dpi: Optional[int] = None,
+                          data_hash: Optional[str] = None) -> bytes:
+    """
+    PNG for a slide: at dpi when asked for, otherwise the sharpest PNG of this chart already
+    in the cache (e.g. the one just shown in the browser), rendered at PPTX_DPI only if none is
+    """
+    if dpi:
+        return await cached_chart(df, chart_type, "png", dpi, data_hash)
+    data_hash = data_hash or frame_hash(df)
+    cached_dpi = _png_dpis.get((data_hash, chart_type))
+    image = _rendered_charts.get((data_hash, chart_type, "png", cached_dpi)) if cached_dpi else None
+    if image is not None:
+        return image
+    return await cached_chart(df, chart_type, "png", PPTX_DPI, data_hash)
+
+
+if __name__ == "__main__":
+    import argparse
+    import gc
+    import time
+
+    def rss_mb() -> float:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+    parser = argparse.ArgumentParser(description="Render many charts and report resident memory along the way")
+    parser.add_argument("--charts", type=int, default=3000)
+    parser.add_argument("--every", type=int, default=250, help="Report RSS every this many charts")
+    parser.add_argument("--pyplot", action="store_true", help="Use the old pyplot approach (figures never closed)")
+    parser.add_argument("--workers", type=int, default=0, help="Also time the same charts on a pool of this many processes")
+    args = parser.parse_args()
+
+    frame = prepare_frame(pd.DataFrame({
+        "Response": ["Strongly Agree", "Agree", "Neutral", "Disagree", "Strongly Disagree"],
+        "Students": [42, 61, 23, 9, 4],
+        "Lecturers": [12, 18, 7, 3, 1],
+        "Staff": [8, 14, 9, 2, "n/a"],
+        "Total": [62, 93, 39, 14, 5],
+    }))
+
+    def render_with_pyplot(df: pd.DataFrame, chart_type: str) -> bytes:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        plt.clf()
+        plt.figure(figsize=(10, 6))
+        df.set_index(df.columns[0]).drop(columns="Total", errors="ignore").plot(kind='bar', stacked=True)
+        plt.title(chart_type)
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
+
+    render = (lambda chart_type: render_with_pyplot(frame, chart_type)) if args.pyplot \
+        else (lambda chart_type: render_chart(frame, chart_type))
+    render(CHART_TYPES[0])  # imports and font cache out of the way before the baseline
+    gc.collect()
+    baseline = rss_mb()
+    print(f"{'pyplot' if args.pyplot else 'Figure/Agg'}: baseline RSS {baseline:.0f} MB")
+    started = time.perf_counter()
+    for number in range(1, args.charts + 1):
+        render(CHART_TYPES[number % len(CHART_TYPES)])
+        if number % args.every == 0:
+            print(f"{number:6d} charts  RSS {rss_mb():6.0f} MB  (+{rss_mb() - baseline:.0f} MB)  "
+                  f"{number / (time.perf_counter() - started):.1f} charts/s")
+
+    if args.workers:
+        async def render_on_pool() -> float:
+            global CHART_RENDER_WORKERS
+            CHART_RENDER_WORKERS = args.workers
+            await render_chart_async(frame, CHART_TYPES[0])
+            pool_started = time.perf_counter()
+            await asyncio.gather(*(render_chart_async(frame, CHART_TYPES[number % len(CHART_TYPES)])
+                                   for number in range(args.charts)))
+            return time.perf_counter() - pool_started
+
+        elapsed = asyncio.run(render_on_pool())
+        print(f"{args.workers} worker processes: {args.charts} charts in {elapsed:.1f}s "
+              f"({args.charts / elapsed:.1f} charts/s)")
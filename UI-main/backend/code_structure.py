@@ -0,0 +1,337 @@
+"""
+Syntax-aware comparison of two versions of source code.
+
+Python is compared through `ast`, JavaScript/TypeScript and Java through a small
+tokenizer, so whitespace, comments, formatting and import order don't count as changes.
+The result lists added, removed and modified functions/classes and changed signatures,
+and renders a compact summary for the impact analyzer's prompts.
+
+    python code_structure.py   # regression checks
+"""
+import ast
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+TOKENIZED_LANGUAGES = {"javascript", "typescript", "java"}
+_LANGUAGE_ALIASES = {"js": "javascript", "jsx": "javascript", "ts": "typescript", "tsx": "typescript", "py": "python"}
+
+_TOKEN_RE = re.compile(
+    r"//[^\n]*|/\*.*?\*/"                                   # comments (dropped)
+    r"|\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`"  # string literals
+    r"|[A-Za-z_$][\w$]*|\d[\w.]*|=>|\S",
+    re.DOTALL,
+)
+# Tokens of one line for normalized_code_lines; comments are kept (as tokens), strings keep their spacing
+_LINE_TOKEN_RE = re.compile(
+    r"\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`"
+    r"|[A-Za-z_$][\w$]*|\d[\w.]*"
+    r"|===|!==|\*\*=|//=|>>=|<<=|=>|==|!=|<=|>=|&&|\|\||\+\+|--|[-+*/%&|^]=|->|::|\*\*|//|<<|>>|\S"
+)
+_IMPORT_LINE_RE = re.compile(r"^\s*(import|from\s+\S+\s+import|package)\b")
+_CONTROL_KEYWORDS = {
+    "if", "for", "while", "switch", "catch", "else", "do", "try", "finally", "synchronized", "return", "with"
+}
+_CLASS_KEYWORDS = {"class", "interface", "enum"}
+
+
+@dataclass(frozen=True)
+class Definition:
+    name: str
+    kind: str
+    signature: str
+    fingerprint: str
+
+
+@dataclass
+class StructuralDiff:
+    language: str
+    added: List[Definition] = field(default_factory=list)
+    removed: List[Definition] = field(default_factory=list)
+    modified: List[Definition] = field(default_factory=list)
+    signature_changes: List[Tuple[str, str, str]] = field(default_factory=list)  # (name, old, new)
+    imports_added: List[str] = field(default_factory=list)
+    imports_removed: List[str] = field(default_factory=list)
+    other_changes: bool = False
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.removed or self.modified or self.signature_changes
+                    or self.imports_added or self.imports_removed or self.other_changes)
+
+    def summary(self) -> str:
+        """Compact, prompt-sized description of the structural changes"""
+        if not self.changed:
+            return f"Structural diff ({self.language}): only formatting, comments or import order changed."
+        lines = [f"Structural diff ({self.language}):"]
+        for label, definitions in (("Added", self.added), ("Removed", self.removed)):
+            for definition in definitions:
+                lines.append(f"- {label} {definition.kind} {definition.name}: {definition.signature}")
+        for name, old_signature, new_signature in self.signature_changes:
+            lines.append(f"- Signature changed {name}: {old_signature} -> {new_signature}")
+        for definition in self.modified:
+            lines.append(f"- Body changed {definition.kind} {definition.name}")
+        for statement in self.imports_added:
+            lines.append(f"- Import added: {statement}")
+        for statement in self.imports_removed:
+            lines.append(f"- Import removed: {statement}")
+        if self.other_changes:
+            lines.append("- Module-level statements changed")
+        return "\n".join(lines)
+
+
+def normalize_language(language: Optional[str], source: str = "") -> str:
+    if language:
+        language = language.strip().lower()
+        return _LANGUAGE_ALIASES.get(language, language)
+    return detect_language(source)
+
+
+def detect_language(source: str) -> str:
+    """Best-effort language guess for code pasted without a language"""
+    if re.search(r"^\s*(def|class)\s+\w+.*:\s*$", source, re.MULTILINE) or re.search(r"^\s*from\s+\S+\s+import\b", source, re.MULTILINE):
+        return "python"
+    if re.search(r"\b(public|private|protected)\s+(static\s+)?[\w<>\[\]]+\s+\w+\s*\(", source) or "System.out" in source:
+        return "java"
+    if re.search(r"\bfunction\b|=>|\bconst\b|\blet\b|console\.", source):
+        return "javascript"
+    return "text"
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _python_structure(source: str) -> Tuple[Dict[str, Definition], Set[str], str]:
+    tree = ast.parse(source)
+    definitions: Dict[str, Definition] = {}
+    imports: Set[str] = set()
+    module_statements: List[str] = []
+
+    def unique(key: str) -> str:
+        # The same name and arguments twice in one scope (e.g. a conditional redefinition): number the repeats
+        if key not in definitions:
+            return key
+        copy = 2
+        while f"{key} #{copy}" in definitions:
+            copy += 1
+        return f"{key} #{copy}"
+
+    def visit(body, prefix: str, in_class: bool) -> List[str]:
+        """Record definitions in body; return dumps of the remaining statements"""
+        rest = []
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                name = prefix + node.name
+                arguments = ast.unparse(node.args)
+                decorators = "".join(f"@{ast.unparse(decorator)} " for decorator in node.decorator_list)
+                returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+                keyword = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+                signature = f"{decorators}{keyword} {node.name}({arguments}){returns}"
+                nested = visit(node.body, name + ".", False)
+                # Keyed with the arguments, like the tokenized languages, so a property's getter and
+                # setter or a stack of @overload variants don't overwrite each other
+                key = unique(f"{name}({arguments})")
+                definitions[key] = Definition(key, "method" if in_class else "function", signature, _hash("\n".join(nested)))
+            elif isinstance(node, ast.ClassDef):
+                name = prefix + node.name
+                bases = ", ".join(ast.unparse(base) for base in node.bases + node.keywords)
+                decorators = "".join(f"@{ast.unparse(decorator)} " for decorator in node.decorator_list)
+                signature = f"{decorators}class {node.name}({bases})" if bases else f"{decorators}class {node.name}"
+                class_statements = visit(node.body, name + ".", True)
+                key = unique(name)
+                definitions[key] = Definition(key, "class", signature, _hash("\n".join(class_statements)))
+            elif isinstance(node, (ast.Import, ast.ImportFrom)) and not prefix:
+                imports.add(ast.unparse(node))
+            else:
+                rest.append(ast.dump(node, include_attributes=False))
+        return rest
+
+    module_statements = visit(tree.body, "", False)
+    return definitions, imports, _hash("\n".join(module_statements))
+
+
+def _tokens(source: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall(source) if not token.startswith(("//", "/*"))]
+
+
+def _declaration(header: List[str]) -> Optional[Tuple[str, str, str]]:
+    """(kind, name, parameters) for the tokens preceding a '{', or None for blocks that aren't declarations"""
+    for index, token in enumerate(header):
+        if token in _CLASS_KEYWORDS and index + 1 < len(header):
+            return "class", header[index + 1], ""
+    if "(" not in header:
+        return None
+    open_index = header.index("(")
+    if open_index == 0:
+        return None
+    close_index = _closing_paren(header, open_index)
+    if close_index is None:
+        # The '{' is inside the call's arguments: a callback such as describe("x", () => { or
+        # app.get(path, function (req, res) {, not a declaration of describe or get
+        return None
+    name = header[open_index - 1]
+    if name == "function":
+        # const name = function (...) {
+        name = header[open_index - 3] if open_index >= 3 and header[open_index - 2] == "=" else ""
+    elif name in ("=", ":") and open_index >= 2:
+        # name = (...) => {   /   name: (...) => {
+        name = header[open_index - 2]
+    if not name or name in _CONTROL_KEYWORDS or not re.match(r"[A-Za-z_$]", name):
+        return None
+    # Control blocks and anonymous classes (new Foo() { ... }) are not declarations
+    if header[0] in _CONTROL_KEYWORDS or "new" in header[:open_index]:
+        return None
+    return "function", name, " ".join(header[open_index + 1:close_index])
+
+
+def _closing_paren(tokens: List[str], open_index: int) -> Optional[int]:
+    depth = 0
+    for index in range(open_index, len(tokens)):
+        if tokens[index] == "(":
+            depth += 1
+        elif tokens[index] == ")":
+            depth -= 1
+            if not depth:
+                return index
+    return None
+
+
+def _tokenized_structure(source: str) -> Tuple[Dict[str, Definition], Set[str], str]:
+    imports = {" ".join(line.split()).rstrip(";") for line in source.splitlines() if _IMPORT_LINE_RE.match(line)}
+    body_source = "\n".join(line for line in source.splitlines() if not _IMPORT_LINE_RE.match(line))
+    # Keyed by qualified name plus parameters for functions, so Java/TypeScript overloads stay apart
+    definitions: Dict[str, Definition] = {}
+    # Open blocks: (name for nested scopes or None, definition key, kind, signature, the block's own tokens)
+    stack: List[Tuple[Optional[str], str, str, str, List[str]]] = []
+    outside: List[str] = []
+    header: List[str] = []
+    for token in _tokens(body_source):
+        own = stack[-1][4] if stack else outside
+        if token == "{":
+            declaration = _declaration(header)
+            if declaration:
+                kind, name, parameters = declaration
+                # The header belongs to the definition's signature, not to the enclosing block
+                del own[len(own) - len(header):]
+                scope = ".".join(entry[0] for entry in stack if entry[0])
+                qualified = f"{scope}.{name}" if scope else name
+                if kind == "function" and stack and stack[-1][2] == "class":
+                    kind = "method"
+                key = qualified if kind == "class" else f"{qualified}({parameters})"
+                stack.append((qualified, key, kind, " ".join(header), []))
+            else:
+                stack.append((None, "", "block", "", []))
+            header = []
+            continue
+        if token == "}":
+            if stack:
+                qualified, key, kind, signature, block_tokens = stack.pop()
+                parent = stack[-1][4] if stack else outside
+                if qualified:
+                    # Nested definitions are fingerprinted on their own, so edits to a method don't mark its class
+                    definitions[key] = Definition(key, kind, signature, _hash(" ".join(block_tokens)))
+                    parent.append(qualified)
+                else:
+                    parent.extend(["{", *block_tokens, "}"])
+            header = []
+            continue
+        own.append(token)
+        if token == ";":
+            header = []
+        else:
+            header.append(token)
+    return definitions, imports, _hash(" ".join(outside))
+
+
+def structural_diff(old_source: str, new_source: str, language: Optional[str] = None) -> Optional[StructuralDiff]:
+    """
+    Compare two versions of source code by structure.
+    Returns None when the language isn't supported or either version doesn't parse.
+    """
+    language = normalize_language(language, new_source or old_source)
+    try:
+        if language == "python":
+            old_definitions, old_imports, old_module = _python_structure(old_source)
+            new_definitions, new_imports, new_module = _python_structure(new_source)
+        elif language in TOKENIZED_LANGUAGES:
+            old_definitions, old_imports, old_module = _tokenized_structure(old_source)
+            new_definitions, new_imports, new_module = _tokenized_structure(new_source)
+        else:
+            return None
+    except (SyntaxError, ValueError):
+        return None
+
+    result = StructuralDiff(language=language)
+    # Function keys include the parameters; a function whose parameters changed and that has no other
+    # unmatched overload is the same function with a new signature, not a removal and an addition
+    unmatched_old: Dict[str, List[str]] = {}
+    for key in old_definitions:
+        if key not in new_definitions:
+            unmatched_old.setdefault(key.split("(", 1)[0], []).append(key)
+    unmatched_new: Dict[str, List[str]] = {}
+    for key in new_definitions:
+        if key not in old_definitions:
+            unmatched_new.setdefault(key.split("(", 1)[0], []).append(key)
+    renamed = {
+        new_keys[0]: old_keys[0] for name, new_keys in unmatched_new.items()
+        for old_keys in [unmatched_old.get(name, [])] if len(new_keys) == 1 and len(old_keys) == 1
+    }
+    for name, definition in new_definitions.items():
+        old_definition = old_definitions.get(name) or old_definitions.get(renamed.get(name, ""))
+        if old_definition is None:
+            result.added.append(definition)
+            continue
+        if old_definition.signature != definition.signature:
+            result.signature_changes.append((name, old_definition.signature, definition.signature))
+        if old_definition.fingerprint != definition.fingerprint:
+            result.modified.append(definition)
+    matched_old = set(renamed.values())
+    result.removed = [definition for name, definition in old_definitions.items()
+                      if name not in new_definitions and name not in matched_old]
+    result.imports_added = sorted(new_imports - old_imports)
+    result.imports_removed = sorted(old_imports - new_imports)
+    result.other_changes = old_module != new_module
+    return result
+
+
+def normalized_code_lines(source: str) -> List[str]:
+    """
+    Each line as its tokens separated by single spaces, blank and import lines dropped, for a
+    formatting-insensitive line diff: "a+b" and "a + b" are the same line
+    """
+    return [" ".join(_LINE_TOKEN_RE.findall(line)) for line in source.splitlines()
+            if line.strip() and not _IMPORT_LINE_RE.match(line)]
+
+
+if __name__ == "__main__":
+    # A property's getter and setter share a name; editing either is a real change
+    properties = (
+        "class T:\n"
+        "    @property\n"
+        "    def x(self):\n"
+        "        return self._x\n\n"
+        "    @x.setter\n"
+        "    def x(self, value):\n"
+        "        self._x = value\n"
+    )
+    for before, after, changed in (("return self._x", "return self._x * 2", "T.x(self)"),
+                                   ("self._x = value", "self._x = int(value)", "T.x(self, value)")):
+        diff = structural_diff(properties, properties.replace(before, after), "python")
+        assert [definition.name for definition in diff.modified] == [changed], diff.summary()
+
+    # Java overloads are kept apart
+    overloads = "class A { int foo(int x) { return x + 1; } int foo(String s) { return s.length(); } }"
+    diff = structural_diff(overloads, overloads.replace("x + 1", "x * 100"), "java")
+    assert [definition.name for definition in diff.modified] == ["A.foo(int x)"], diff.summary()
+
+    # Test callbacks are blocks, not functions named describe/it
+    spec = 'describe("x", () => {\n  it("a", () => { expect(1).toBe(1); });\n  it("b", () => { expect(2).toBe(2); });\n});\n'
+    diff = structural_diff(spec, spec.replace("toBe(2)", "toBe(3)"), "typescript")
+    assert diff.changed and not diff.added and not diff.modified, diff.summary()
+
+    # Formatting alone is not a change, in structure or in the normalized lines
+    assert not structural_diff("const y = a+b;", "const y = a + b; // sum", "javascript").changed
+    assert normalized_code_lines("x=a+b") == normalized_code_lines("x = a + b")
+    print("code_structure checks passed")
@@ -0,0 +1,334 @@
+"""
+Export formats rendered from one parsed document.
+
+Content is parsed into markdown_document blocks once (cached by content hash) and every
+format is emitted from those blocks: DOCX with real headings, list styles and tables,
+slides that paginate on headings and when a slide fills up, CSV with the document's
+tables as rows and columns between single-cell rows of text, and escaped, structured
+HTML. PDF comes from pdf_export.
+"""
+import csv
+import html
+import io
+import math
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from docx import Document
+from docx.shared import Pt
+from pptx import Presentation
+from pptx.util import Inches, Pt as SlidePt
+
+from markdown_document import Block, inline_runs, parse_document, plain_text
+from pdf_export import render_pdf
+
+EMPTY_DOCUMENT = "No content to export"
+MONO_FONT = "Consolas"
+
+# Slide layout (the default template is 10 x 7.5 in)
+SLIDE_BODY_SIZE = 16
+SLIDE_CODE_SIZE = 12
+SLIDE_BODY_LINES = 16  # 16pt lines that fit under a slide title
+SLIDE_LINE_CHARS = 80  # characters per 16pt line across the text box
+SLIDE_TABLE_ROWS = 10  # body rows per table slide; the header repeats on each
+_TITLE_ONLY_LAYOUT = 5
+_BLANK_LAYOUT = 6
+_TITLE_LAYOUT = 0
+
+_HTML_STYLE = (
+    "body{font-family:-apple-system,Segoe UI,Helvetica,Arial,sans-serif;max-width:60em;margin:2em auto;"
+    "padding:0 1em;line-height:1.5;color:#222}pre{background:#f3f3f3;padding:.75em;overflow-x:auto}"
+    "code{font-family:Consolas,monospace}table{border-collapse:collapse;margin:1em 0}"
+    "th,td{border:1px solid #bbb;padding:.3em .6em;text-align:left}th{background:#e6ecf5}"
+)
+
+
+def _document(blocks: List[Block]) -> List[Block]:
+    return blocks if any(block.kind != "blank" for block in blocks) else parse_document(EMPTY_DOCUMENT)
+
+
+def _table_shape(rows: List[List[str]]) -> List[List[str]]:
+    columns = max(len(row) for row in rows)
+    return [row + [""] * (columns - len(row)) for row in rows]
+
+
+# DOCX
+
+def _docx_runs(paragraph, text: str, bold: bool = False) -> None:
+    for style, run_text in inline_runs(text):
+        run = paragraph.add_run(run_text)
+        run.bold = bold or style == "B"
+        run.italic = style == "I"
+        if style == "mono":
+            run.font.name = MONO_FONT
+
+
+def render_docx(blocks: List[Block]) -> bytes:
+    doc = Document()
+    for block in _document(blocks):
+        if block.kind == "heading":
+            _docx_runs(doc.add_heading(level=min(block.level, 9)), block.text)
+        elif block.kind == "paragraph":
+            _docx_runs(doc.add_paragraph(), block.text)
+        elif block.kind == "item":
+            # The default template has three levels of each list style
+            style = "List Number" if block.ordered else "List Bullet"
+            if block.level:
+                style += f" {min(block.level, 2) + 1}"
+            _docx_runs(doc.add_paragraph(style=style), block.text)
+        elif block.kind == "code":
+            run = doc.add_paragraph().add_run()
+            run.font.name = MONO_FONT
+            run.font.size = Pt(9)
+            for number, line in enumerate(block.lines):
+                if number:
+                    run.add_break()
+                run.add_text(line)
+        elif block.kind == "table":
+            rows = _table_shape(block.rows)
+            table = doc.add_table(rows=len(rows), cols=len(rows[0]))
+            table.style = "Table Grid"
+            for number, (row, cells) in enumerate(zip(table.rows, rows)):
+                for cell, text in zip(row.cells, cells):
+                    _docx_runs(cell.paragraphs[0], text, bold=number == 0)
+        elif block.kind == "rule":
+            doc.add_paragraph()
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+# PPTX
+
+class _Deck:
+    """Adds slides as content comes in; a slide ends at a section heading or when it is full"""
+
+    def __init__(self):
+        self.prs = Presentation()
+        self.title = ""
+        self.section_slides = 0  # slides in the current section so far; later ones are "(cont.)"
+        self.frame = None  # text box of the current slide; None starts a new slide for the next content
+        self.fresh = False  # the text box still has only its initial empty paragraph
+        self.used = 0.0  # body lines used on the current slide
+
+    def new_slide(self):
+        title = f"{self.title} (cont.)" if self.title and self.section_slides else self.title
+        self.section_slides += 1
+        if title:
+            slide = self.prs.slides.add_slide(self.prs.slide_layouts[_TITLE_ONLY_LAYOUT])
+            slide.shapes.title.text = title
+            slide.shapes.title.text_frame.paragraphs[0].font.size = SlidePt(32)
+            return slide, Inches(1.5)
+        return self.prs.slides.add_slide(self.prs.slide_layouts[_BLANK_LAYOUT]), Inches(0.5)
+
+    def start(self) -> None:
+        slide, top = self.new_slide()
+        box = slide.shapes.add_textbox(Inches(0.5), top, Inches(9), Inches(7) - top)
+        self.frame = box.text_frame
+        self.frame.word_wrap = True
+        self.fresh = True
+        self.used = 0.0
+
+    def section(self, title: str) -> None:
+        self.title = title
+        self.section_slides = 0
+        self.start()
+
+    def reserve(self, lines: float, keep: float = 0.0) -> None:
+        """Make room for lines of body text (and keep more after them), on a new slide when this one is full"""
+        if self.frame is None or (self.used and self.used + lines + keep > SLIDE_BODY_LINES):
+            self.start()
+        self.used += lines
+
+    def paragraph(self, runs: List[Tuple[str, str]], size: int, prefix: str = "", keep: float = 0.0) -> None:
+        characters = len(prefix) + sum(len(run) for _, run in runs)
+        lines = max(1, math.ceil(characters * size / (SLIDE_LINE_CHARS * SLIDE_BODY_SIZE))) * size / SLIDE_BODY_SIZE
+        self.reserve(lines, keep)
+        if self.fresh:
+            paragraph, self.fresh = self.frame.paragraphs[0], False
+        else:
+            paragraph = self.frame.add_paragraph()
+        for style, run_text in ([("", prefix)] if prefix else []) + runs:
+            run = paragraph.add_run()
+            run.text = run_text
+            run.font.size = SlidePt(size)
+            run.font.bold = style == "B"
+            run.font.italic = style == "I"
+            if style == "mono":
+                run.font.name = MONO_FONT
+
+    def table(self, rows: List[List[str]]) -> None:
+        rows = _table_shape(rows)
+        header, body = rows[0], rows[1:] or [[""] * len(rows[0])]
+        for start in range(0, len(body), SLIDE_TABLE_ROWS):
+            chunk = [header] + body[start:start + SLIDE_TABLE_ROWS]
+            slide, top = self.new_slide()
+            shape = slide.shapes.add_table(len(chunk), len(header), Inches(0.5), top, Inches(9), Inches(0.4) * len(chunk))
+            for row_cells, values in zip(shape.table.rows, chunk):
+                for cell, value in zip(row_cells.cells, values):
+                    cell.text = plain_text(value)
+                    for paragraph in cell.text_frame.paragraphs:
+                        paragraph.font.size = SlidePt(12)
+        # What follows the table goes on a slide of its own
+        self.frame = None
+
+
+def _split_runs(runs: List[Tuple[str, str]], limit: int) -> List[List[Tuple[str, str]]]:
+    """Runs cut at word boundaries into pieces of about limit characters (a paragraph too long for one slide)"""
+    pieces: List[List[Tuple[str, str]]] = [[]]
+    size = 0
+    for style, text in runs:
+        for word in re.findall(r"\S+\s*|\s+", text):
+            if size + len(word) > limit and size:
+                pieces.append([])
+                size = 0
+            piece = pieces[-1]
+            if piece and piece[-1][0] == style:
+                piece[-1] = (style, piece[-1][1] + word)
+            else:
+                piece.append((style, word))
+            size += len(word)
+    return pieces
+
+
+def render_pptx(blocks: List[Block]) -> bytes:
+    deck = _Deck()
+    blocks = [block for block in _document(blocks) if block.kind != "blank"]
+    start = 0
+    if blocks[0].kind == "heading" and blocks[0].level == 1:
+        # A leading top-level heading becomes the title slide, with a short paragraph after it as the subtitle
+        slide = deck.prs.slides.add_slide(deck.prs.slide_layouts[_TITLE_LAYOUT])
+        slide.shapes.title.text = deck.title = plain_text(blocks[0].text)
+        subtitle = slide.placeholders[1]
+        if len(blocks) > 1 and blocks[1].kind == "paragraph" and len(blocks[1].text) <= 200:
+            subtitle.text = plain_text(blocks[1].text)
+            start = 2
+        else:
+            subtitle.element.getparent().remove(subtitle.element)
+            start = 1
+    for block in blocks[start:]:
+        if block.kind == "heading" and block.level <= 2:
+            deck.section(plain_text(block.text))
+        elif block.kind == "heading":
+            # Keep a sub-heading with at least two lines of what follows
+            deck.paragraph([("B", plain_text(block.text))], SLIDE_BODY_SIZE + 2, keep=2)
+        elif block.kind == "paragraph":
+            for runs in _split_runs(inline_runs(block.text), SLIDE_BODY_LINES * SLIDE_LINE_CHARS // 2):
+                deck.paragraph(runs, SLIDE_BODY_SIZE)
+        elif block.kind == "item":
+            indent = "    " * min(block.level, 4)
+            deck.paragraph(inline_runs(block.text), SLIDE_BODY_SIZE, prefix=f"{indent}{block.marker} ")
+        elif block.kind == "code":
+            for line in block.lines or [""]:
+                deck.paragraph([("mono", line)], SLIDE_CODE_SIZE)
+        elif block.kind == "table":
+            deck.table(block.rows)
+        elif block.kind == "rule":
+            deck.frame = None
+    buffer = io.BytesIO()
+    deck.prs.save(buffer)
+    return buffer.getvalue()
+
+
+# CSV
+
+def render_csv(blocks: List[Block]) -> bytes:
+    """
+    One row per block in document order: tables keep their rows and columns, set off by a blank
+    row, and headings, paragraphs, list items and code lines are single-cell rows
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    previous = None  # kind of the last block written
+    for block in _document(blocks):
+        if block.kind == "table":
+            if previous is not None:
+                writer.writerow([])
+            writer.writerows([plain_text(cell) for cell in row] for row in _table_shape(block.rows))
+        elif block.kind in ("heading", "paragraph", "item", "code"):
+            if previous == "table":
+                writer.writerow([])
+            if block.kind == "code":
+                writer.writerows([line] for line in block.lines)
+            else:
+                writer.writerow([plain_text(block.text)])
+        else:
+            continue
+        previous = block.kind
+    return output.getvalue().encode()
+
+
+# HTML
+
+def _html_inline(text: str) -> str:
+    parts = []
+    for style, run in inline_runs(text):
+        run = html.escape(run)
+        parts.append({"B": "<strong>{}</strong>", "I": "<em>{}</em>", "mono": "<code>{}</code>"}.get(style, "{}").format(run))
+    return "".join(parts)
+
+
+def render_html(blocks: List[Block]) -> bytes:
+    blocks = _document(blocks)
+    title = next((plain_text(block.text) for block in blocks if block.kind == "heading"), "Export")
+    parts: List[str] = []
+    lists: List[str] = []  # open list tags, outermost first
+
+    def close_lists(depth: int = 0) -> None:
+        while len(lists) > depth:
+            parts.append(f"</li></{lists.pop()}>")
+
+    for block in blocks:
+        if block.kind == "item":
+            tag = "ol" if block.ordered else "ul"
+            depth = min(block.level, len(lists))  # a list can't skip nesting levels
+            close_lists(depth + 1)
+            if len(lists) == depth + 1 and lists[-1] != tag:
+                close_lists(depth)
+            if len(lists) == depth + 1:
+                parts.append("</li><li>")
+            else:
+                parts.append(f"<{tag}><li>")
+                lists.append(tag)
+            parts.append(_html_inline(block.text))
+            continue
+        if block.kind == "blank":
+            # Blank lines between list items don't end the list
+            continue
+        close_lists()
+        if block.kind == "heading":
+            level = min(block.level, 6)
+            parts.append(f"<h{level}>{_html_inline(block.text)}</h{level}>")
+        elif block.kind == "paragraph":
+            parts.append(f"<p>{_html_inline(block.text)}</p>")
+        elif block.kind == "code":
+            code = html.escape("\n".join(block.lines))
+            parts.append(f"<pre><code>{code}</code></pre>")
+        elif block.kind == "table":
+            rows = _table_shape(block.rows)
+            head = "".join(f"<th>{_html_inline(cell)}</th>" for cell in rows[0])
+            body = "".join("<tr>" + "".join(f"<td>{_html_inline(cell)}</td>" for cell in row) + "</tr>" for row in rows[1:])
+            parts.append(f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>")
+        elif block.kind == "rule":
+            parts.append("<hr>")
+    close_lists()
+    document = (
+        f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title>"
+        f"<style>{_HTML_STYLE}</style></head>\n<body>\n" + "\n".join(parts) + "\n</body></html>\n"
+    )
+    return document.encode("utf-8")
+
+
+# Export format -> renderer of parsed blocks
+RENDERERS: Dict[str, Callable[[List[Block]], bytes]] = {
+    "pdf": render_pdf,
+    "docx": render_docx,
+    "pptx": render_pptx,
+    "csv": render_csv,
+    "html": render_html,
+}
+
+
+def export_document(text: str, export_format: str, blocks: Optional[List[Block]] = None) -> bytes:
+    """Render text in one of RENDERERS' formats, parsing it only if it hasn't been parsed before"""
+    return RENDERERS[export_format](blocks if blocks is not None else parse_document(text))
@@ -0,0 +1,201 @@
+"""
+Per-hunk impact analysis for large diffs.
+
+Instead of truncating a diff to fit one prompt, hunks are packed into groups that fit a
+token budget and every group is analyzed concurrently. Per-group impact notes, risk
+factors and scores are merged into the final report. Group results are cached by the
+hash of their text, so re-running after a small edit only re-analyzes changed hunks.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from caching import LRUCache
+from diff_engine import DiffResult
+
+# Rough budget per analysis prompt; ~4 characters per token for code and prose
+HUNK_TOKEN_BUDGET = int(os.getenv("HUNK_TOKEN_BUDGET", "3000"))
+CHARS_PER_TOKEN = 4
+HUNK_ANALYSIS_CONCURRENCY = int(os.getenv("HUNK_ANALYSIS_CONCURRENCY", "4"))
+# On average a group is closed after this many hunks, independent of the budget
+HUNK_GROUP_BOUNDARY = 8
+SEVERITY_ORDER = {"High": 0, "Medium": 1, "Low": 2}
+
+_hunk_analyses = LRUCache(max_entries=2048)
+
+
+@dataclass
+class HunkGroupAnalysis:
+    headers: List[str]
+    impact: str
+    risks: List[Tuple[str, str]] = field(default_factory=list)  # (severity, description)
+    risk_score: Optional[int] = None
+
+
+@dataclass
+class ImpactReport:
+    impact_analysis: str
+    risk_factors: List[str]
+    risk_score: Optional[int]
+    groups: List[HunkGroupAnalysis]
+    # Compact per-group findings, usable as prompt context in place of a truncated diff
+    digest: str
+
+
+def clean_prompt_text(text: str) -> str:
+    text = re.sub(r'<[^>]+>', '', text)
+    return re.sub(r'[^\x00-\x7F]+', '', text)
+
+
+def group_hunks(diff_result: DiffResult, budget_chars: int) -> List[Tuple[List[str], str]]:
+    """
+    Pack consecutive hunks into (headers, text) groups of at most budget_chars; oversized hunks are split.
+    Groups also end after hunks whose content hash hits a boundary, which keeps grouping stable across edits.
+    """
+    groups: List[Tuple[List[str], str]] = []
+    headers: List[str] = []
+    parts: List[str] = []
+    size = 0
+
+    def flush():
+        nonlocal headers, parts, size
+        if parts:
+            groups.append((headers, "\n".join(parts)))
+        headers, parts, size = [], [], 0
+
+    for hunk in diff_result.hunks:
+        lines = [clean_prompt_text(line) for line in diff_result.hunk_lines(hunk)]
+        text = "\n".join([hunk.header] + lines)
+        if size + len(text) > budget_chars:
+            flush()
+        if len(text) <= budget_chars:
+            headers.append(hunk.header)
+            parts.append(text)
+            size += len(text) + 1
+            # Content-defined group ends: an edit only regroups hunks up to the next boundary,
+            # so the rest of the groups (and their cache entries) stay the same
+            if zlib.crc32("\n".join(lines).encode("utf-8")) % HUNK_GROUP_BOUNDARY == 0:
+                flush()
+            continue
+        # A single hunk larger than the budget goes out in pieces under the same header
+        piece: List[str] = []
+        piece_size = len(hunk.header)
+        for line in lines:
+            if piece and piece_size + len(line) + 1 > budget_chars:
+                groups.append(([hunk.header], "\n".join([hunk.header] + piece)))
+                piece, piece_size = [], len(hunk.header)
+            piece.append(line[:budget_chars])
+            piece_size += len(line) + 1
+        if piece:
+            groups.append(([hunk.header], "\n".join([hunk.header] + piece)))
+    flush()
+    return groups
+
+
+def _parse_json_response(text: str) -> Dict[str, Any]:
+    cleaned = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    try:
+        result = json.loads(cleaned)
+        return result if isinstance(result, dict) else {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def _normalize_risks(raw_risks: Any) -> List[Tuple[str, str]]:
+    risks = []
+    for risk in raw_risks if isinstance(raw_risks, list) else []:
+        if isinstance(risk, dict):
+            description = str(risk.get("description", "")).strip()
+            severity = str(risk.get("severity", "Medium")).strip().capitalize()
+        else:
+            description, severity = str(risk).strip(), "Medium"
+        if description:
+            risks.append((severity if severity in SEVERITY_ORDER else "Medium", description))
+    return risks
+
+
+async def _analyze_group(ai_model, subject: str, headers: List[str], text: str,
+                         semaphore: asyncio.Semaphore, context: str = "") -> HunkGroupAnalysis:
+    # Hunk headers are left out of the key so edits elsewhere that shift line numbers still hit the cache
+    body = "\n".join(line for line in text.splitlines() if not line.startswith("@@ "))
+    key = hashlib.sha256(f"{subject}\n{body}".encode("utf-8")).hexdigest()
+    cached = _hunk_analyses.get(key)
+    if cached is not None:
+        return HunkGroupAnalysis(headers, cached.impact, cached.risks, cached.risk_score)
+
+    prompt = (
+        f"You are reviewing part of a diff between two versions of {subject}.\n"
+        "Return ONLY a JSON object with these keys:\n"
+        "  \"impact\": 2-4 sentences on what changed in this part and why it matters,\n"
+        "  \"risks\": a list of {\"description\": one line, \"severity\": \"Low\" | \"Medium\" | \"High\"} for risks "
+        "introduced by these changes (breaking or incompatible changes, broken or removed validation, auth checks, "
+        "logical regressions, removed error handling, performance, security, maintainability); empty if none,\n"
+        "  \"risk_score\": an integer from 1 (harmless) to 10 (very risky).\n\n"
+        + (f"Overview of the whole change:\n{context}\n\n" if context else "")
+        + f"Diff part:\n{text}"
+    )
+    async with semaphore:
+        response = await ai_model.generate_content_async(prompt)
+    result = _parse_json_response(response.text)
+    if not result:
+        result = {"impact": response.text.strip()}
+    try:
+        risk_score = min(10, max(1, int(result.get("risk_score"))))
+    except (TypeError, ValueError):
+        risk_score = None
+    analysis = HunkGroupAnalysis(headers, str(result.get("impact", "")).strip(), _normalize_risks(result.get("risks")), risk_score)
+    _hunk_analyses.set(key, analysis)
+    return analysis
+
+
+async def analyze_diff(diff_result: DiffResult, ai_model, subject: str = "a document",
+                       token_budget: int = HUNK_TOKEN_BUDGET,
+                       concurrency: int = HUNK_ANALYSIS_CONCURRENCY, context: str = "",
+                       semaphore: Optional[asyncio.Semaphore] = None) -> ImpactReport:
+    """
+    Analyze every hunk of a diff within a per-prompt token budget and merge the results.
+    subject describes what was diffed, e.g. "a document" or "code"; context is a short
+    overview of the whole change (e.g. a structural summary) given with every hunk group.
+    It is not part of the cache key, so cached groups survive edits elsewhere in the change.
+    Pass a shared semaphore to bound model calls across several diffs analyzed at once.
+    """
+    groups = group_hunks(diff_result, token_budget * CHARS_PER_TOKEN)
+    if not groups:
+        return ImpactReport("No changes were found between the two versions.", [], None, [], "")
+    semaphore = semaphore or asyncio.Semaphore(max(1, concurrency))
+    analyses = await asyncio.gather(*(_analyze_group(ai_model, subject, headers, text, semaphore, context) for headers, text in groups))
+
+    # Risk factors from every group, most severe first, without duplicates
+    seen = set()
+    ranked_risks = []
+    for analysis in analyses:
+        for severity, description in analysis.risks:
+            if description.lower() not in seen:
+                seen.add(description.lower())
+                ranked_risks.append((severity, description))
+    ranked_risks.sort(key=lambda risk: SEVERITY_ORDER[risk[0]])
+    risk_factors = [f"{description} ({severity})" for severity, description in ranked_risks]
+    scores = [analysis.risk_score for analysis in analyses if analysis.risk_score is not None]
+
+    digest = "\n\n".join(
+        f"{' '.join(analysis.headers)}\n{analysis.impact}"
+        + "".join(f"\n- [{severity}] {description}" for severity, description in analysis.risks)
+        for analysis in analyses
+    )
+    if len(analyses) == 1:
+        impact_analysis = analyses[0].impact
+    else:
+        reduce_prompt = (
+            f"Write 2 paragraphs summarizing the overall impact of the following changes between two versions of {subject}.\n"
+            "They are notes on consecutive parts of one diff.\n\n"
+            "Cover only:\n- What was changed\n- Which parts are affected\n- Why this matters\n\n"
+            f"Keep it within 20 sentences.\n\nNotes:\n{digest}"
+        )
+        async with semaphore:
+            impact_analysis = (await ai_model.generate_content_async(reduce_prompt)).text.strip()
+    return ImpactReport(impact_analysis, risk_factors, max(scores) if scores else None, list(analyses), digest)
@@ -1,15 +1,18 @@
 import os
 import io
+import asyncio
 import re
 import csv
 import json
-import time
+import hashlib
+import hmac
 import traceback
 import warnings
 import requests
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from fpdf import FPDF
 from docx import Document
@@ -18,13 +21,40 @@ from pptx.util import Inches
 from dotenv import load_dotenv
 from atlassian import Confluence
 import google.generativeai as genai
-from bs4 import BeautifulSoup
 from io import BytesIO
-import difflib
+from urllib.parse import quote as url_quote
 import base64
 from datetime import datetime
 import PyPDF2
 import tempfile
+from batch_export import BATCH_EXPORT_CONCURRENCY, MAX_BATCH_EXPORT_ITEMS, ExportItem, stream_zip
+from batch_impact import BATCH_IMPACT_CONCURRENCY, BATCH_IMPACT_MAX_PAGES, checkpoint_path, run_batch_impact
+from caching import LRUCache
+from chart_render import (
+    CHART_TYPES, MAX_CHART_DPI, MIN_CHART_DPI, cached_chart, chart_mime, chart_spec, frame_hash, prepare_frame,
+    slide_chart_png
+)
+from change_sets import ChangeSetError, FileChange, diff_change_set, git_change_set, parse_patch
+from code_structure import normalize_language, normalized_code_lines, structural_diff
+from diff_engine import diff_lines
+from export_pipeline import export_document
+from impact_analysis import CHARS_PER_TOKEN, HUNK_ANALYSIS_CONCURRENCY, HUNK_TOKEN_BUDGET, analyze_diff, clean_prompt_text
+from markdown_document import parse_document
+from page_history import get_page_version, latest_version_number, version_diff, version_history
+from pdf_export import render_pdf, render_pdf_async
+from risk_rules import MAX_OCCURRENCES_PER_RULE, RULES, find_risks, occurrence, search_query
+from stackoverflow import prewarm as prewarm_stack_overflow, search_many
+from storage_parser import ParsedPage, parse_page
+from audio_pipeline import (
+    AudioExtractionError, CHUNK_SIZE, encode_audio_to_file, intermediate_encoding_args, speech_audio_from_stream
+)
+from transcript_index import get_transcript_index
+from transcript_processing import format_range, format_timestamp, summarize_transcript
+from transcription import (
+    WEBHOOK_SECRET_HEADER, TranscriptionError, find_cached_transcript, notify_transcript_webhook,
+    remember_source_audio, source_audio_hash, spool_audio, transcribe_audio_file, transcribe_in_segments,
+    webhook_secret
+)
 
 # Load environment variables
 load_dotenv()
@@ -44,8 +74,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the browser read the filename of streamed downloads
+    expose_headers=["Content-Disposition"],
 )
 
+@app.on_event("startup")
+async def prewarm_stack_overflow_cache():
+    # Opt-in: fetch every risk rule's Stack Overflow query once, in the background, so the
+    # first impact analyses are served from cache
+    if os.getenv("STACK_OVERFLOW_PREWARM", "").lower() in ("1", "true", "yes"):
+        asyncio.get_running_loop().run_in_executor(None, prewarm_stack_overflow, [search_query(rule) for rule in RULES])
+
 # Get API key from environment
 GEMINI_API_KEY = os.getenv("GENAI_API_KEY_1") or os.getenv("GENAI_API_KEY_2")
 if not GEMINI_API_KEY:
@@ -54,6 +93,41 @@ if not GEMINI_API_KEY:
 # Configure Gemini AI
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Attachment types we can extract text from, and the bounds applied to large files
+SUPPORTED_ATTACHMENT_EXTENSIONS = [
+    '.pdf', '.docx', '.doc', '.txt', '.md', '.markdown',
+    '.xlsx', '.xlsm', '.pptx', '.csv', '.html', '.htm'
+]
+MAX_SPREADSHEET_ROWS = int(os.getenv("ATTACHMENT_MAX_ROWS", "2000"))
+MAX_SPREADSHEET_COLUMNS = int(os.getenv("ATTACHMENT_MAX_COLUMNS", "50"))
+MAX_PRESENTATION_SLIDES = int(os.getenv("ATTACHMENT_MAX_SLIDES", "200"))
+
+# Extracted attachment text, keyed by download URL (Confluence URLs carry the attachment version)
+_attachment_text_cache = LRUCache(max_entries=128)
+
+# Attachment catalogs keyed by the page's first batch of attachments (ids, versions, sizes), so an
+# upload or a new attachment version builds a new one; attachment listings are paged this many at a time
+ATTACHMENT_PAGE_SIZE = 100
+# Seconds a first batch embedded in a page fetch is trusted, and a catalog that spans several batches kept
+ATTACHMENT_LISTING_TTL = float(os.getenv("ATTACHMENT_LISTING_TTL", "30"))
+_attachment_catalogs = LRUCache(max_entries=256)
+_paged_attachment_catalogs = LRUCache(max_entries=64, ttl=ATTACHMENT_LISTING_TTL)
+_embedded_attachment_listings = LRUCache(max_entries=256, ttl=ATTACHMENT_LISTING_TTL)
+
+# Audio/video attachments the video summarizer can transcribe, and how many run at once across all requests
+MEDIA_ATTACHMENT_EXTENSIONS = ['.mp4', '.mov', '.webm', '.mkv', '.m4a', '.mp3', '.wav']
+MEDIA_CONCURRENCY = int(os.getenv("VIDEO_MEDIA_CONCURRENCY", "3"))
+_media_semaphore = asyncio.Semaphore(MEDIA_CONCURRENCY)
+# Transcript passages sent to Gemini for a video question
+TRANSCRIPT_QA_PASSAGES = int(os.getenv("TRANSCRIPT_QA_PASSAGES", "6"))
+
+# Chart data per source (Excel attachment URL, which carries the attachment version, or a hash of the
+# HTML table / image): the prepared DataFrame and its hash, so charting it again skips the download and parse
+_chart_sources = LRUCache(max_entries=64)
+
+# Consecutive-version summaries returned by the impact analyzer's version-history mode
+MAX_VERSION_HISTORY_STEPS = int(os.getenv("MAX_VERSION_HISTORY_STEPS", "20"))
+
 # Pydantic models for request/response
 class SearchRequest(BaseModel):
     space_key: str
@@ -65,6 +139,8 @@ class VideoRequest(BaseModel):
     space_key: str
     page_title: str
     question: Optional[str] = None
+    segmented: Optional[bool] = False  # Split long recordings on silences and transcribe segments concurrently
+    all_media: Optional[bool] = False  # Summarize every audio/video attachment on the page
 
 class CodeRequest(BaseModel):
     space_key: str
@@ -74,15 +150,43 @@ class CodeRequest(BaseModel):
 
 class ImpactRequest(BaseModel):
     space_key: str
-    old_page_title: str
-    new_page_title: str
+    old_page_title: Optional[str] = None
+    new_page_title: Optional[str] = None
+    # Version-history mode: compare two versions of one page instead of two pages
+    page_title: Optional[str] = None
+    old_version: Optional[int] = None  # Defaults to new_version - history_depth
+    new_version: Optional[int] = None  # Defaults to the current version
+    history_depth: Optional[int] = 1
     question: Optional[str] = None
     enable_stack_overflow_check: Optional[bool] = True
 
+class BatchImpactRequest(BaseModel):
+    space_key: Optional[str] = None
+    since: str  # YYYY-MM-DD or "YYYY-MM-DD HH:MM", inclusive
+    until: Optional[str] = None  # Exclusive; defaults to now
+    max_pages: Optional[int] = None
+    concurrency: Optional[int] = None
+    resume: Optional[bool] = True  # Skip pages already analyzed by an interrupted run of the same window
+
+class CodeFileChange(BaseModel):
+    path: str
+    old_code: Optional[str] = ""  # Empty for an added file
+    new_code: Optional[str] = ""  # Empty for a deleted file
+    language: Optional[str] = None  # Detected from the extension/code when not given
+
 class DirectCodeImpactRequest(BaseModel):
-    old_code: str
-    new_code: str
+    old_code: Optional[str] = None
+    new_code: Optional[str] = None
+    # Change sets (instead of old_code/new_code): file pairs, a unified diff, or two refs of a local checkout
+    files: Optional[List[CodeFileChange]] = None
+    patch: Optional[str] = None
+    repo_path: Optional[str] = None
+    base_ref: Optional[str] = None
+    head_ref: Optional[str] = None
+    paths: Optional[List[str]] = None  # Limit a git change set to these paths
     question: Optional[str] = None
+    structural: Optional[bool] = False  # Compare by syntax (Python ast, JS/Java tokens) instead of raw lines
+    language: Optional[str] = None  # Detected from the code when not given
     enable_stack_overflow_check: Optional[bool] = True
 
 class PushToJiraConfluenceSlackRequest(BaseModel):
@@ -147,12 +251,19 @@ class ChartRequest(BaseModel):
     excel_url: Optional[str] = None
     chart_type: str
     filename: str
-    format: str
+    format: str  # png, jpg, svg, pdf, pptx, or spec (a Chart.js config instead of a file)
+    dpi: Optional[int] = None  # Raster resolution; 100 by default; pptx reuses a cached PNG of the chart, else 300
+    download: Optional[bool] = False  # Return the file itself instead of base64 in JSON
 
 class ExportRequest(BaseModel):
     content: str
     format: str
     filename: str
+    download: Optional[bool] = False  # Return the file itself instead of base64 in JSON
+
+class BatchExportRequest(BaseModel):
+    items: List[ExportRequest]  # download is ignored; every item goes into the ZIP
+    archive_name: Optional[str] = "exports"
 
 class SaveToConfluenceRequest(BaseModel):
     space_key: Optional[str] = None
@@ -190,20 +301,17 @@ class ExcelSummaryRequest(BaseModel):
     excel_url: str
 
 # Helper functions
-def remove_emojis(text):
-    emoji_pattern = re.compile(
-        "["
-        u"\U0001F600-\U0001F64F"
-        u"\U0001F300-\U0001F5FF"
-        u"\U0001F680-\U0001F6FF"
-        u"\U0001F1E0-\U0001F1FF"
-        "]+", flags=re.UNICODE)
-    no_emoji = emoji_pattern.sub(r'', text)
-    return no_emoji.encode('latin-1', 'ignore').decode('latin-1')
-
 def clean_html(html_content):
-    soup = BeautifulSoup(html_content, "html.parser")
-    return soup.get_text(separator="\n")
+    return parse_page(html_content).text
+
+def get_parsed_page(confluence, page_id: str, representation: str = "storage") -> ParsedPage:
+    """Fetch a page body and parse it, reusing the parsed form for pages whose version has not changed"""
+    page_data = confluence.get_page_by_id(page_id, expand=f"body.{representation},version,children.attachment")
+    markup = page_data["body"][representation]["value"]
+    version = page_data.get("version", {}).get("number")
+    cache_key = (str(page_id), version, representation) if version is not None else None
+    _remember_attachment_listing(page_id, page_data)
+    return parse_page(markup, cache_key=cache_key, rendered=representation != "storage")
 
 def init_confluence():
     try:
@@ -219,48 +327,8 @@ def init_confluence():
 # Export functions
 def create_pdf(text):
     try:
-        # Validate input
-        if not text or not text.strip():
-            text = "No content to export"
-        
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.set_font("Arial", size=12)
-        
-        # Clean and encode text properly
-        cleaned_text = remove_emojis(text)
-        
-        # Split text into lines and add to PDF
-        lines = cleaned_text.split('\n')
-        for line in lines:
-            # Handle empty lines
-            if not line.strip():
-                pdf.ln(5)
-            else:
-                # Encode line to handle special characters
-                try:
-                    # First try with latin-1 encoding
-                    encoded_line = line.encode('latin-1', 'replace').decode('latin-1')
-                    if encoded_line.strip():  # Only add non-empty lines
-                        pdf.multi_cell(0, 10, encoded_line)
-                except UnicodeEncodeError:
-                    # Fallback for problematic characters
-                    try:
-                        safe_line = line.encode('ascii', 'ignore').decode('ascii')
-                        if safe_line.strip():  # Only add non-empty lines
-                            pdf.multi_cell(0, 10, safe_line)
-                    except Exception:
-                        # Final fallback - skip problematic lines
-                        continue
-        
-        # Get PDF as bytes - FPDF2 returns bytes directly when using dest='S'
-        pdf_bytes = pdf.output(dest='S')
-        if not pdf_bytes:
-            raise Exception("PDF generation returned empty data")
-        
-        # Return the bytes directly without additional encoding
-        return io.BytesIO(pdf_bytes)
+        # Unicode TTF font and markdown structure; see pdf_export
+        return io.BytesIO(render_pdf(text))
     except Exception as e:
         print(f"PDF creation error: {e}")
         # Fallback: create a simple text-based PDF
@@ -283,69 +351,27 @@ def create_pdf(text):
             return io.BytesIO(pdf.output(dest='S'))
 
 def create_docx(text):
-    doc = Document()
-    for line in text.split('\n'):
-        doc.add_paragraph(line)
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+    # Headings, list styles and tables from the parsed markdown; see export_pipeline
+    return io.BytesIO(export_document(text, "docx"))
 
 def create_csv(text):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    for line in text.strip().split('\n'):
-        writer.writerow([line])
-    return io.BytesIO(output.getvalue().encode())
+    return io.BytesIO(export_document(text, "csv"))
 
 def create_json(text):
     return io.BytesIO(json.dumps({"response": text}, indent=4).encode())
 
 def create_html(text):
-    html = f"<html><body><pre>{text}</pre></body></html>"
-    return io.BytesIO(html.encode())
+    return io.BytesIO(export_document(text, "html"))
 
 def create_txt(text):
     return io.BytesIO(text.encode())
 
 def create_pptx(text):
-    """Create a PowerPoint presentation with the given text content"""
-    prs = Presentation()
-    
-    # Add a slide
-    slide_layout = prs.slide_layouts[6]  # Blank layout
-    slide = prs.slides.add_slide(slide_layout)
-    
-    # Add a text box
-    left = Inches(1)
-    top = Inches(1)
-    width = Inches(8)
-    height = Inches(6)
-    
-    txBox = slide.shapes.add_textbox(left, top, width, height)
-    tf = txBox.text_frame
-    
-    # Add text content
-    lines = text.split('\n')
-    for i, line in enumerate(lines):
-        if i == 0:
-            p = tf.add_paragraph()
-            p.text = line
-            p.font.size = Inches(0.3)  # 24pt
-            p.font.bold = True
-        else:
-            p = tf.add_paragraph()
-            p.text = line
-            p.font.size = Inches(0.2)  # 16pt
-    
-    # Save to buffer
-    buffer = io.BytesIO()
-    prs.save(buffer)
-    buffer.seek(0)
-    return buffer
+    """Create a PowerPoint presentation with the given text content, a slide per section (more when it runs long)"""
+    return io.BytesIO(export_document(text, "pptx"))
 
 def create_pptx_with_image(image_data_base64, title="Chart"):
-    """Create a PowerPoint presentation with just the chart image"""
+    """Create a PowerPoint presentation with just the chart image (raw image bytes or base64)"""
     prs = Presentation()
     
     # Add a slide
@@ -353,8 +379,11 @@ def create_pptx_with_image(image_data_base64, title="Chart"):
     slide = prs.slides.add_slide(slide_layout)
     
     try:
-        # Decode base64 image data
-        image_data = base64.b64decode(image_data_base64)
+        # Decode base64 image data (raw bytes are used as they are)
+        if isinstance(image_data_base64, (bytes, bytearray, memoryview)):
+            image_data = image_data_base64
+        else:
+            image_data = base64.b64decode(image_data_base64)
         
         # Add image to slide
         left = Inches(1)
@@ -400,48 +429,114 @@ def create_pptx_with_image(image_data_base64, title="Chart"):
     buffer.seek(0)
     return buffer
 
+# Export format -> (renderer, MIME type, file extension); anything else is exported as plain text
+EXPORT_FORMATS = {
+    "pdf": (create_pdf, "application/pdf", "pdf"),
+    "docx": (create_docx, "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "docx"),
+    "pptx": (create_pptx, "application/vnd.openxmlformats-officedocument.presentationml.presentation", "pptx"),
+    "csv": (create_csv, "text/csv", "csv"),
+    "json": (create_json, "application/json", "json"),
+    "html": (create_html, "text/html", "html"),
+}
+BINARY_EXPORT_EXTENSIONS = {"pdf", "docx", "pptx"}
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+async def render_export(content: str, export_format: str) -> Tuple[io.BytesIO, str, str]:
+    """Render content in an export format off the event loop; returns (buffer, MIME type, file extension)"""
+    renderer, mime, extension = EXPORT_FORMATS.get(export_format, (create_txt, "text/plain", "txt"))
+    if extension != "pdf":
+        return await asyncio.to_thread(renderer, content), mime, extension
+    try:
+        print(f"Creating PDF for content length: {len(content)}")
+        # PDFs are rendered in a worker process from the parsed blocks (create_pdf's fallbacks run if that fails)
+        buffer = io.BytesIO(await render_pdf_async(await asyncio.to_thread(parse_document, content)))
+        print(f"PDF generated, size: {buffer.getbuffer().nbytes} bytes")
+        return buffer, mime, extension
+    except Exception as pdf_error:
+        print(f"PDF export error: {pdf_error}")
+        print(f"Traceback: {traceback.format_exc()}")
+        # Create a fallback PDF with error message
+        try:
+            fallback_content = f"PDF Export Error\n\nOriginal content could not be exported.\nError: {str(pdf_error)}\n\nContent preview:\n{content[:500]}..."
+            return create_pdf(fallback_content), mime, extension
+        except Exception as fallback_error:
+            print(f"Fallback PDF also failed: {fallback_error}")
+            # Return a simple text file instead
+            return io.BytesIO(f"PDF Export Failed: {str(pdf_error)}".encode('utf-8')), "text/plain", "txt"
+
+def content_disposition(filename: str) -> str:
+    """attachment header with an ASCII fallback name and the UTF-8 name (RFC 6266)"""
+    ascii_name = filename.encode("ascii", "ignore").decode("ascii").replace('"', "") or "download"
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{url_quote(filename)}"
+
+def file_response(buffer: io.BytesIO, mime: str, filename: str) -> StreamingResponse:
+    """Stream a rendered file from its buffer in chunks, without copying it whole"""
+    size = buffer.getbuffer().nbytes
+    buffer.seek(0)
+    return StreamingResponse(
+        iter(lambda: buffer.read(EXPORT_CHUNK_SIZE), b""),
+        media_type=mime,
+        headers={"Content-Disposition": content_disposition(filename), "Content-Length": str(size)}
+    )
+
 def extract_text_from_file(file_url: str, file_extension: str) -> str:
     """Extract text content from various file types"""
+    file_extension = file_extension.lower()
+    cache_key = (file_url, file_extension)
+    cached_text = _attachment_text_cache.get(cache_key)
+    if cached_text is not None:
+        print(f"Using cached text for: {file_url}")
+        return cached_text
     try:
         print(f"Downloading file from: {file_url}")
-        # Download the file
+        # Download the file, spooling large files to disk instead of holding them in memory
         auth = (os.getenv('CONFLUENCE_USER_EMAIL'), os.getenv('CONFLUENCE_API_KEY'))
-        response = requests.get(file_url, auth=auth, timeout=30)
-        
-        print(f"Download response status: {response.status_code}")
-        print(f"Download response headers: {dict(response.headers)}")
-        
-        if response.status_code == 404:
-            return f"Error: File not found at URL: {file_url}"
-        elif response.status_code == 403:
-            return f"Error: Access denied to file at URL: {file_url}"
-        elif response.status_code != 200:
-            return f"Error: HTTP {response.status_code} when downloading file from {file_url}"
-        
-        file_content = response.content
-        print(f"Downloaded file size: {len(file_content)} bytes")
-        
-        # Check if content is empty
-        if not file_content:
-            return f"Error: Empty file content from {file_url}"
-        
-        # Extract text based on file type
-        print(f"File extension received: '{file_extension}' (lowercase: '{file_extension.lower()}')")
-        
-        if file_extension.lower() == '.pdf':
-            print("Calling PDF extraction function")
-            return extract_text_from_pdf(file_content)
-        elif file_extension.lower() in ['.docx', '.doc']:
-            print("Calling DOCX extraction function")
-            result = extract_text_from_docx(file_content)
-            print(f"DOCX extraction result: {len(result)} characters")
-            return result
-        elif file_extension.lower() == '.txt':
-            print("Calling TXT extraction function")
-            return extract_text_from_txt(file_content)
-        else:
-            print(f"Unsupported file type: {file_extension}")
-            return f"Unsupported file type: {file_extension}"
+        with requests.get(file_url, auth=auth, timeout=30, stream=True) as response, \
+                tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as file_obj:
+            print(f"Download response status: {response.status_code}")
+            
+            if response.status_code == 404:
+                return f"Error: File not found at URL: {file_url}"
+            elif response.status_code == 403:
+                return f"Error: Access denied to file at URL: {file_url}"
+            elif response.status_code != 200:
+                return f"Error: HTTP {response.status_code} when downloading file from {file_url}"
+            
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                file_obj.write(chunk)
+            file_size = file_obj.tell()
+            print(f"Downloaded file size: {file_size} bytes")
+            
+            # Check if content is empty
+            if not file_size:
+                return f"Error: Empty file content from {file_url}"
+            file_obj.seek(0)
+            
+            # Extract text based on file type
+            print(f"File extension received: '{file_extension}'")
+            
+            if file_extension == '.pdf':
+                result = extract_text_from_pdf(file_obj.read())
+            elif file_extension in ['.docx', '.doc']:
+                result = extract_text_from_docx(file_obj.read())
+            elif file_extension in ['.txt', '.md', '.markdown']:
+                result = extract_text_from_txt(file_obj.read())
+            elif file_extension in ['.xlsx', '.xlsm']:
+                result = extract_text_from_xlsx(file_obj)
+            elif file_extension == '.pptx':
+                result = extract_text_from_pptx(file_obj)
+            elif file_extension == '.csv':
+                result = extract_text_from_csv(file_obj)
+            elif file_extension in ['.html', '.htm']:
+                result = extract_text_from_html(file_obj)
+            else:
+                print(f"Unsupported file type: {file_extension}")
+                return f"Unsupported file type: {file_extension}"
+        
+        print(f"Extracted {len(result)} characters from {file_url}")
+        if not result.startswith("Error"):
+            _attachment_text_cache.set(cache_key, result)
+        return result
             
     except requests.exceptions.Timeout:
         return f"Error: Timeout when downloading file from {file_url}"
@@ -545,142 +640,191 @@ def extract_text_from_txt(txt_content: bytes) -> str:
     except Exception as e:
         return f"Error reading TXT: {str(e)}"
 
-def get_page_attachments(confluence, page_id: str) -> List[Dict[str, str]]:
-    """Get all attachments from a Confluence page"""
+def extract_text_from_xlsx(xlsx_file) -> str:
+    """Extract text from XLSX content, streaming rows with openpyxl's read-only mode"""
     try:
-        attachments = confluence.get_attachments_from_content(page_id, start=0, limit=100)
-        supported_extensions = ['.pdf', '.docx', '.doc', '.txt']
-        
-        print(f"Raw attachments response: {attachments}")
-        
-        file_attachments = []
-        for attachment in attachments.get('results', []):
-            filename = attachment.get('title', '')
-            file_extension = os.path.splitext(filename)[1].lower()
-            
-            print(f"Processing attachment: {filename} with extension: {file_extension}")
-            print(f"Attachment data: {attachment}")
-            
-            if file_extension in supported_extensions:
-                # Try different ways to get the download URL
-                download_url = None
-                
-                # Method 1: Try _links.download
-                if attachment.get('_links', {}).get('download'):
-                    download_url = attachment['_links']['download']
-                    # If it's a relative URL, make it absolute
-                    if download_url.startswith('/'):
-                        base_url = confluence.url.rstrip('/')
-                        download_url = f"{base_url}{download_url}"
-                    print(f"Method 1 - Direct download URL: {download_url}")
-                
-                # Method 2: Try _links.self + /download
-                elif attachment.get('_links', {}).get('self'):
-                    base_url = attachment['_links']['self']
-                    download_url = f"{base_url}/download"
-                    print(f"Method 2 - Self + download URL: {download_url}")
-                
-                # Method 3: Construct URL using attachment ID
-                elif attachment.get('id'):
-                    # Get the base URL from confluence instance
-                    base_url = confluence.url.rstrip('/')
-                    download_url = f"{base_url}/download/attachments/{page_id}/{attachment['id']}"
-                    print(f"Method 3 - Constructed URL: {download_url}")
-                
-                # Method 4: Try using the confluence download method directly
-                if not download_url and attachment.get('id'):
-                    try:
-                        # Use confluence's built-in download method
-                        download_url = confluence.download_attachment(attachment['id'], 'temp')
-                        print(f"Method 4 - Confluence download method: {download_url}")
-                    except Exception as e:
-                        print(f"Method 4 failed: {e}")
-                
-                if download_url:
-                    file_attachments.append({
-                        'filename': filename,
-                        'url': download_url,
-                        'extension': file_extension,
-                        'id': attachment.get('id', '')
-                    })
-                    print(f"Successfully added attachment: {filename} with URL: {download_url}")
-                else:
-                    print(f"Failed to get download URL for: {filename}")
-        
-        return file_attachments
+        from openpyxl import load_workbook
+        workbook = load_workbook(xlsx_file, read_only=True, data_only=True)
+        try:
+            lines = []
+            rows_left = MAX_SPREADSHEET_ROWS
+            for sheet in workbook.worksheets:
+                if rows_left <= 0:
+                    lines.append(f"... [truncated after {MAX_SPREADSHEET_ROWS} rows]")
+                    break
+                lines.append(f"Sheet: {sheet.title}")
+                for row in sheet.iter_rows(max_col=MAX_SPREADSHEET_COLUMNS, values_only=True):
+                    cells = ["" if value is None else str(value).strip() for value in row]
+                    while cells and not cells[-1]:
+                        cells.pop()
+                    if not cells:
+                        continue
+                    if rows_left <= 0:
+                        lines.append(f"... [truncated after {MAX_SPREADSHEET_ROWS} rows]")
+                        break
+                    lines.append(" | ".join(cells))
+                    rows_left -= 1
+            return "\n".join(lines).strip()
+        finally:
+            workbook.close()
     except Exception as e:
-        print(f"Error getting attachments: {e}")
-        return []
+        return f"Error reading XLSX: {str(e)}"
 
-def get_page_attachments_alternative(confluence, page_id: str) -> List[Dict[str, str]]:
-    """Alternative method to get attachments using different API approach"""
+def extract_text_from_pptx(pptx_file) -> str:
+    """Extract text from PPTX content (slide text, tables and speaker notes)"""
     try:
-        supported_extensions = ['.pdf', '.docx', '.doc', '.txt']
-        file_attachments = []
-        
-        # Try to get attachments using a different method
-        try:
-            # Get page content with attachments expanded
-            page_data = confluence.get_page_by_id(page_id, expand="children.attachment")
-            print(f"Page data with attachments: {page_data}")
-            
-            if 'children' in page_data and 'attachment' in page_data['children']:
-                attachments = page_data['children']['attachment']['results']
-                
-                for attachment in attachments:
-                    filename = attachment.get('title', '')
-                    file_extension = os.path.splitext(filename)[1].lower()
-                    
-                    if file_extension in supported_extensions:
-                        # Try to construct the download URL
-                        base_url = confluence.url.rstrip('/')
-                        attachment_id = attachment.get('id')
-                        
-                        if attachment_id:
-                            download_url = f"{base_url}/download/attachments/{page_id}/{attachment_id}"
-                            # Ensure it's an absolute URL
-                            if not download_url.startswith('http'):
-                                download_url = f"{base_url}{download_url}"
-                            file_attachments.append({
-                                'filename': filename,
-                                'url': download_url,
-                                'extension': file_extension,
-                                'id': attachment_id
-                            })
-                            print(f"Alternative method - Added: {filename} with URL: {download_url}")
-        
-        except Exception as e:
-            print(f"Alternative method failed: {e}")
-        
-        return file_attachments
+        def shape_texts(shapes):
+            for shape in shapes:
+                if getattr(shape, "shapes", None) is not None:  # group shape
+                    yield from shape_texts(shape.shapes)
+                elif shape.has_text_frame:
+                    if shape.text_frame.text.strip():
+                        yield shape.text_frame.text.strip()
+                elif getattr(shape, "has_table", False) and shape.has_table:
+                    for row in shape.table.rows:
+                        cells = [cell.text.strip() for cell in row.cells]
+                        if any(cells):
+                            yield " | ".join(cells)
+        
+        prs = Presentation(pptx_file)
+        lines = []
+        for index, slide in enumerate(prs.slides, start=1):
+            if index > MAX_PRESENTATION_SLIDES:
+                lines.append(f"... [truncated after {MAX_PRESENTATION_SLIDES} slides]")
+                break
+            lines.append(f"Slide {index}:")
+            lines.extend(shape_texts(slide.shapes))
+            if slide.has_notes_slide:
+                notes = slide.notes_slide.notes_text_frame.text.strip()
+                if notes:
+                    lines.append(f"Notes: {notes}")
+        return "\n".join(lines).strip()
     except Exception as e:
-        print(f"Error in alternative attachment method: {e}")
-        return []
+        return f"Error reading PPTX: {str(e)}"
 
+def extract_text_from_csv(csv_file) -> str:
+    """Extract text from CSV content, sniffing the dialect and streaming a bounded number of rows"""
+    try:
+        text_stream = io.TextIOWrapper(csv_file, encoding='utf-8', errors='replace', newline='')
+        try:
+            sample = text_stream.read(64 * 1024)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+            except csv.Error:
+                dialect = csv.excel
+            text_stream.seek(0)
+            lines = []
+            for row_number, row in enumerate(csv.reader(text_stream, dialect)):
+                if row_number >= MAX_SPREADSHEET_ROWS:
+                    lines.append(f"... [truncated after {MAX_SPREADSHEET_ROWS} rows]")
+                    break
+                cells = [cell.strip() for cell in row[:MAX_SPREADSHEET_COLUMNS]]
+                if any(cells):
+                    lines.append(" | ".join(cells))
+            return "\n".join(lines).strip()
+        finally:
+            text_stream.detach()
+    except Exception as e:
+        return f"Error reading CSV: {str(e)}"
 
-def extract_timestamps_from_summary(summary):
-    timestamps = []
-    lines = summary.splitlines()
-    collecting = False
-    for line in lines:
-        if "**Timestamps:**" in line or "Timestamps:" in line:
-            collecting = True
+def extract_text_from_html(html_file) -> str:
+    """Extract visible text from HTML content using lxml"""
+    try:
+        import lxml.html
+        root = lxml.html.parse(html_file).getroot()
+        if root is None:
+            return ""
+        for element in list(root.iter('script', 'style', 'noscript', 'template')):
+            element.drop_tree()
+        lines = (text.strip() for text in root.itertext())
+        return "\n".join(line for line in lines if line)
+    except Exception as e:
+        return f"Error reading HTML: {str(e)}"
+
+def _remember_attachment_listing(page_id: str, page_data: Dict[str, Any]) -> None:
+    """Keep the first batch of attachments embedded in a page fetch, so the catalog needn't fetch it again"""
+    listing = page_data.get("children", {}).get("attachment")
+    if listing is not None:
+        _embedded_attachment_listings.set(str(page_id), listing)
+
+def _attachment_listing_key(page_id: str, listing: Dict[str, Any]) -> Tuple:
+    """What identifies a catalog: every attachment in the first batch, with its version and size"""
+    return (page_id, "next" in listing.get("_links", {})) + tuple(
+        (attachment.get('id'), attachment.get('version', {}).get('number'),
+         attachment.get('extensions', {}).get('fileSize'))
+        for attachment in listing.get("results", [])
+    )
+
+def _attachment_download_url(confluence, page_id: str, attachment: Dict[str, Any]) -> Optional[str]:
+    """Resolve an absolute download URL for an attachment record"""
+    base_url = confluence.url.rstrip('/')
+    links = attachment.get('_links', {})
+    if links.get('download'):
+        download_url = links['download']
+        return f"{base_url}{download_url}" if download_url.startswith('/') else download_url
+    if links.get('self'):
+        return f"{links['self']}/download"
+    if attachment.get('id'):
+        return f"{base_url}/download/attachments/{page_id}/{attachment['id']}"
+    return None
+
+def get_attachment_catalog(confluence, page_id: str) -> List[Dict[str, Any]]:
+    """
+    Get every attachment on a page with absolute download URLs.
+    Each call looks at the first batch of attachments, which comes embedded in a recent page
+    fetch (see get_parsed_page) or costs one small request; the catalog is rebuilt only when
+    that batch changed (an upload, a new version, a deletion). Catalogs that span several
+    batches are also rebuilt after ATTACHMENT_LISTING_TTL seconds, since later batches can
+    change without the first one changing.
+    """
+    page_id = str(page_id)
+    # An embedded batch is used once; the next call asks Confluence again
+    listing = _embedded_attachment_listings.get(page_id)
+    _embedded_attachment_listings.pop(page_id)
+    if listing is None:
+        listing = confluence.get_attachments_from_content(page_id, start=0, limit=ATTACHMENT_PAGE_SIZE, expand="version")
+    key = _attachment_listing_key(page_id, listing)
+    catalogs = _paged_attachment_catalogs if "next" in listing.get("_links", {}) else _attachment_catalogs
+    catalog = catalogs.get(key)
+    if catalog is not None:
+        return list(catalog)
+
+    results = list(listing.get("results", []))
+    has_more = "next" in listing.get("_links", {})
+    while has_more:
+        batch = confluence.get_attachments_from_content(page_id, start=len(results), limit=ATTACHMENT_PAGE_SIZE)
+        batch_results = batch.get("results", [])
+        results.extend(batch_results)
+        has_more = bool(batch_results) and "next" in batch.get("_links", {})
+    
+    catalog = []
+    for attachment in results:
+        filename = attachment.get('title', '')
+        download_url = _attachment_download_url(confluence, page_id, attachment)
+        if not download_url:
+            print(f"Failed to get download URL for: {filename}")
             continue
-        if collecting:
-            if not line.strip() or line.strip().startswith("**"):
-                break
-            # match lines like "* [00:00-00:05] sentence" or "[00:00-00:05] sentence"
-            match = re.match(r"^\*?\s*\[(\d{1,2}:\d{2}-\d{1,2}:\d{2})\]\s*(.*)", line.strip())
-            if match:
-                timestamp_text = f"[{match.group(1)}] {match.group(2)}"
-                timestamps.append(timestamp_text)
-            elif line.strip().startswith("*") or line.strip().startswith("-"):
-                # fallback for bullet points
-                timestamps.append(line.strip().lstrip("* -").strip())
-            elif line.strip():
-                # fallback for any non-empty line
-                timestamps.append(line.strip())
-    return timestamps
+        catalog.append({
+            'filename': filename,
+            'url': download_url,
+            'extension': os.path.splitext(filename)[1].lower(),
+            'id': attachment.get('id', ''),
+            'media_type': attachment.get('metadata', {}).get('mediaType', ''),
+            'file_size': attachment.get('extensions', {}).get('fileSize'),
+            'version': attachment.get('version', {}).get('number')
+        })
+    print(f"Attachment catalog for page {page_id}: {len(catalog)} attachments")
+    catalogs.set(key, catalog)
+    return list(catalog)
+
+def get_page_attachments(confluence, page_id: str, extensions: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Get the attachments of a Confluence page that we can extract text from.
+    Listing errors (auth, timeouts, 5xx) propagate, so callers can tell them from a page without attachments.
+    """
+    extensions = extensions or SUPPORTED_ATTACHMENT_EXTENSIONS
+    return [att for att in get_attachment_catalog(confluence, page_id) if att['extension'] in extensions]
+
 
 def auto_detect_space(confluence, space_key: Optional[str] = None) -> str:
     """
@@ -723,214 +867,42 @@ def search_web_google(query, num_results=5):
     except Exception as e:
         return f"❌ Google Search error: {e}"
 
-def search_stack_overflow(query: str, num_results: int = 3) -> List[str]:
-    """Search Stack Overflow API for relevant discussions"""
+def check_stack_overflow_risks(code_content: str, language: Optional[str] = None,
+                               files: Optional[List[Tuple[str, str, Optional[str]]]] = None) -> List[Dict[str, Any]]:
+    """
+    Check for risky patterns and deprecated features using Stack Overflow API.
+    files: (path, code, language) of a multi-file change set, scanned one by one so each
+    occurrence carries its file path; code_content and language are used otherwise.
+    """
     try:
-        import os
-        STACK_OVERFLOW_API_KEY = os.getenv("STACK_OVERFLOW_API_KEY")
-        
-        # Stack Overflow API endpoint
-        url = "https://api.stackexchange.com/2.3/search/advanced"
-        
-        params = {
-            "site": "stackoverflow",
-            "q": query,
-            "sort": "votes",
-            "order": "desc",
-            "pagesize": num_results,
-            "filter": "withbody",
-            "key": STACK_OVERFLOW_API_KEY if STACK_OVERFLOW_API_KEY else None
-        }
-        
-        # Remove None values
-        params = {k: v for k, v in params.items() if v is not None}
+        # One precompiled pass over the code for all rules of the language (all rules if unknown)
+        sources = files if files is not None else [(None, code_content, language)]
+        matched: Dict[str, Tuple[Any, List[Tuple[Optional[str], str, Any]]]] = {}
+        for path, content, source_language in sources:
+            for rule, hits in find_risks(content, source_language).values():
+                matched.setdefault(rule.id, (rule, []))[1].extend((path, content, hit) for hit in hits)
         
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        links = []
-        
-        if "items" in data:
-            for item in data["items"]:
-                question_id = item.get("question_id")
-                if question_id:
-                    links.append(f"https://stackoverflow.com/questions/{question_id}")
-        
-        return links[:num_results]
-        
-    except Exception as e:
-        print(f"Stack Overflow API error: {e}")
-        # Fallback to mock links if API fails
-        return [
-            f"https://stackoverflow.com/questions/mock-{query.replace(' ', '-').lower()}-1",
-            f"https://stackoverflow.com/questions/mock-{query.replace(' ', '-').lower()}-2"
-        ]
-
-def check_stack_overflow_risks(code_content: str) -> List[Dict[str, Any]]:
-    """Check for risky patterns and deprecated features using Stack Overflow API"""
-    try:
-        # Common risky patterns and deprecated features to check for
-        risk_patterns = [
-            # JavaScript/Web patterns
-            {
-                "pattern": "eval\\(",
-                "risk_level": "high",
-                "description": "Use of eval() function is dangerous as it executes arbitrary code",
-                "deprecation_warning": "eval() is considered dangerous and should be avoided",
-                "alternative_suggestions": [
-                    "Use JSON.parse() for parsing JSON data",
-                    "Use Function constructor for dynamic code execution",
-                    "Implement proper input validation and sanitization"
-                ],
-                "search_terms": ["javascript eval function security risks", "eval() dangerous code execution"]
-            },
-            {
-                "pattern": "innerHTML\\s*=",
-                "risk_level": "medium",
-                "description": "Direct innerHTML assignment can lead to XSS attacks",
-                "deprecation_warning": "innerHTML assignment without sanitization is risky",
-                "alternative_suggestions": [
-                    "Use textContent for text-only content",
-                    "Use DOMPurify library for HTML sanitization",
-                    "Use createElement and appendChild for DOM manipulation"
-                ],
-                "search_terms": ["innerHTML XSS security", "innerHTML vs textContent security"]
-            },
-            {
-                "pattern": "document\\.write\\(",
-                "risk_level": "high",
-                "description": "document.write() can cause security issues and poor performance",
-                "deprecation_warning": "document.write() is deprecated and should not be used",
-                "alternative_suggestions": [
-                    "Use DOM manipulation methods like createElement",
-                    "Use innerHTML with proper sanitization",
-                    "Use modern frameworks like React, Vue, or Angular"
-                ],
-                "search_terms": ["document.write deprecated", "document.write security issues"]
-            },
-            {
-                "pattern": "setTimeout\\(.*,\\s*0\\)",
-                "risk_level": "low",
-                "description": "setTimeout with 0 delay can indicate potential race conditions",
-                "alternative_suggestions": [
-                    "Use Promise.resolve().then() for microtasks",
-                    "Use requestAnimationFrame for UI updates",
-                    "Consider using async/await patterns"
-                ],
-                "search_terms": ["setTimeout 0 delay race condition", "setTimeout vs Promise microtask"]
-            },
-            {
-                "pattern": "console\\.log\\(",
-                "risk_level": "low",
-                "description": "Console.log statements should be removed in production code",
-                "alternative_suggestions": [
-                    "Use proper logging framework",
-                    "Remove console.log statements before production",
-                    "Use environment-based logging"
-                ],
-                "search_terms": ["console.log production code", "remove console.log before deployment"]
-            },
-            {
-                "pattern": "var\\s+",
-                "risk_level": "medium",
-                "description": "var declarations have function scope and can cause hoisting issues",
-                "deprecation_warning": "var is considered outdated in modern JavaScript",
-                "alternative_suggestions": [
-                    "Use const for values that won't be reassigned",
-                    "Use let for values that will be reassigned",
-                    "Prefer block scope over function scope"
-                ],
-                "search_terms": ["javascript var vs let const", "var hoisting issues"]
-            },
-            {
-                "pattern": "\\bfor\\s*\\([^)]*var\\s+",
-                "risk_level": "medium",
-                "description": "var in for loops can cause closure issues",
-                "alternative_suggestions": [
-                    "Use let instead of var in for loops",
-                    "Use forEach, map, or other array methods",
-                    "Use for...of loops for iterables"
-                ],
-                "search_terms": ["var in for loop closure", "javascript for loop var let difference"]
-            },
-            # Python-specific patterns
-            {
-                "pattern": "exec\\(",
-                "risk_level": "high",
-                "description": "Use of exec() function is dangerous as it executes arbitrary code",
-                "deprecation_warning": "exec() is considered dangerous and should be avoided",
-                "alternative_suggestions": [
-                    "Use ast.literal_eval() for safe evaluation",
-                    "Use json.loads() for JSON data",
-                    "Implement proper input validation and sanitization"
-                ],
-                "search_terms": ["python exec function security risks", "exec() dangerous code execution"]
-            },
-            {
-                "pattern": "pickle\\.load\\(",
-                "risk_level": "high",
-                "description": "pickle.load() can execute arbitrary code and is unsafe for untrusted data",
-                "deprecation_warning": "pickle.load() is dangerous for untrusted data",
-                "alternative_suggestions": [
-                    "Use json.load() for safe data deserialization",
-                    "Use ast.literal_eval() for simple data structures",
-                    "Implement custom serialization for complex objects"
-                ],
-                "search_terms": ["python pickle security risks", "pickle.load dangerous"]
-            },
-            {
-                "pattern": "subprocess\\.run.*shell=True",
-                "risk_level": "medium",
-                "description": "subprocess.run with shell=True can execute arbitrary shell commands",
-                "deprecation_warning": "shell=True is dangerous with user input",
-                "alternative_suggestions": [
-                    "Use subprocess.run with shell=False and list arguments",
-                    "Use specific command execution libraries",
-                    "Validate and sanitize all command inputs"
-                ],
-                "search_terms": ["python subprocess shell=True security", "subprocess shell injection"]
-            },
-            {
-                "pattern": "input\\(",
-                "risk_level": "medium",
-                "description": "input() without validation can lead to injection attacks",
-                "alternative_suggestions": [
-                    "Validate and sanitize all user input",
-                    "Use argparse for command-line arguments",
-                    "Implement proper input validation"
-                ],
-                "search_terms": ["python input() security", "input validation python"]
-            },
-            {
-                "pattern": "print\\(",
-                "risk_level": "low",
-                "description": "print() statements should be replaced with proper logging in production",
-                "alternative_suggestions": [
-                    "Use logging module for proper logging",
-                    "Remove print statements before production",
-                    "Use environment-based logging configuration"
-                ],
-                "search_terms": ["python print vs logging", "remove print statements production"]
-            }
-        ]
+        # Search Stack Overflow for real discussions (cached, misses fetched concurrently)
+        links_by_query = search_many([search_query(rule) for rule, _ in matched.values()], 3)
         
         found_risks = []
-        
-        for pattern_info in risk_patterns:
-            if re.search(pattern_info["pattern"], code_content, re.IGNORECASE):
-                # Search Stack Overflow for real discussions
-                search_query = pattern_info.get("search_terms", [pattern_info["pattern"].replace('\\', '')])[0]
-                stack_overflow_links = search_stack_overflow(search_query, 3)
-                
-                found_risks.append({
-                    "pattern": pattern_info["pattern"].replace('\\', ''),
-                    "risk_level": pattern_info["risk_level"],
-                    "description": pattern_info["description"],
-                    "stack_overflow_links": stack_overflow_links,
-                    "alternative_suggestions": pattern_info["alternative_suggestions"],
-                    "deprecation_warning": pattern_info.get("deprecation_warning")
-                })
+        for rule, hits in matched.values():
+            occurrences = []
+            for path, content, hit in hits[:MAX_OCCURRENCES_PER_RULE]:
+                location = occurrence(hit, content)
+                if path:
+                    location["path"] = path
+                occurrences.append(location)
+            found_risks.append({
+                "pattern": rule.pattern.replace('\\', ''),
+                "risk_level": rule.risk_level,
+                "description": rule.description,
+                "stack_overflow_links": links_by_query[search_query(rule)],
+                "alternative_suggestions": list(rule.alternative_suggestions),
+                "deprecation_warning": rule.deprecation_warning,
+                "occurrence_count": len(hits),
+                "occurrences": occurrences
+            })
         
         return found_risks
         
@@ -1029,18 +1001,15 @@ async def ai_powered_search(request: SearchRequest, req: Request):
         # Extract content from selected pages
         for page in selected_pages:
             page_id = page["id"]
-            page_data = confluence.get_page_by_id(page_id, expand="body.storage")
-            raw_html = page_data["body"]["storage"]["value"]
-            text_content = clean_html(raw_html)
+            text_content = get_parsed_page(confluence, page_id).text
             full_context += f"\n\nTitle: {page['title']}\n{text_content}"
             
-            # Get and process attachments
-            attachments = get_page_attachments(confluence, page_id)
-            
-            # If no attachments found, try alternative method
-            if not attachments:
-                print(f"No attachments found with primary method for page {page['title']}, trying alternative...")
-                attachments = get_page_attachments_alternative(confluence, page_id)
+            # Get and process attachments; the page text is still useful if they can't be listed
+            try:
+                attachments = get_page_attachments(confluence, page_id)
+            except Exception as e:
+                print(f"Error getting attachments of page {page_id}: {e}")
+                attachments = []
             
             if attachments:
                 full_context += f"\n\nAttachments in {page['title']}:"
@@ -1119,13 +1088,85 @@ async def ai_powered_search(request: SearchRequest, req: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def transcribe_media_attachment(confluence, attachment: Dict[str, Any], assemblyai_api_key: str,
+                                      segmented: bool = False) -> Dict[str, Any]:
+    """
+    Transcribe one audio/video attachment with AssemblyAI.
+    The download is streamed through ffmpeg into hashed speech audio (or cut into
+    silence-bounded segments when segmented=True), so audio that was transcribed before,
+    even from another page, is neither uploaded nor transcribed again. At most
+    MEDIA_CONCURRENCY attachments are downloaded and encoded at once.
+    """
+    download_url = attachment['url']
+    source_key = f"confluence-attachment:{attachment['id']}:{attachment.get('version')}" if attachment.get('id') else None
+    
+    # A known attachment version skips the download entirely
+    if source_key and not segmented:
+        known_hash = source_audio_hash(source_key)
+        if known_hash:
+            cached = await find_cached_transcript(known_hash, assemblyai_api_key)
+            if cached is not None:
+                return cached
+    
+    def extract_speech_audio():
+        with confluence._session.get(download_url, stream=True, timeout=(10, 300)) as video_response:
+            video_response.raise_for_status()
+            return spool_audio(speech_audio_from_stream(video_response.iter_content(chunk_size=CHUNK_SIZE)))
+    
+    def extract_audio_to_file(path: str) -> None:
+        with confluence._session.get(download_url, stream=True, timeout=(10, 300)) as video_response:
+            video_response.raise_for_status()
+            encode_audio_to_file(video_response.iter_content(chunk_size=CHUNK_SIZE), path, intermediate_encoding_args())
+    
+    # Uploading and waiting for AssemblyAI don't hold a slot; the slot bounds download and ffmpeg work
+    if segmented:
+        # Long recordings: cut the extracted audio on silences and transcribe the segments in parallel
+        with tempfile.TemporaryDirectory() as tmpdir:
+            audio_path = os.path.join(tmpdir, "speech.flac")
+            async with _media_semaphore:
+                print(f"Transcribing media attachment: {attachment['filename']}")
+                await asyncio.to_thread(extract_audio_to_file, audio_path)
+            return await transcribe_in_segments(audio_path, assemblyai_api_key)
+    async with _media_semaphore:
+        print(f"Transcribing media attachment: {attachment['filename']}")
+        audio_file, audio_hash = await asyncio.to_thread(extract_speech_audio)
+    if source_key:
+        remember_source_audio(source_key, audio_hash)
+    with audio_file:
+        return await transcribe_audio_file(audio_file, audio_hash, assemblyai_api_key)
+
+def media_error_detail(error: Exception) -> str:
+    if isinstance(error, AudioExtractionError):
+        return f"ffmpeg audio extraction failed: {error}"
+    if isinstance(error, requests.exceptions.RequestException):
+        return f"Failed to stream video audio to AssemblyAI: {error}"
+    return str(error)
+
+async def summarize_media_attachment(confluence, attachment: Dict[str, Any], assemblyai_api_key: str,
+                                     ai_model, segmented: bool = False) -> Dict[str, Any]:
+    """Transcribe and summarize one media attachment"""
+    transcript_data = await transcribe_media_attachment(confluence, attachment, assemblyai_api_key, segmented)
+    transcript_text = transcript_data.get("text", "")
+    if not transcript_text:
+        raise TranscriptionError("No transcript text returned from AssemblyAI")
+    summary_result = await summarize_transcript(transcript_data, ai_model)
+    return {
+        "filename": attachment['filename'],
+        "video_url": attachment['url'],
+        "summary": summary_result["summary"],
+        "quotes": summary_result["quotes"],
+        "quote_timestamps": summary_result["quote_timestamps"],
+        "timestamps": summary_result["timestamps"],
+        "segments": summary_result["segments"],
+        "transcript_text": transcript_text
+    }
+
+def truncate_transcript(transcript_text: str) -> str:
+    return transcript_text[:1000] + "..." if len(transcript_text) > 1000 else transcript_text
+
 @app.post("/video-summarizer")
 async def video_summarizer(request: VideoRequest, req: Request):
     """Video Summarizer functionality using AssemblyAI and Gemini"""
-    import requests
-    import tempfile
-    import subprocess
-    import shutil
     confluence = init_confluence()
     space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
 
@@ -1136,139 +1177,151 @@ async def video_summarizer(request: VideoRequest, req: Request):
         raise HTTPException(status_code=400, detail="Page not found")
     page_id = selected_page["id"]
 
-    # Get attachments
-    attachments = confluence.get(f"/rest/api/content/{page_id}/child/attachment?limit=50")
-    video_attachment = None
-    for att in attachments.get("results", []):
-        if att["title"].lower().endswith(".mp4"):
-            video_attachment = att
-            break
-    if not video_attachment:
-        raise HTTPException(status_code=404, detail="No .mp4 video attachment found on this page.")
-
-    # Download video
-    video_url = video_attachment["_links"]["download"]
-    full_url = f"{os.getenv('CONFLUENCE_BASE_URL').rstrip('/')}{video_url}"
-    video_name = video_attachment["title"].replace(" ", "_")
+    # Every audio/video attachment on the page (paged through, cached per page version)
+    try:
+        media_attachments = get_page_attachments(confluence, page_id, MEDIA_ATTACHMENT_EXTENSIONS)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Could not list the page's attachments: {e}")
+    if not media_attachments:
+        raise HTTPException(status_code=404, detail="No video or audio attachment found on this page.")
+    if not request.all_media:
+        media_attachments = media_attachments[:1]
+    
+    assemblyai_api_key = os.getenv('ASSEMBLYAI_API_KEY')
+    if not assemblyai_api_key:
+        raise HTTPException(status_code=500, detail="AssemblyAI API key not configured. Please set ASSEMBLYAI_API_KEY in your environment variables.")
     
-    with tempfile.TemporaryDirectory() as tmpdir:
-        video_path = os.path.join(tmpdir, video_name)
-        audio_path = os.path.join(tmpdir, "audio.mp3")
-        # Download video file
-        video_data = confluence._session.get(full_url).content
-        with open(video_path, "wb") as f:
-            f.write(video_data)
-        # Extract audio using ffmpeg
+    # Initialize Gemini AI model for text generation
+    api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
+    genai.configure(api_key=api_key)
+    ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+    
+    # Q&A
+    if request.question:
         try:
-            subprocess.run([
-                "ffmpeg", "-y", "-i", video_path, "-vn", "-acodec", "mp3", audio_path
-            ], check=True, capture_output=True)
+            transcripts = await asyncio.gather(*(
+                transcribe_media_attachment(confluence, attachment, assemblyai_api_key, request.segmented)
+                for attachment in media_attachments
+            ))
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"ffmpeg audio extraction failed: {e}")
-        # Upload audio to AssemblyAI
-        assemblyai_api_key = os.getenv('ASSEMBLYAI_API_KEY')
-        if not assemblyai_api_key:
-            raise HTTPException(status_code=500, detail="AssemblyAI API key not configured. Please set ASSEMBLYAI_API_KEY in your environment variables.")
-        headers = {"authorization": assemblyai_api_key}
-        with open(audio_path, "rb") as f:
-            upload_response = requests.post(
-                "https://api.assemblyai.com/v2/upload",
-                headers=headers,
-                data=f
-            )
-        if upload_response.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to upload audio to AssemblyAI")
-        audio_url = upload_response.json()["upload_url"]
-        # Submit for transcription
-        transcript_request = {
-            "audio_url": audio_url,
-            "speaker_labels": True,
-            "auto_chapters": True,
-            "auto_highlights": True,
-            "entity_detection": True,
-            "sentiment_analysis": True
-        }
-        transcript_response = requests.post(
-            "https://api.assemblyai.com/v2/transcript",
-            json=transcript_request,
-            headers={**headers, "content-type": "application/json"}
-        )
-        if transcript_response.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to submit audio for transcription")
-        transcript_id = transcript_response.json()["id"]
-        # Poll for completion
-        while True:
-            polling_response = requests.get(
-                f"https://api.assemblyai.com/v2/transcript/{transcript_id}",
-                headers=headers
-            )
-            if polling_response.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to get transcription status")
-            status = polling_response.json()["status"]
-            if status == "completed":
-                break
-            elif status == "error":
-                raise HTTPException(status_code=500, detail="Transcription failed")
-            time.sleep(3)
-        transcript_data = polling_response.json()
-        transcript_text = transcript_data.get("text", "")
-        if not transcript_text:
+            raise HTTPException(status_code=500, detail=media_error_detail(e))
+        # Retrieve only the passages relevant to the question, with their word-timing ranges
+        hits = []
+        for attachment, transcript in zip(media_attachments, transcripts):
+            index = get_transcript_index(transcript)
+            hits.extend((score, passage, attachment) for passage, score in index.search(request.question, TRANSCRIPT_QA_PASSAGES))
+        if not hits:
+            # No passage shares a term with the question: fall back to the opening of each recording
+            for attachment, transcript in zip(media_attachments, transcripts):
+                hits.extend((0.0, passage, attachment) for passage in get_transcript_index(transcript).passages[:TRANSCRIPT_QA_PASSAGES])
+        if not hits:
             raise HTTPException(status_code=500, detail="No transcript text returned from AssemblyAI")
-        
-        # Initialize Gemini AI model for text generation
-        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
-        genai.configure(api_key=api_key)
-        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
-        
-        # Q&A
-        if request.question:
-            qa_prompt = (
-                f"Based on the following video transcript, answer this question: {request.question}\n\n"
-                f"Transcript: {transcript_text[:3000]}\n\n"
-                f"Provide a detailed answer based on the video content."
-            )
-            qa_response = ai_model.generate_content(qa_prompt)
-            return {"answer": qa_response.text.strip()}
-        
-        # Generate quotes
-        quote_prompt = (
-            "Extract 3-5 powerful or interesting quotes from the transcript.\n"
-            "Format each quote on a new line starting with a dash (-).\n"
-            f"Transcript:\n{transcript_text[:3000]}"
+        hits = sorted(hits, key=lambda hit: hit[0], reverse=True)[:TRANSCRIPT_QA_PASSAGES]
+        hits.sort(key=lambda hit: (media_attachments.index(hit[2]), hit[1].start_ms))
+        
+        sources = []
+        for _, passage, attachment in hits:
+            sources.append({
+                "filename": attachment['filename'],
+                "start": format_timestamp(passage.start_ms),
+                "end": format_timestamp(passage.end_ms),
+                "start_ms": passage.start_ms,
+                "end_ms": passage.end_ms,
+                "url": f"{attachment['url']}#t={passage.start_ms // 1000}",
+                "speakers": list(passage.speakers),
+                "text": passage.text
+            })
+        excerpts = "\n\n".join(
+            (f"{source['filename']} " if len(media_attachments) > 1 else "")
+            + f"{format_range(source['start_ms'], source['end_ms'])} {source['text']}"
+            for source in sources
         )
-        quotes_response = ai_model.generate_content(quote_prompt).text.strip()
-        # Split quotes into individual items
-        quotes = [quote.strip().lstrip("- ").strip() for quote in quotes_response.split('\n') if quote.strip()]
-        
-        # Generate summary WITHOUT timestamps
-        summary_prompt = (
-            "detailed paragraph summarizing the video content.\n"
-            "Do NOT include any timestamps in the summary.\n"
-            f"Transcript:\n{transcript_text[:3000]}"
+        qa_prompt = (
+            f"Based on the following excerpts from a video transcript, answer this question: {request.question}\n\n"
+            f"Excerpts (each starts with its [MM:SS-MM:SS] time range):\n{excerpts}\n\n"
+            f"Provide a detailed answer based on the video content. Cite the time range of each excerpt you use, "
+            f"exactly as written, e.g. [01:05-01:40]."
         )
-        summary = ai_model.generate_content(summary_prompt).text.strip()
-        
-        # Generate timestamps separately
-        timestamp_prompt = (
-            "Extract 5-7 important moments from the following transcript.\n"
-            "Format each moment as: [MM:SS-MM:SS] Description of what happens\n"
-            "Example: [00:15-00:30] Speaker introduces the main topic\n"
-            "Return only the timestamps, one per line.\n\n"
-            f"Transcript:\n{transcript_text[:3000]}"
-        )
-        timestamps_response = ai_model.generate_content(timestamp_prompt).text.strip()
-        # Split timestamps into individual items
-        timestamps = [ts.strip() for ts in timestamps_response.split('\n') if ts.strip()]
-        
+        qa_response = await ai_model.generate_content_async(qa_prompt)
+        return {"answer": qa_response.text.strip(), "sources": sources}
+    
+    # Transcribe and summarize every selected attachment concurrently (bounded by MEDIA_CONCURRENCY);
+    # timestamps come from word timings
+    results = await asyncio.gather(*(
+        summarize_media_attachment(confluence, attachment, assemblyai_api_key, ai_model, request.segmented)
+        for attachment in media_attachments
+    ), return_exceptions=True)
+    
+    if not request.all_media:
+        result = results[0]
+        if isinstance(result, Exception):
+            raise HTTPException(status_code=500, detail=media_error_detail(result))
         return {
-            "summary": summary,
-            "quotes": quotes,
-            "timestamps": timestamps,
+            "summary": result["summary"],
+            "quotes": result["quotes"],
+            "quote_timestamps": result["quote_timestamps"],
+            "timestamps": result["timestamps"],
+            "segments": result["segments"],
             "qa": [],
             "page_title": request.page_title,
-            "transcript": transcript_text[:1000] + "..." if len(transcript_text) > 1000 else transcript_text,
-            "video_url": full_url
+            "transcript": truncate_transcript(result["transcript_text"]),
+            "video_url": result["video_url"]
         }
+    
+    videos = []
+    for attachment, result in zip(media_attachments, results):
+        if isinstance(result, Exception):
+            print(f"Failed to summarize {attachment['filename']}: {result}")
+            videos.append({"filename": attachment['filename'], "video_url": attachment['url'], "error": media_error_detail(result)})
+            continue
+        transcript_text = result.pop("transcript_text")
+        videos.append({**result, "transcript": truncate_transcript(transcript_text)})
+    summarized = [video for video in videos if "error" not in video]
+    if not summarized:
+        raise HTTPException(status_code=500, detail=videos[0]["error"])
+    
+    # Combined digest across all recordings on the page
+    if len(summarized) == 1:
+        digest = summarized[0]["summary"]
+    else:
+        digest_prompt = (
+            "The following are summaries of the recordings attached to one Confluence page.\n"
+            "Write a combined digest: the overall themes first, then what each recording adds.\n"
+            "Refer to recordings by file name. Do NOT include timestamps.\n\n"
+            + "\n\n".join(f"{video['filename']}:\n{video['summary']}" for video in summarized)
+        )
+        try:
+            digest = (await ai_model.generate_content_async(digest_prompt)).text.strip()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Digest generation failed: {e}")
+    
+    return {
+        "summary": digest,
+        "digest": digest,
+        "videos": videos,
+        "quotes": [quote for video in summarized for quote in video["quotes"]],
+        "timestamps": [f"{video['filename']} {timestamp}" for video in summarized for timestamp in video["timestamps"]],
+        "qa": [],
+        "page_title": request.page_title
+    }
+
+
+@app.post("/assemblyai-webhook")
+async def assemblyai_webhook(req: Request, payload: dict = Body(...)):
+    """
+    Completion callback for AssemblyAI transcripts (set ASSEMBLYAI_WEBHOOK_URL to this endpoint's public URL).
+    Expects JSON: { "transcript_id": "...", "status": "completed" | "error" }
+    """
+    secret = webhook_secret()
+    # Constant-time comparison; bytes, since compare_digest rejects non-ASCII str
+    supplied = req.headers.get(WEBHOOK_SECRET_HEADER, "").encode("utf-8")
+    if secret and not hmac.compare_digest(supplied, secret.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    transcript_id = payload.get("transcript_id")
+    if not transcript_id:
+        raise HTTPException(status_code=400, detail="Missing 'transcript_id' in request body.")
+    matched = notify_transcript_webhook(transcript_id, payload.get("status", ""))
+    return {"status": "ok", "matched": matched}
 
 
 @app.post("/code-assistant")
@@ -1289,18 +1342,18 @@ async def code_assistant(request: CodeRequest, req: Request):
             raise HTTPException(status_code=400, detail="Page not found")
         
         page_id = selected_page["id"]
-        page_content = confluence.get_page_by_id(page_id, expand="body.storage")
-        context = page_content["body"]["storage"]["value"]
-        
-        # Extract visible code
-        soup = BeautifulSoup(context, "html.parser")
-        for tag in soup.find_all(['pre', 'code']):
-            code_text = tag.get_text()
-            if code_text.strip():
-                cleaned_code = code_text
-                break
+        parsed_page = get_parsed_page(confluence, page_id)
+        context = parsed_page.markup
+        
+        # Extract visible code: code macros first, then <pre>/<code> blocks, then the page text
+        macro_language = ""
+        if parsed_page.code_blocks:
+            cleaned_code = parsed_page.code_blocks[0].code
+            macro_language = parsed_page.code_blocks[0].language.lower()
+        elif parsed_page.preformatted:
+            cleaned_code = parsed_page.preformatted[0]
         else:
-            cleaned_code = soup.get_text(separator="\n").strip()
+            cleaned_code = parsed_page.text.strip()
         
         # Detect language
         def detect_language_from_content(content: str) -> str:
@@ -1320,7 +1373,7 @@ async def code_assistant(request: CodeRequest, req: Request):
                 return "javascript"
             return "text"
         
-        detected_lang = detect_language_from_content(cleaned_code)
+        detected_lang = macro_language or detect_language_from_content(cleaned_code)
         
         # Generate summary
         summary_prompt = (
@@ -1376,68 +1429,65 @@ async def impact_analyzer(request: ImpactRequest, req: Request):
         
         # Get pages
         pages = confluence.get_all_pages_from_space(space=space_key, start=0, limit=100)
-        old_page = next((p for p in pages if p["title"] == request.old_page_title), None)
-        new_page = next((p for p in pages if p["title"] == request.new_page_title), None)
-        
-        if not old_page or not new_page:
-            raise HTTPException(status_code=400, detail="One or both pages not found")
-        
-        # Extract content from pages
-        def extract_content(content):
-            soup = BeautifulSoup(content, 'html.parser')
-            # Try to find code blocks first
-            code_blocks = soup.find_all('ac:structured-macro', {'ac:name': 'code'})
-            if code_blocks:
-                return '\n'.join(
-                    block.find('ac:plain-text-body').text
-                    for block in code_blocks if block.find('ac:plain-text-body')
-                )
-            # If no code blocks, extract all text content
-            return soup.get_text(separator="\n").strip()
+        version_history_steps = []
         
-        old_raw = confluence.get_page_by_id(old_page["id"], expand="body.storage")["body"]["storage"]["value"]
-        new_raw = confluence.get_page_by_id(new_page["id"], expand="body.storage")["body"]["storage"]["value"]
-        old_content = extract_content(old_raw)
-        new_content = extract_content(new_raw)
+        if request.page_title:
+            # Version-history mode: diff version N-k of a page against version N
+            page = next((p for p in pages if p["title"] == request.page_title), None)
+            if not page:
+                raise HTTPException(status_code=400, detail="Page not found")
+            page_id = page["id"]
+            new_version = request.new_version or latest_version_number(confluence, page_id)
+            old_version = request.old_version or max(1, new_version - max(1, request.history_depth or 1))
+            if old_version >= new_version:
+                raise HTTPException(status_code=400, detail="old_version must be lower than new_version")
+            
+            # Versions and their diffs are immutable, so both are cached without expiry
+            old_content = get_page_version(confluence, page_id, old_version).content()
+            new_content = get_page_version(confluence, page_id, new_version).content()
+            diff_result = version_diff(confluence, page_id, old_version, new_version)
+            old_label = f"{request.page_title} (v{old_version})"
+            new_label = f"{request.page_title} (v{new_version})"
+            version_history_steps = version_history(confluence, page_id, old_version, new_version, MAX_VERSION_HISTORY_STEPS)
+        else:
+            if not request.old_page_title or not request.new_page_title:
+                raise HTTPException(status_code=400, detail="Provide old_page_title and new_page_title, or page_title for version history")
+            old_page = next((p for p in pages if p["title"] == request.old_page_title), None)
+            new_page = next((p for p in pages if p["title"] == request.new_page_title), None)
+            
+            if not old_page or not new_page:
+                raise HTTPException(status_code=400, detail="One or both pages not found")
+            
+            # Extract content from pages (code blocks if present, otherwise all text)
+            old_content = get_parsed_page(confluence, old_page["id"]).code_text()
+            new_content = get_parsed_page(confluence, new_page["id"]).code_text()
+            diff_result = None
+            old_label, new_label = request.old_page_title, request.new_page_title
         
         if not old_content or not new_content:
             raise HTTPException(status_code=400, detail="No content found in one or both pages")
         
-        # Generate diff
+        # Generate diff (hunks and added/removed counts come out of one pass)
         old_lines = old_content.splitlines()
         new_lines = new_content.splitlines()
-        diff = difflib.unified_diff(old_lines, new_lines, fromfile=request.old_page_title, tofile=request.new_page_title, lineterm='')
-        full_diff_text = '\n'.join(diff)
+        diff_result = diff_result or diff_lines(old_lines, new_lines)
+        full_diff_text = diff_result.unified(old_label, new_label)
         
         # Calculate metrics
-        lines_added = sum(1 for l in full_diff_text.splitlines() if l.startswith('+') and not l.startswith('+++'))
-        lines_removed = sum(1 for l in full_diff_text.splitlines() if l.startswith('-') and not l.startswith('---'))
+        lines_added = diff_result.lines_added
+        lines_removed = diff_result.lines_removed
         total_lines = len(old_lines) or 1
         percent_change = round(((lines_added + lines_removed) / total_lines) * 100, 2)
         
-        # Generate AI analysis
-        def clean_and_truncate_prompt(text, max_chars=10000):
-            text = re.sub(r'<[^>]+>', '', text)
-            text = re.sub(r'[^\x00-\x7F]+', '', text)
-            return text[:max_chars]
-        
-        safe_diff = clean_and_truncate_prompt(full_diff_text)
-        
-        # Impact analysis
-        impact_prompt = f"""Write 2 paragraphs summarizing the overall impact of the following changes between two versions of a document.
-        
-        Cover only:
-        - What was changed
-        - Which parts of the content are affected
-        - Why this matters
+        # Impact analysis: every hunk is analyzed within a per-prompt token budget
+        # (concurrently, cached per hunk group) and the results are merged
+        impact_report = await analyze_diff(diff_result, ai_model, subject="a document")
+        impact_text = impact_report.impact_analysis
         
-        Keep it within 20 sentences.
-        
-        Changes:
-        {safe_diff}"""
-        
-        impact_response = ai_model.generate_content(impact_prompt)
-        impact_text = impact_response.text.strip()
+        # Whole-diff prompts get the diff when it fits the budget, otherwise the per-hunk findings
+        safe_diff = clean_prompt_text(full_diff_text)
+        if len(safe_diff) > HUNK_TOKEN_BUDGET * CHARS_PER_TOKEN:
+            safe_diff = impact_report.digest[:HUNK_TOKEN_BUDGET * CHARS_PER_TOKEN]
         
         # Recommendations
         rec_prompt = f"""As a senior analyst, write 2 paragraphs suggesting improvements for the following changes.
@@ -1469,28 +1519,9 @@ async def impact_analyzer(request: ImpactRequest, req: Request):
             raw_risk
         )
         
-        # Generate structured risk factors (new dynamic part)
-        risk_factors_prompt = f"""
-        Analyze the following code/content diff and extract a structured list of key risk factors introduced by these changes.
-
-        Focus on identifying:
-        - Broken or removed validation
-        - Modified authentication/authorization checks
-        - Logical regressions
-        - Removed error handling
-        - Performance or scalability risks
-        - Security vulnerabilities
-        - Stability or maintainability concerns
-
-        Write each risk factor as 1 line. Avoid repeating obvious stats like line count.
-
-        Diff:
-        {safe_diff}
-        """
-
-        risk_factors_response = ai_model.generate_content(risk_factors_prompt)
-        risk_factors = risk_factors_response.text.strip().split("\n")
-        risk_factors = [re.sub(r"^[\*\-•\s]+", "", line).strip() for line in risk_factors if line.strip()]
+        # Structured risk factors and score, merged from the per-hunk analyses
+        risk_factors = impact_report.risk_factors
+        risk_score = impact_report.risk_score or min(10, max(1, round(percent_change / 10)))
 
 
 
@@ -1499,7 +1530,7 @@ async def impact_analyzer(request: ImpactRequest, req: Request):
         if getattr(request, 'enable_stack_overflow_check', True):
             # Check both old and new content for risks
             combined_content = f"{old_content}\n{new_content}"
-            stack_overflow_risks = check_stack_overflow_risks(combined_content)
+            stack_overflow_risks = await asyncio.to_thread(check_stack_overflow_risks, combined_content)
 
         # Q&A if question provided
         qa_answer = None
@@ -1529,66 +1560,221 @@ Answer:"""
             "impact_analysis": impact_text,
             "recommendations": rec_text,
             "risk_analysis": risk_text,
-            "risk_level": "low" if percent_change < 10 else "medium" if percent_change < 30 else "high",
-            "risk_score": min(10, max(1, round(percent_change / 10))),
+            "risk_level": "low" if risk_score <= 3 else "medium" if risk_score <= 6 else "high",
+            "risk_score": risk_score,
             "risk_factors": risk_factors,
             "answer": qa_answer,
             "diff": full_diff_text,
-            "stack_overflow_risks": stack_overflow_risks
+            "stack_overflow_risks": stack_overflow_risks,
+            "version_history": version_history_steps
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/direct-code-impact-analyzer")
-async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Request):
-    """Direct Code Impact Analyzer functionality - analyzes code without requiring Confluence pages"""
+@app.post("/batch-impact-analyzer")
+async def batch_impact_analyzer(request: BatchImpactRequest, req: Request):
+    """Impact analysis of every page in a space modified between two dates, ranked by risk"""
     try:
         api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
         genai.configure(api_key=api_key)
         ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
+        confluence = init_confluence()
+        space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
         
-        old_content = request.old_code
-        new_content = request.new_code
-        
-        if not old_content or not new_content:
-            raise HTTPException(status_code=400, detail="Both old and new code must be provided")
-        
-        # Generate diff
-        old_lines = old_content.splitlines()
-        new_lines = new_content.splitlines()
-        diff = difflib.unified_diff(old_lines, new_lines, fromfile="original_code", tofile="modified_code", lineterm='')
-        full_diff_text = '\n'.join(diff)
-        
-        # Calculate metrics
-        lines_added = sum(1 for l in full_diff_text.splitlines() if l.startswith('+') and not l.startswith('+++'))
-        lines_removed = sum(1 for l in full_diff_text.splitlines() if l.startswith('-') and not l.startswith('---'))
-        total_lines = len(old_lines) or 1
-        percent_change = round(((lines_added + lines_removed) / total_lines) * 100, 2)
-        
-        # Generate AI analysis
-        def clean_and_truncate_prompt(text, max_chars=10000):
-            text = re.sub(r'<[^>]+>', '', text)
-            text = re.sub(r'[^\x00-\x7F]+', '', text)
-            return text[:max_chars]
-        
-        safe_diff = clean_and_truncate_prompt(full_diff_text)
-        
-        # Impact analysis
-        impact_prompt = f"""Write 2 paragraphs summarizing the overall impact of the following changes between two versions of code.
+        return await run_batch_impact(
+            confluence, ai_model, space_key, request.since, request.until,
+            concurrency=request.concurrency or BATCH_IMPACT_CONCURRENCY,
+            max_pages=request.max_pages or BATCH_IMPACT_MAX_PAGES,
+            checkpoint=checkpoint_path(space_key, request.since, request.until),
+            resume=request.resume is not False
+        )
         
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def change_set_from_request(request: DirectCodeImpactRequest) -> List[FileChange]:
+    """The files of a multi-file request: explicit pairs, a unified diff, or two git refs"""
+    if request.files:
+        return [
+            FileChange(
+                path=file.path,
+                old_code=file.old_code or "",
+                new_code=file.new_code or "",
+                status="added" if not file.old_code else "deleted" if not file.new_code else "modified",
+                language=file.language or request.language,
+            )
+            for file in request.files
+        ]
+    if request.patch:
+        return parse_patch(request.patch)
+    if not (request.repo_path and request.base_ref and request.head_ref):
+        raise ChangeSetError("Git change sets need repo_path, base_ref and head_ref")
+    return git_change_set(request.repo_path, request.base_ref, request.head_ref, request.paths)
+
+async def analyze_change_set(request: DirectCodeImpactRequest, ai_model) -> Dict[str, Any]:
+    """Diff every file of a change set in parallel and analyze each file's hunks within the token budget"""
+    changes = await asyncio.to_thread(change_set_from_request, request)
+    if not changes:
+        raise HTTPException(status_code=400, detail="The change set has no files")
+    file_diffs = await asyncio.to_thread(diff_change_set, changes, bool(request.structural))
+    
+    # One semaphore for all files, so a 40-file change set doesn't multiply the model calls in flight
+    semaphore = asyncio.Semaphore(HUNK_ANALYSIS_CONCURRENCY)
+    changed = [file_diff for file_diff in file_diffs if file_diff.diff.hunks]
+    reports = await asyncio.gather(*(
+        analyze_diff(
+            file_diff.diff, ai_model, subject=f"code ({file_diff.change.path})",
+            context=file_diff.structure.summary() if file_diff.structure is not None else "",
+            semaphore=semaphore
+        )
+        for file_diff in changed
+    ))
+    
+    files = []
+    risk_factors = []
+    for file_diff, report in zip(changed, reports):
+        file_percent = round(((file_diff.diff.lines_added + file_diff.diff.lines_removed) / (file_diff.old_line_count or 1)) * 100, 2)
+        file_score = report.risk_score or min(10, max(1, round(file_percent / 10)))
+        files.append({
+            "path": file_diff.change.path,
+            "old_path": file_diff.change.old_path,
+            "status": file_diff.change.status,
+            "language": file_diff.language,
+            "lines_added": file_diff.diff.lines_added,
+            "lines_removed": file_diff.diff.lines_removed,
+            "percentage_change": file_percent,
+            "impact_analysis": report.impact_analysis,
+            "risk_score": file_score,
+            "risk_level": "low" if file_score <= 3 else "medium" if file_score <= 6 else "high",
+            "risk_factors": report.risk_factors,
+            "structure": file_diff.structure.summary() if file_diff.structure is not None else None
+        })
+        risk_factors.extend(f"{file_diff.change.path}: {factor}" for factor in report.risk_factors)
+    # Most severe first across files (each factor ends with its severity)
+    severity_rank = {"(High)": 0, "(Medium)": 1, "(Low)": 2}
+    risk_factors.sort(key=lambda factor: severity_rank.get(factor.rsplit(" ", 1)[-1], 1))
+    
+    budget_chars = HUNK_TOKEN_BUDGET * CHARS_PER_TOKEN
+    if len(files) > 1:
+        file_notes = "\n\n".join(f"{file['path']} ({file['status']}, +{file['lines_added']} -{file['lines_removed']}):\n{file['impact_analysis']}" for file in files)
+        reduce_prompt = f"""Write 2 paragraphs summarizing the overall impact of a change set touching {len(files)} files.
+
         Cover only:
         - What was changed
-        - Which parts of the code are affected
+        - Which parts are affected
         - Why this matters
         
         Keep it within 20 sentences.
         
-        Changes:
-        {safe_diff}"""
+        Per-file notes:
+        {clean_prompt_text(file_notes)[:budget_chars]}"""
+        async with semaphore:
+            impact_text = (await ai_model.generate_content_async(reduce_prompt)).text.strip()
+    else:
+        impact_text = files[0]["impact_analysis"] if files else "No changes were found between the two versions."
+    
+    full_diff_text = "\n".join(file_diff.unified() for file_diff in changed)
+    safe_diff = clean_prompt_text(full_diff_text)
+    if len(safe_diff) > budget_chars:
+        safe_diff = "\n\n".join(f"{file_diff.change.path}:\n{report.digest}" for file_diff, report in zip(changed, reports))[:budget_chars]
+    structure_summary = "\n".join(
+        f"{file_diff.change.path}: {file_diff.structure.summary()}" for file_diff in changed if file_diff.structure is not None
+    )
+    
+    lines_added = sum(file["lines_added"] for file in files)
+    lines_removed = sum(file["lines_removed"] for file in files)
+    total_lines = sum(file_diff.old_line_count for file_diff in file_diffs) or 1
+    return {
+        "changes": changes,
+        "files": files,
+        "files_changed": len(changed),
+        "lines_added": lines_added,
+        "lines_removed": lines_removed,
+        "percentage_change": round(((lines_added + lines_removed) / total_lines) * 100, 2),
+        "impact_analysis": impact_text,
+        "risk_factors": risk_factors,
+        "risk_score": max((file["risk_score"] for file in files), default=1),
+        "diff": full_diff_text,
+        "safe_diff": safe_diff,
+        "structure": structure_summary
+    }
+
+@app.post("/direct-code-impact-analyzer")
+async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Request):
+    """Direct Code Impact Analyzer functionality - analyzes code without requiring Confluence pages"""
+    try:
+        api_key = get_actual_api_key_from_identifier(req.headers.get('x-api-key'))
+        genai.configure(api_key=api_key)
+        ai_model = genai.GenerativeModel("models/gemini-1.5-flash-8b-latest")
         
-        impact_response = ai_model.generate_content(impact_prompt)
-        impact_text = impact_response.text.strip()
+        files = None
+        if request.files or request.patch or request.repo_path or request.base_ref or request.head_ref:
+            # Change-set mode: many files diffed in parallel, analyzed per file and aggregated
+            change_set = await analyze_change_set(request, ai_model)
+            files = change_set["files"]
+            full_diff_text = change_set["diff"]
+            safe_diff = change_set["safe_diff"]
+            structure_summary = change_set["structure"]
+            impact_text = change_set["impact_analysis"]
+            risk_factors = change_set["risk_factors"]
+            risk_score = change_set["risk_score"]
+            lines_added, lines_removed = change_set["lines_added"], change_set["lines_removed"]
+            percent_change = change_set["percentage_change"]
+            files_changed = change_set["files_changed"]
+            risk_sources = [
+                (change.path, f"{change.old_code}\n{change.new_code}", change.resolved_language())
+                for change in change_set["changes"]
+            ]
+        else:
+            old_content = request.old_code
+            new_content = request.new_code
+            
+            if not old_content or not new_content:
+                raise HTTPException(status_code=400, detail="Both old and new code must be provided")
+            
+            # Structural mode: changed functions/classes/signatures, with whitespace-only edits
+            # and import reordering left out of the line diff
+            structure = structural_diff(old_content, new_content, request.language) if request.structural else None
+            structure_summary = structure.summary() if structure is not None else ""
+            
+            # Generate diff (hunks and added/removed counts come out of one pass)
+            if structure is not None:
+                old_lines = normalized_code_lines(old_content)
+                new_lines = normalized_code_lines(new_content)
+            else:
+                old_lines = old_content.splitlines()
+                new_lines = new_content.splitlines()
+            diff_result = diff_lines(old_lines, new_lines)
+            full_diff_text = diff_result.unified("original_code", "modified_code")
+            
+            # Calculate metrics
+            lines_added = diff_result.lines_added
+            lines_removed = diff_result.lines_removed
+            total_lines = len(old_lines) or 1
+            percent_change = round(((lines_added + lines_removed) / total_lines) * 100, 2)
+            files_changed = 1
+            
+            # Impact analysis: every hunk is analyzed within a per-prompt token budget
+            # (concurrently, cached per hunk group) and the results are merged
+            impact_report = await analyze_diff(diff_result, ai_model, subject="code", context=structure_summary)
+            impact_text = impact_report.impact_analysis
+            
+            # Whole-diff prompts get the diff when it fits the budget, otherwise the per-hunk findings
+            safe_diff = clean_prompt_text(full_diff_text)
+            if len(safe_diff) > HUNK_TOKEN_BUDGET * CHARS_PER_TOKEN:
+                safe_diff = impact_report.digest[:HUNK_TOKEN_BUDGET * CHARS_PER_TOKEN]
+            
+            # Structured risk factors and score, merged from the per-hunk analyses
+            risk_factors = impact_report.risk_factors
+            risk_score = impact_report.risk_score or min(10, max(1, round(percent_change / 10)))
+            # Only the rules for the code's language; unrecognized languages get all rules
+            risk_sources = [(None, f"{old_content}\n{new_content}", normalize_language(request.language, new_content))]
+        structure_context = f"{structure_summary}\n\n" if structure_summary else ""
         
         # Recommendations
         rec_prompt = f"""As a senior developer, write 2 paragraphs suggesting improvements for the following code changes.
@@ -1608,7 +1794,7 @@ async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Req
         rec_text = rec_response.text.strip()
         
         # Risk analysis
-        risk_prompt = f"Assess the risk of each change in this code diff with severity tags (Low, Medium, High):\n\n{safe_diff}"
+        risk_prompt = f"Assess the risk of each change in this code diff with severity tags (Low, Medium, High):\n\n{structure_context}{safe_diff}"
         risk_response = ai_model.generate_content(risk_prompt)
         raw_risk = risk_response.text.strip()
         risk_text = re.sub(
@@ -1621,23 +1807,6 @@ async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Req
             raw_risk
         )
         
-        # Generate structured risk factors
-        risk_factors_prompt = f"""
-        Analyze the following code changes and extract specific risk factors. Return only a list of risk factors, one per line, starting with "- ":
-        
-        {safe_diff}
-        
-        Focus on:
-        - Breaking changes
-        - Performance impacts
-        - Security vulnerabilities
-        - Maintainability issues
-        - Compatibility problems
-        """
-        
-        risk_factors_response = ai_model.generate_content(risk_factors_prompt)
-        risk_factors = [line.strip()[2:] for line in risk_factors_response.text.strip().split('\n') if line.strip().startswith('- ')]
-        
         # QA response if question provided
         qa_answer = ""
         if request.question:
@@ -1653,25 +1822,30 @@ async def direct_code_impact_analyzer(request: DirectCodeImpactRequest, req: Req
         # Stack Overflow risk check if enabled
         stack_overflow_risks = []
         if getattr(request, 'enable_stack_overflow_check', True):
-            combined_content = f"{old_content}\n{new_content}"
-            stack_overflow_risks = check_stack_overflow_risks(combined_content)
+            stack_overflow_risks = await asyncio.to_thread(check_stack_overflow_risks, "", None, risk_sources)
         
         return {
             "lines_added": lines_added,
             "lines_removed": lines_removed,
-            "files_changed": 1,
+            "files_changed": files_changed,
             "percentage_change": percent_change,
             "impact_analysis": impact_text,
             "recommendations": rec_text,
             "risk_analysis": risk_text,
-            "risk_level": "low" if percent_change < 10 else "medium" if percent_change < 30 else "high",
-            "risk_score": min(10, max(1, round(percent_change / 10))),
+            "risk_level": "low" if risk_score <= 3 else "medium" if risk_score <= 6 else "high",
+            "risk_score": risk_score,
             "risk_factors": risk_factors,
             "answer": qa_answer,
             "diff": full_diff_text,
-            "stack_overflow_risks": stack_overflow_risks
+            "stack_overflow_risks": stack_overflow_risks,
+            "structure": structure_summary or None,
+            "files": files
         }
         
+    except HTTPException:
+        raise
+    except ChangeSetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2080,8 +2254,8 @@ async def analyze_document(request: DocumentAnalysisRequest, req: Request):
         if not document_page:
             raise HTTPException(status_code=400, detail="Document page not found")
         
-        document_data = confluence.get_page_by_id(document_page["id"], expand="body.storage")
-        document_content = document_data["body"]["storage"]["value"]
+        parsed_document = get_parsed_page(confluence, document_page["id"])
+        document_content = parsed_document.markup
         
         print(f"Found document page: {document_page['title']}, content length: {len(document_content)}")
         
@@ -2089,12 +2263,6 @@ async def analyze_document(request: DocumentAnalysisRequest, req: Request):
         attachments = get_page_attachments(confluence, document_page["id"])
         print(f"Found {len(attachments)} attachments")
         
-        # If no attachments found, try alternative method
-        if not attachments:
-            print("No attachments found with primary method, trying alternative...")
-            attachments = get_page_attachments_alternative(confluence, document_page["id"])
-            print(f"Alternative method found {len(attachments)} attachments")
-        
         # Look for document files in attachments
         document_text = ""
         for attachment in attachments:
@@ -2103,11 +2271,11 @@ async def analyze_document(request: DocumentAnalysisRequest, req: Request):
             
             print(f"Checking attachment: {file_name} with URL: {file_url}")
             
-            if any(ext in file_name for ext in ['.docx', '.doc', '.pdf', '.txt']):
+            if file_name.endswith(tuple(SUPPORTED_ATTACHMENT_EXTENSIONS)):
                 print(f"Processing document attachment: {file_name}")
                 try:
                     # Extract file extension
-                    file_extension = '.' + file_name.split('.')[-1] if '.' in file_name else '.txt'
+                    file_extension = os.path.splitext(file_name)[1] or '.txt'
                     
                     # Download and extract text from file
                     file_content = extract_text_from_file(file_url, file_extension)
@@ -2124,8 +2292,7 @@ async def analyze_document(request: DocumentAnalysisRequest, req: Request):
         if not document_text.strip():
             print("No document attachments found, using page content")
             # Clean HTML content
-            soup = BeautifulSoup(document_content, 'html.parser')
-            clean_text = soup.get_text()
+            clean_text = parsed_document.text
         else:
             # Use extracted document content
             clean_text = document_text
@@ -2133,8 +2300,7 @@ async def analyze_document(request: DocumentAnalysisRequest, req: Request):
         # If document extraction failed or returned very little content, fall back to page content
         if len(clean_text.strip()) < 100:  # Less than 100 characters
             print(f"Document extraction returned only {len(clean_text.strip())} characters, falling back to page content")
-            soup = BeautifulSoup(document_content, 'html.parser')
-            page_text = soup.get_text()
+            page_text = parsed_document.text
             if len(page_text.strip()) > len(clean_text.strip()):
                 clean_text = page_text
                 print(f"Using page content instead: {len(clean_text.strip())} characters")
@@ -2983,31 +3149,22 @@ async def get_images(space_key: Optional[str] = None, page_title: str = ""):
             raise HTTPException(status_code=404, detail=f"Page '{page_title}' not found")
         
         page_id = page["id"]
-        html_content = confluence.get_page_by_id(page_id=page_id, expand="body.export_view")["body"]["export_view"]["value"]
-        soup = BeautifulSoup(html_content, "html.parser")
+        parsed_page = get_parsed_page(confluence, page_id, representation="export_view")
         base_url = os.getenv("CONFLUENCE_BASE_URL")
         
         # Images
-        image_urls = list({
-            base_url + img["src"] if img["src"].startswith("/") else img["src"]
-            for img in soup.find_all("img") if img.get("src")
-        })
+        image_urls = list(dict.fromkeys(
+            base_url + src if src.startswith("/") else src
+            for src in parsed_page.images
+        ))
         
         # Tables (as HTML strings)
-        tables = [str(table) for table in soup.find_all("table")]
+        tables = list(parsed_page.tables)
         
         # Excel attachments
         excels = []
         try:
-            attachments = confluence.get_attachments_from_content(page_id=page_id, start=0, limit=100)
-            for att in attachments.get("results", []):
-                title = att.get("title", "")
-                if title.lower().endswith((".xls", ".xlsx")):
-                    # Compose download URL
-                    download_link = att["_links"].get("download")
-                    if download_link:
-                        url = base_url.rstrip("/") + download_link
-                        excels.append(url)
+            excels = [att["url"] for att in get_attachment_catalog(confluence, page_id) if att["extension"] in (".xls", ".xlsx")]
         except Exception as e:
             # If attachment fetch fails, just skip excels
             pass
@@ -3124,8 +3281,6 @@ async def create_chart(request: ChartRequest, req: Request):
         confluence = init_confluence()
         space_key = auto_detect_space(confluence, getattr(request, 'space_key', None))
         import pandas as pd
-        import matplotlib.pyplot as plt
-        import seaborn as sns
         from io import StringIO
         import tempfile
         import requests
@@ -3133,20 +3288,26 @@ async def create_chart(request: ChartRequest, req: Request):
         import io
         # Priority: excel_url > table_html > image_url
         df = None
+        data_hash = None
         if request.excel_url:
+            source_key = ("excel", request.excel_url)
+        elif request.table_html:
+            source_key = ("html", hashlib.sha256(request.table_html.encode("utf-8")).hexdigest())
+        else:
+            source_key = None
+        cached_source = _chart_sources.get(source_key) if source_key else None
+        if cached_source is not None:
+            df, data_hash = cached_source
+        elif request.excel_url:
             # Download and read Excel file
             auth = (os.getenv('CONFLUENCE_USER_EMAIL'), os.getenv('CONFLUENCE_API_KEY'))
             response = requests.get(request.excel_url, auth=auth)
             if response.status_code != 200:
                 raise HTTPException(status_code=404, detail="Failed to fetch Excel file")
-            excel_bytes = response.content
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_xls:
-                tmp_xls.write(excel_bytes)
-                tmp_xls.flush()
-                df = pd.read_excel(tmp_xls.name)
+            df = await asyncio.to_thread(pd.read_excel, io.BytesIO(response.content))
         elif request.table_html:
             # Parse HTML table to DataFrame
-            dfs = pd.read_html(request.table_html)
+            dfs = pd.read_html(StringIO(request.table_html))
             if not dfs:
                 raise HTTPException(status_code=400, detail="No table found in HTML")
             df = dfs[0]
@@ -3157,111 +3318,101 @@ async def create_chart(request: ChartRequest, req: Request):
             if response.status_code != 200:
                 raise HTTPException(status_code=404, detail="Failed to fetch image")
             image_bytes = response.content
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_img:
-                tmp_img.write(image_bytes)
-                tmp_img.flush()
-                uploaded_img = genai.upload_file(
-                    path=tmp_img.name,
-                    mime_type="image/png",
-                    display_name=f"chart_image_{request.page_title}.png"
+            # The table read from an image is cached by the image's content, which saves the Gemini call
+            source_key = ("image", hashlib.sha256(image_bytes).hexdigest())
+            cached_source = _chart_sources.get(source_key)
+            if cached_source is not None:
+                df, data_hash = cached_source
+            else:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_img:
+                    tmp_img.write(image_bytes)
+                    tmp_img.flush()
+                    uploaded_img = genai.upload_file(
+                        path=tmp_img.name,
+                        mime_type="image/png",
+                        display_name=f"chart_image_{request.page_title}.png"
+                    )
+                graph_prompt = (
+                    "You're looking at a Likert-style bar chart image or table. Extract the full numeric table represented by the chart.\n"
+                    "Return only the raw CSV table: no markdown, no comments, no code blocks.\n"
+                    "The first column must be the response category (e.g., Strongly Agree), followed by columns for group counts (e.g., Students, Lecturers, Staff, Total).\n"
+                    "Ensure all values are numeric and the CSV is properly aligned. Do NOT summarize—just output the table."
                 )
-            graph_prompt = (
-                "You're looking at a Likert-style bar chart image or table. Extract the full numeric table represented by the chart.\n"
-                "Return only the raw CSV table: no markdown, no comments, no code blocks.\n"
-                "The first column must be the response category (e.g., Strongly Agree), followed by columns for group counts (e.g., Students, Lecturers, Staff, Total).\n"
-                "Ensure all values are numeric and the CSV is properly aligned. Do NOT summarize—just output the table."
-            )
-            graph_response = ai_model.generate_content([uploaded_img, graph_prompt])
-            csv_text = graph_response.text.strip()
-            def clean_ai_csv(raw_text):
-                lines = raw_text.strip().splitlines()
-                clean_lines = [
-                    line.strip() for line in lines
-                    if ',' in line and not line.strip().startswith("```") and not line.lower().startswith("here")
-                ]
-                header = clean_lines[0].split(",")
-                cleaned_data = [clean_lines[0]]
-                for line in clean_lines[1:]:
-                    if line.split(",")[0] != header[0]:
-                        cleaned_data.append(line)
-                return "\n".join(cleaned_data)
-            cleaned_csv = clean_ai_csv(csv_text)
-            df = pd.read_csv(StringIO(cleaned_csv))
+                graph_response = ai_model.generate_content([uploaded_img, graph_prompt])
+                csv_text = graph_response.text.strip()
+                def clean_ai_csv(raw_text):
+                    lines = raw_text.strip().splitlines()
+                    clean_lines = [
+                        line.strip() for line in lines
+                        if ',' in line and not line.strip().startswith("```") and not line.lower().startswith("here")
+                    ]
+                    header = clean_lines[0].split(",")
+                    cleaned_data = [clean_lines[0]]
+                    for line in clean_lines[1:]:
+                        if line.split(",")[0] != header[0]:
+                            cleaned_data.append(line)
+                    return "\n".join(cleaned_data)
+                cleaned_csv = clean_ai_csv(csv_text)
+                df = pd.read_csv(StringIO(cleaned_csv))
         else:
             raise HTTPException(status_code=400, detail="No data source provided for chart generation")
-        # Clean and process DataFrame
-        for col in df.columns[1:]:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        df.dropna(subset=df.columns[1:], how='all', inplace=True)
-        if df.empty:
-            raise HTTPException(status_code=400, detail="Failed to extract chart data from provided source")
-        # Create chart based on type
-        plt.clf()
-        if request.chart_type == "Grouped Bar":
-            melted = df.melt(id_vars=[df.columns[0]], var_name="Group", value_name="Count")
-            plt.figure(figsize=(10, 6))
-            sns.barplot(data=melted, x=melted.columns[0], y="Count", hue="Group")
-            plt.xticks(rotation=45)
-            plt.title("Grouped Bar Chart")
-            plt.tight_layout()
-        elif request.chart_type == "Stacked Bar":
-            df_plot = df.set_index(df.columns[0])
-            plt.figure(figsize=(10, 6))
-            df_plot.drop(columns="Total", errors="ignore").plot(kind='bar', stacked=True)
-            plt.title("Stacked Bar Chart")
-            plt.xticks(rotation=45)
-            plt.ylabel("Count")
-            plt.tight_layout()
-        elif request.chart_type == "Line":
-            df_plot = df.set_index(df.columns[0])
-            plt.figure(figsize=(10, 6))
-            df_plot.drop(columns="Total", errors="ignore").plot(marker='o')
-            plt.title("Line Chart")
-            plt.xticks(rotation=45)
-            plt.ylabel("Count")
-            plt.tight_layout()
-        elif request.chart_type == "Pie":
-            plt.figure(figsize=(7, 6))
-            label_col = df.columns[0]
-            if "Total" in df.columns:
-                data = df["Total"]
-            else:
-                data = df.iloc[:, 1:].sum(axis=1)
-            plt.pie(data, labels=df[label_col], autopct="%1.1f%%", startangle=140)
-            plt.title("Pie Chart (Total Responses)")
-            plt.tight_layout()
+        if data_hash is None:
+            # Clean and process DataFrame
+            df = prepare_frame(df)
+            if df.empty:
+                raise HTTPException(status_code=400, detail="Failed to extract chart data from provided source")
+            data_hash = frame_hash(df)
+            _chart_sources.set(source_key, (df, data_hash))
+        if request.chart_type not in CHART_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unsupported chart type: {request.chart_type}")
+        if request.dpi is not None and not MIN_CHART_DPI <= request.dpi <= MAX_CHART_DPI:
+            raise HTTPException(status_code=400, detail=f"dpi must be between {MIN_CHART_DPI} and {MAX_CHART_DPI}")
+        if request.format.lower() == "spec":
+            # Chart.js config for the browser to draw; nothing is rendered on the server
+            spec = chart_spec(df, request.chart_type)
+            filename = f"{request.filename}.json"
+            if request.download:
+                return file_response(io.BytesIO(json.dumps(spec).encode()), "application/json", filename)
+            return {
+                "chart_spec": spec,
+                "mime_type": "application/json",
+                "filename": filename
+            }
         # Handle PowerPoint format specially
         if request.format.lower() == "pptx":
-            # Save chart as PNG first
-            buf = io.BytesIO()
-            plt.savefig(buf, format="png", bbox_inches="tight", dpi=300)
-            buf.seek(0)
-            chart_bytes = buf.getvalue()
-            chart_base64 = base64.b64encode(chart_bytes).decode()
+            # Render the chart as PNG first (on its own Figure, in a worker process; see chart_render).
+            # Without a dpi the slides reuse a PNG of this chart that is already cached, e.g. the preview
+            png_bytes = await slide_chart_png(df, request.chart_type, request.dpi, data_hash)
             
             # Create PowerPoint with the chart image
-            pptx_buffer = create_pptx_with_image(chart_base64, f"{request.chart_type} Chart")
-            pptx_bytes = pptx_buffer.getvalue()
-            pptx_base64 = base64.b64encode(pptx_bytes).decode()
+            pptx_buffer = create_pptx_with_image(png_bytes, f"{request.chart_type} Chart")
+            mime_type = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+            filename = f"{request.filename}.pptx"
+            if request.download:
+                return file_response(pptx_buffer, mime_type, filename)
+            pptx_base64 = base64.b64encode(pptx_buffer.getvalue()).decode()
             
             return {
                 "chart_data": pptx_base64,
-                "mime_type": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-                "filename": f"{request.filename}.pptx"
+                "mime_type": mime_type,
+                "filename": filename
             }
         else:
             # Save chart to bytes for other formats
-            buf = io.BytesIO()
-            plt.savefig(buf, format=request.format.lower(), bbox_inches="tight")
-            buf.seek(0)
-            chart_bytes = buf.getvalue()
+            buf = io.BytesIO(await cached_chart(df, request.chart_type, request.format, request.dpi, data_hash))
+            mime_type = chart_mime(request.format)
+            filename = f"{request.filename}.{request.format.lower()}"
+            if request.download:
+                return file_response(buf, mime_type, filename)
             # Convert to base64 for response
-            chart_base64 = base64.b64encode(chart_bytes).decode()
+            chart_base64 = base64.b64encode(buf.getvalue()).decode()
             return {
                 "chart_data": chart_base64,
-                "mime_type": f"image/{request.format.lower()}",
-                "filename": f"{request.filename}.{request.format.lower()}"
+                "mime_type": mime_type,
+                "filename": filename
             }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -3282,98 +3433,52 @@ async def export_content(request: ExportRequest, req: Request):
         # Clean content
         content = request.content.strip()
         
-        if request.format.lower() == "pdf":
-            try:
-                print(f"Creating PDF for content length: {len(content)}")
-                buffer = create_pdf(content)
-                file_data = buffer.getvalue()
-                print(f"PDF generated, size: {len(file_data)} bytes")
-                if not file_data:
-                    raise Exception("PDF generation returned empty data")
-                encoded_data = base64.b64encode(file_data).decode('utf-8')
-                print(f"PDF base64 encoded, length: {len(encoded_data)}")
-                return {
-                    "file": encoded_data, 
-                    "mime": "application/pdf", 
-                    "filename": f"{request.filename}.pdf"
-                }
-            except Exception as pdf_error:
-                print(f"PDF export error: {pdf_error}")
-                print(f"Error type: {type(pdf_error)}")
-                import traceback
-                print(f"Traceback: {traceback.format_exc()}")
-                # Create a fallback PDF with error message
-                try:
-                    fallback_content = f"PDF Export Error\n\nOriginal content could not be exported.\nError: {str(pdf_error)}\n\nContent preview:\n{content[:500]}..."
-                    buffer = create_pdf(fallback_content)
-                    file_data = buffer.getvalue()
-                    return {
-                        "file": base64.b64encode(file_data).decode('utf-8'), 
-                        "mime": "application/pdf", 
-                        "filename": f"{request.filename}.pdf"
-                    }
-                except Exception as fallback_error:
-                    print(f"Fallback PDF also failed: {fallback_error}")
-                    # Return a simple text response instead
-                    return {
-                        "file": base64.b64encode(f"PDF Export Failed: {str(pdf_error)}".encode('utf-8')).decode('utf-8'),
-                        "mime": "text/plain",
-                        "filename": f"{request.filename}.txt"
-                    }
-        elif request.format.lower() == "docx":
-            buffer = create_docx(content)
-            file_data = buffer.getvalue()
-            return {
-                "file": base64.b64encode(file_data).decode('utf-8'), 
-                "mime": "application/vnd.openxmlformats-officedocument.wordprocessingml.document", 
-                "filename": f"{request.filename}.docx"
-            }
-        elif request.format.lower() == "pptx":
-            buffer = create_pptx(content)
-            file_data = buffer.getvalue()
-            return {
-                "file": base64.b64encode(file_data).decode('utf-8'), 
-                "mime": "application/vnd.openxmlformats-officedocument.presentationml.presentation", 
-                "filename": f"{request.filename}.pptx"
-            }
-        elif request.format.lower() == "csv":
-            buffer = create_csv(content)
-            file_data = buffer.getvalue()
-            return {
-                "file": file_data.decode('utf-8'), 
-                "mime": "text/csv", 
-                "filename": f"{request.filename}.csv"
-            }
-        elif request.format.lower() == "json":
-            buffer = create_json(content)
-            file_data = buffer.getvalue()
-            return {
-                "file": file_data.decode('utf-8'), 
-                "mime": "application/json", 
-                "filename": f"{request.filename}.json"
-            }
-        elif request.format.lower() == "html":
-            buffer = create_html(content)
-            file_data = buffer.getvalue()
-            return {
-                "file": file_data.decode('utf-8'), 
-                "mime": "text/html", 
-                "filename": f"{request.filename}.html"
-            }
-        else:  # txt/markdown
-            buffer = create_txt(content)
-            file_data = buffer.getvalue()
-            return {
-                "file": file_data.decode('utf-8'), 
-                "mime": "text/plain", 
-                "filename": f"{request.filename}.txt"
-            }
+        buffer, mime, extension = await render_export(content, request.format.lower())
+        filename = f"{request.filename}.{extension}"
+        
+        if request.download:
+            # The file itself, streamed straight from the buffer it was rendered into
+            return file_response(buffer, mime, filename)
+        
+        # JSON shape kept for older clients: binary formats base64-encoded, text formats as text
+        file_data = buffer.getvalue()
+        if extension in BINARY_EXPORT_EXTENSIONS:
+            return {"file": base64.b64encode(file_data).decode('utf-8'), "mime": mime, "filename": filename}
+        return {"file": file_data.decode('utf-8'), "mime": mime, "filename": filename}
     except HTTPException:
         raise
     except Exception as e:
         print(f"Export error: {e}")
         raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
 
+@app.post("/export-batch")
+async def export_batch(request: BatchExportRequest, req: Request):
+    """Export many contents and formats as one ZIP, streamed while the files are rendered"""
+    try:
+        if not request.items:
+            raise HTTPException(status_code=400, detail="No items to export")
+        if len(request.items) > MAX_BATCH_EXPORT_ITEMS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_EXPORT_ITEMS} items can be exported at once")
+        items = []
+        for number, item in enumerate(request.items, start=1):
+            if not item.content or not item.content.strip():
+                raise HTTPException(status_code=400, detail=f"Item {number}: content cannot be empty")
+            if not item.format:
+                raise HTTPException(status_code=400, detail=f"Item {number}: format must be specified")
+            items.append(ExportItem(item.content.strip(), item.format.lower(), item.filename or "export"))
+        
+        print(f"Batch export of {len(items)} items")
+        return StreamingResponse(
+            stream_zip(items, render_export, BATCH_EXPORT_CONCURRENCY),
+            media_type="application/zip",
+            headers={"Content-Disposition": content_disposition(f"{request.archive_name or 'exports'}.zip")}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Batch export error: {e}")
+        raise HTTPException(status_code=500, detail=f"Batch export failed: {str(e)}")
+
 @app.post("/save-to-confluence")
 async def save_to_confluence(request: SaveToConfluenceRequest, req: Request):
     """
@@ -3635,9 +3740,9 @@ async def debug_attachments(space_key: str, page_title: str):
         
         page_id = selected_page["id"]
         
-        # Try both methods
-        attachments1 = get_page_attachments(confluence, page_id)
-        attachments2 = get_page_attachments_alternative(confluence, page_id)
+        # Full catalog and the subset we can extract text from
+        catalog = get_attachment_catalog(confluence, page_id)
+        supported_attachments = get_page_attachments(confluence, page_id)
         
         # Get raw page data
         page_data = confluence.get_page_by_id(page_id, expand="children.attachment")
@@ -3645,8 +3750,8 @@ async def debug_attachments(space_key: str, page_title: str):
         return {
             "page_id": page_id,
             "page_title": page_title,
-            "method1_attachments": attachments1,
-            "method2_attachments": attachments2,
+            "attachment_catalog": catalog,
+            "supported_attachments": supported_attachments,
             "raw_page_data": page_data
         }
         
@@ -3673,8 +3778,6 @@ async def debug_document_analysis(space_key: str, page_title: str):
         
         # Get attachments
         attachments = get_page_attachments(confluence, page["id"])
-        if not attachments:
-            attachments = get_page_attachments_alternative(confluence, page["id"])
         
         # Try to extract content from first document attachment
         extracted_content = ""
@@ -3683,9 +3786,9 @@ async def debug_document_analysis(space_key: str, page_title: str):
                 file_name = attachment.get('filename', '').lower()
                 file_url = attachment.get('url', '')
                 
-                if any(ext in file_name for ext in ['.docx', '.doc', '.pdf', '.txt']):
+                if file_name.endswith(tuple(SUPPORTED_ATTACHMENT_EXTENSIONS)):
                     try:
-                        file_extension = file_name.split('.')[-1] if '.' in file_name else 'txt'
+                        file_extension = os.path.splitext(file_name)[1] or '.txt'
                         file_content = extract_text_from_file(file_url, file_extension)
                         if file_content:
                             extracted_content = file_content[:500] + "..." if len(file_content) > 500 else file_content
@@ -3702,7 +3805,7 @@ async def debug_document_analysis(space_key: str, page_title: str):
             "attachments": attachments,
             "attachment_count": len(attachments),
             "extracted_content_preview": extracted_content,
-            "has_document_files": any(any(ext in att.get('filename', '').lower() for ext in ['.docx', '.doc', '.pdf', '.txt']) for att in attachments)
+            "has_document_files": any(att.get('filename', '').lower().endswith(tuple(SUPPORTED_ATTACHMENT_EXTENSIONS)) for att in attachments)
         }
     except Exception as e:
         return {"error": str(e), "traceback": traceback.format_exc()}
@@ -0,0 +1,131 @@
+"""
+The document tree the exporters render from.
+
+AI responses are markdown: headings, paragraphs with **bold**, *italic* and `code`, bullet
+and numbered lists, fenced code blocks and pipe tables. parse_document splits a response
+into a flat list of blocks once and caches the result by content hash, so exporting the
+same answer as PDF, DOCX, slides and CSV parses it a single time.
+"""
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from caching import LRUCache
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$")
+_BULLET_RE = re.compile(r"^(\s*)([-*+•]|\d+[.)])\s+(.*)$")
+_TABLE_SEPARATOR_RE = re.compile(r"^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$")
+_RULE_RE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+_INLINE_RE = re.compile(r"(\*\*.+?\*\*|__.+?__|`[^`]+`|(?<![\w*])\*(?!\s).+?(?<!\s)\*(?!\w)|(?<!\w)_(?!\s).+?(?<!\s)_(?!\w))")
+
+# content hash -> parsed blocks; blocks are shared between renderers and never modified
+_documents = LRUCache(max_entries=64)
+
+
+@dataclass
+class Block:
+    kind: str  # heading | paragraph | item | code | table | rule | blank
+    text: str = ""
+    level: int = 0  # heading level, or list nesting depth
+    marker: str = ""  # list marker ("•", "1.")
+    lines: List[str] = field(default_factory=list)  # code lines
+    rows: List[List[str]] = field(default_factory=list)  # table rows, header first
+
+    @property
+    def ordered(self) -> bool:
+        return self.marker[:1].isdigit()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def parse_document(text: str) -> List[Block]:
+    """Blocks of a markdown text, parsed once per distinct content"""
+    key = content_hash(text)
+    blocks = _documents.get(key)
+    if blocks is None:
+        blocks = parse_blocks(text)
+        _documents.set(key, blocks)
+    return blocks
+
+
+def parse_blocks(text: str) -> List[Block]:
+    """Split markdown into blocks; consecutive text lines become one paragraph"""
+    blocks: List[Block] = []
+    lines = text.replace("\r\n", "\n").replace("\t", "    ").split("\n")
+    paragraph: List[str] = []
+
+    def flush_paragraph():
+        if paragraph:
+            blocks.append(Block("paragraph", " ".join(part.strip() for part in paragraph)))
+            paragraph.clear()
+
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            flush_paragraph()
+            code = []
+            index += 1
+            while index < len(lines) and not lines[index].strip().startswith("```"):
+                code.append(lines[index])
+                index += 1
+            blocks.append(Block("code", lines=code))
+        elif stripped.startswith("|") and index + 1 < len(lines) and _TABLE_SEPARATOR_RE.match(lines[index + 1]):
+            flush_paragraph()
+            rows = [_table_cells(line)]
+            index += 2
+            while index < len(lines) and lines[index].strip().startswith("|"):
+                rows.append(_table_cells(lines[index]))
+                index += 1
+            blocks.append(Block("table", rows=rows))
+            continue
+        elif not stripped:
+            flush_paragraph()
+            if blocks and blocks[-1].kind != "blank":
+                blocks.append(Block("blank"))
+        elif _HEADING_RE.match(stripped):
+            flush_paragraph()
+            marks, heading = _HEADING_RE.match(stripped).groups()
+            blocks.append(Block("heading", heading.strip("# "), level=len(marks)))
+        elif _RULE_RE.match(stripped):
+            flush_paragraph()
+            blocks.append(Block("rule"))
+        elif _BULLET_RE.match(line):
+            flush_paragraph()
+            indent, marker, item = _BULLET_RE.match(line).groups()
+            blocks.append(Block("item", item, level=len(indent) // 2, marker=marker if marker[0].isdigit() else "•"))
+        else:
+            paragraph.append(line)
+        index += 1
+    flush_paragraph()
+    return blocks
+
+
+def _table_cells(line: str) -> List[str]:
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def inline_runs(text: str) -> List[Tuple[str, str]]:
+    """(style, text) runs for **bold**, *italic* / _italic_ and `code` spans"""
+    runs = []
+    for part in _INLINE_RE.split(text):
+        if not part:
+            continue
+        if part.startswith(("**", "__")) and len(part) > 4:
+            runs.append(("B", part[2:-2]))
+        elif part.startswith("`") and len(part) > 2:
+            runs.append(("mono", part[1:-1]))
+        elif part[0] in "*_" and part[-1] == part[0] and len(part) > 2:
+            runs.append(("I", part[1:-1]))
+        else:
+            runs.append(("", part))
+    return runs
+
+
+def plain_text(text: str) -> str:
+    """Inline text without its markdown markers"""
+    return "".join(run for _, run in inline_runs(text))
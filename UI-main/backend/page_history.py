@@ -0,0 +1,141 @@
+"""
+Confluence page version history for the impact analyzer.
+
+Historical versions are fetched through the content API (status=historical&version=N).
+A published version never changes, so version bodies and the diffs between them are cached
+without expiry; reviewing a page's last N edits only fetches versions not seen before.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from caching import LRUCache
+from diff_engine import DiffResult, diff_lines
+from storage_parser import parse_page
+
+# Bounded by entry count only: immutable versions are never invalidated
+_page_versions = LRUCache(max_entries=2048)
+_version_diffs = LRUCache(max_entries=2048)
+VERSION_LIST_PAGE_SIZE = 200
+
+
+@dataclass(frozen=True)
+class PageVersion:
+    page_id: str
+    number: int
+    title: str
+    markup: str
+    when: str = ""
+    author: str = ""
+    message: str = ""
+
+    def content(self) -> str:
+        """Code blocks if the version has any, otherwise its text (what the impact analyzer diffs)"""
+        return parse_page(self.markup, cache_key=(self.page_id, self.number, "storage")).code_text()
+
+
+def latest_version_number(confluence, page_id: str) -> int:
+    """The current version number of a page (always fetched, since it moves)"""
+    page_data = confluence.get_page_by_id(page_id, expand="version")
+    return page_data["version"]["number"]
+
+
+def get_page_version(confluence, page_id: str, number: int) -> PageVersion:
+    """Fetch one version of a page, from cache when it was fetched before"""
+    page_id = str(page_id)
+    key = (page_id, number)
+    version = _page_versions.get(key)
+    if version is not None:
+        return version
+    page_data = confluence.get_page_by_id(page_id, expand="body.storage,version", status="historical", version=number)
+    version_info = page_data.get("version", {})
+    if version_info.get("number") not in (None, number):
+        raise ValueError(f"Confluence returned version {version_info.get('number')} of page {page_id} instead of {number}")
+    version = PageVersion(
+        page_id=page_id,
+        number=number,
+        title=page_data.get("title", ""),
+        markup=page_data.get("body", {}).get("storage", {}).get("value", ""),
+        when=version_info.get("when", ""),
+        author=version_info.get("by", {}).get("displayName", ""),
+        message=version_info.get("message", ""),
+    )
+    _page_versions.set(key, version)
+    return version
+
+
+def _published_at(when: str) -> Optional[datetime]:
+    """A version's "when" (ISO 8601, e.g. 2026-10-18T09:30:00.000Z) as an aware datetime"""
+    try:
+        moment = datetime.fromisoformat(when.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def version_before(confluence, page_id: str, moment: datetime, latest: int) -> int:
+    """
+    Number of the last version of a page published before moment (an aware datetime), or 0
+    when the page was created after it. Reads the version list (newest first, one request per
+    VERSION_LIST_PAGE_SIZE versions); where that isn't available, walks back version by version.
+    """
+    page_id = str(page_id)
+    try:
+        start = 0
+        while True:
+            response = confluence.get(f"rest/api/content/{page_id}/version",
+                                      params={"start": start, "limit": VERSION_LIST_PAGE_SIZE}) or {}
+            results = response.get("results", [])
+            for entry in results:
+                published = _published_at(entry.get("when", ""))
+                if published is not None and published < moment and entry.get("number", latest) <= latest:
+                    return entry["number"]
+            if not results and not start:
+                break  # no version list: walk back below
+            if not results or "next" not in response.get("_links", {}):
+                return 0
+            start += len(results)
+    except Exception as e:
+        print(f"Version list of page {page_id} unavailable ({e}); walking back through versions")
+    for number in range(latest, 0, -1):
+        published = _published_at(get_page_version(confluence, page_id, number).when)
+        if published is not None and published < moment:
+            return number
+    return 0
+
+
+def version_diff(confluence, page_id: str, old_number: int, new_number: int) -> DiffResult:
+    """Diff the analyzed content of two versions of a page (cached per version pair)"""
+    key = (str(page_id), old_number, new_number)
+    result = _version_diffs.get(key)
+    if result is None:
+        old_content = get_page_version(confluence, page_id, old_number).content()
+        new_content = get_page_version(confluence, page_id, new_number).content()
+        result = diff_lines(old_content.splitlines(), new_content.splitlines())
+        _version_diffs.set(key, result)
+    return result
+
+
+def version_history(confluence, page_id: str, old_number: int, new_number: int,
+                    max_steps: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Per-edit summary between two versions: one entry per consecutive pair (v-1 -> v),
+    newest last. Only the most recent max_steps edits are included when given.
+    """
+    first = old_number + 1
+    if max_steps is not None:
+        first = max(first, new_number - max_steps + 1)
+    history = []
+    for number in range(first, new_number + 1):
+        version = get_page_version(confluence, page_id, number)
+        step = version_diff(confluence, page_id, number - 1, number)
+        history.append({
+            "from_version": number - 1,
+            "to_version": number,
+            "when": version.when,
+            "author": version.author,
+            "message": version.message,
+            "lines_added": step.lines_added,
+            "lines_removed": step.lines_removed,
+        })
+    return history
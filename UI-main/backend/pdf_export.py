@@ -0,0 +1,372 @@
+"""
+PDF rendering for exports, with Unicode text and markdown structure.
+
+A TrueType font (DejaVu by default; PDF_FONT_PATH for other scripts) is parsed once per
+process and copied into each document. Markdown headings, paragraphs with **bold**,
+*italic* and `code`, bullet and numbered lists, code blocks and tables (the blocks of
+markdown_document) are laid out with a line breaker that works from cached glyph widths.
+Each wrapped line is placed directly with FPDF.text, which avoids fpdf2's per-character
+multi_cell line breaking, the slow part for long reports. Rendering runs in a worker
+process, so long documents don't hold the event loop or the GIL.
+"""
+import asyncio
+import copy
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from fontTools import ttLib
+from fpdf import FPDF
+
+from markdown_document import Block, inline_runs, parse_document
+
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+# Regular font to use instead of DejaVu Sans (e.g. a Noto font for CJK); used for all styles
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH")
+PDF_FONT_DIR = os.getenv("PDF_FONT_DIR")
+_SYSTEM_FONT_DIR = "/usr/share/fonts/truetype/dejavu"
+
+# Page geometry in mm (A4)
+PAGE_WIDTH = 210.0
+PAGE_HEIGHT = 297.0
+MARGIN = 15.0
+BODY_SIZE = 11.0
+CODE_SIZE = 9.0
+HEADING_SIZES = {1: 18.0, 2: 15.0, 3: 13.0}
+LINE_SPACING = 1.35
+LIST_INDENT = 6.0
+PT_TO_MM = 25.4 / 72
+
+_DEJAVU_FILES = {
+    "": "DejaVuSans.ttf",
+    "B": "DejaVuSans-Bold.ttf",
+    "I": "DejaVuSans-Oblique.ttf",
+    "BI": "DejaVuSans-BoldOblique.ttf",
+    "mono": "DejaVuSansMono.ttf",
+}
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+@lru_cache(maxsize=1)
+def font_files() -> Dict[str, str]:
+    """Style -> TTF path; empty when no TrueType font is available (core fonts are used then)"""
+    if PDF_FONT_PATH and os.path.exists(PDF_FONT_PATH):
+        return {style: PDF_FONT_PATH for style in _DEJAVU_FILES}
+    directories = [PDF_FONT_DIR] if PDF_FONT_DIR else []
+    try:
+        import matplotlib
+        directories.append(os.path.join(matplotlib.get_data_path(), "fonts", "ttf"))
+    except ImportError:
+        pass
+    directories.append(_SYSTEM_FONT_DIR)
+    for directory in directories:
+        regular = os.path.join(directory, _DEJAVU_FILES[""])
+        if os.path.exists(regular):
+            files = {}
+            for style, name in _DEJAVU_FILES.items():
+                path = os.path.join(directory, name)
+                files[style] = path if os.path.exists(path) else regular
+            return files
+    print("No TrueType font found for PDF export; falling back to latin-1 core fonts")
+    return {}
+
+
+@lru_cache(maxsize=1)
+def _template() -> FPDF:
+    """An empty document with the fonts registered; parsing a TTF takes ~0.1s, copying it ~0.02s"""
+    pdf = FPDF(unit="mm", format="A4")
+    pdf.set_auto_page_break(False)
+    pdf.set_margins(MARGIN, MARGIN, MARGIN)
+    files = font_files()
+    if files:
+        for style in ("", "B", "I", "BI"):
+            pdf.add_font("Body", style, files[style])
+        pdf.add_font("Mono", "", files["mono"])
+    return pdf
+
+
+class _Fonts:
+    """Selects fonts by run style and measures text from cached glyph widths"""
+
+    def __init__(self, pdf: FPDF):
+        self.pdf = pdf
+        self.unicode = bool(font_files())
+        self._widths: Dict[str, Dict] = {}
+        self._text_widths: Dict[str, Dict[str, float]] = {}
+        self._current: Optional[Tuple[str, float]] = None
+
+    def family(self, style: str) -> Tuple[str, str]:
+        if self.unicode:
+            return ("Mono", "") if style == "mono" else ("Body", style)
+        return ("Courier", "") if style == "mono" else ("Helvetica", style)
+
+    def use(self, style: str, size: float) -> None:
+        if self._current != (style, size):
+            family, font_style = self.family(style)
+            self.pdf.set_font(family, font_style, size)
+            self._current = (style, size)
+            self._widths.setdefault(style, self.pdf.current_font.cw)
+
+    def clean(self, style: str, text: str) -> str:
+        """Drop characters the font has no glyph for (e.g. emoji) instead of rendering boxes; call after use()"""
+        widths = self._widths[style]
+        if self.unicode:
+            return "".join(char for char in text if ord(char) in widths)
+        return text.encode("latin-1", "replace").decode("latin-1")
+
+    def width(self, style: str, text: str, size: float) -> float:
+        # Widths at size 1 are memoized per style; the same words come up again and again
+        cache = self._text_widths.setdefault(style, {})
+        units = cache.get(text)
+        if units is None:
+            widths = self._widths[style]
+            if self.unicode:
+                units = sum(widths.get(ord(char), 0) for char in text)
+            else:
+                units = sum(widths.get(char, 500) for char in text)
+            cache[text] = units
+        return units * size / 1000 * PT_TO_MM
+
+
+class _Layout:
+    def __init__(self, pdf: FPDF):
+        self.pdf = pdf
+        self.fonts = _Fonts(pdf)
+        self.y = PAGE_HEIGHT  # forces the first page
+        self.bottom = PAGE_HEIGHT - MARGIN
+
+    def ensure(self, height: float) -> None:
+        if self.y + height > self.bottom:
+            self.pdf.add_page()
+            self.y = MARGIN
+
+    def wrap(self, runs: List[Tuple[str, str]], width: float, size: float) -> List[List[Tuple[str, str]]]:
+        """Greedy word wrap of styled runs into lines of at most width mm"""
+        lines: List[List[Tuple[str, str]]] = [[]]
+        line_width = 0.0
+        for style, text in runs:
+            self.fonts.use(style, size)
+            text = self.fonts.clean(style, text)
+            for word in re.findall(r"\S+\s*|\s+", text):
+                word_width = self.fonts.width(style, word, size)
+                if line_width + self.fonts.width(style, word.rstrip(), size) > width and line_width > 0:
+                    lines.append([])
+                    line_width = 0.0
+                    word = word.lstrip()
+                    word_width = self.fonts.width(style, word, size)
+                while word_width > width and len(word) > 1:
+                    # A word wider than the line is broken after the last character that fits
+                    cut, used = len(word) - 1, 0.0
+                    for position, char in enumerate(word):
+                        used += self.fonts.width(style, char, size)
+                        if used > width:
+                            cut = max(1, position)
+                            break
+                    lines[-1].append((style, word[:cut]))
+                    lines.append([])
+                    word = word[cut:]
+                    word_width = self.fonts.width(style, word, size)
+                    line_width = 0.0
+                if word:
+                    line = lines[-1]
+                    if line and line[-1][0] == style:
+                        # Same-style words share one text operation
+                        line[-1] = (style, line[-1][1] + word)
+                    else:
+                        line.append((style, word))
+                    line_width += word_width
+        return [line for line in lines if line] or [[]]
+
+    def draw_line(self, line: List[Tuple[str, str]], x: float, size: float, height: float) -> None:
+        self.ensure(height)
+        baseline = self.y + height * 0.75
+        for style, text in line:
+            self.fonts.use(style, size)
+            if text.strip():
+                self.pdf.text(x, baseline, text)
+            x += self.fonts.width(style, text, size)
+        self.y += height
+
+    def flow(self, runs: List[Tuple[str, str]], x: float, size: float, first_prefix: str = "") -> None:
+        height = size * PT_TO_MM * LINE_SPACING
+        width = PAGE_WIDTH - MARGIN - x
+        for number, line in enumerate(self.wrap(runs, width, size)):
+            if number == 0 and first_prefix:
+                self.ensure(height)
+                self.fonts.use("", size)
+                self.pdf.text(x - LIST_INDENT + 1, self.y + height * 0.75, first_prefix)
+            self.draw_line(line, x, size, height)
+
+    def code(self, lines: List[str]) -> None:
+        height = CODE_SIZE * PT_TO_MM * LINE_SPACING
+        width = PAGE_WIDTH - 2 * MARGIN - 4
+        self.y += 1
+        for source_line in lines or [""]:
+            for line in self.wrap([("mono", source_line.replace(" ", " "))], width, CODE_SIZE):
+                self.ensure(height)
+                self.pdf.set_fill_color(243, 243, 243)
+                self.pdf.rect(MARGIN, self.y, PAGE_WIDTH - 2 * MARGIN, height, style="F")
+                self.draw_line(line, MARGIN + 2, CODE_SIZE, height)
+        self.y += 2
+
+    def table(self, rows: List[List[str]]) -> None:
+        columns = max(len(row) for row in rows)
+        rows = [row + [""] * (columns - len(row)) for row in rows]
+        size = BODY_SIZE - 1
+        height = size * PT_TO_MM * LINE_SPACING
+        total = PAGE_WIDTH - 2 * MARGIN
+        # Column widths follow the longest cell of each column, with a floor so no column collapses
+        longest = [max(len(row[column]) for row in rows) + 2 for column in range(columns)]
+        widths = [max(total * length / sum(longest), min(18.0, total / columns)) for length in longest]
+        scale = total / sum(widths)
+        widths = [width * scale for width in widths]
+        self.pdf.set_draw_color(180, 180, 180)
+        for number, row in enumerate(rows):
+            style = "B" if number == 0 else ""
+            cells = [self.wrap(inline_runs(cell) if style == "" else [("B", cell)], width - 2, size)
+                     for cell, width in zip(row, widths)]
+            row_height = max(len(cell) for cell in cells) * height + 1
+            self.ensure(row_height)
+            top = self.y
+            x = MARGIN
+            for cell, width in zip(cells, widths):
+                if number == 0:
+                    self.pdf.set_fill_color(230, 236, 245)
+                    self.pdf.rect(x, top, width, row_height, style="DF")
+                else:
+                    self.pdf.rect(x, top, width, row_height)
+                self.y = top + 0.5
+                for line in cell:
+                    self.draw_line(line, x + 1, size, height)
+                x += width
+            self.y = top + row_height
+        self.y += 2
+
+
+def _render(layout: _Layout, blocks: List[Block]) -> None:
+    body_height = BODY_SIZE * PT_TO_MM * LINE_SPACING
+    for block in blocks:
+        if block.kind == "heading":
+            size = HEADING_SIZES.get(block.level, BODY_SIZE + 1)
+            layout.y += size * PT_TO_MM * 0.5
+            # Keep a heading on the same page as at least two lines of what follows
+            layout.ensure(size * PT_TO_MM * LINE_SPACING + 2 * body_height)
+            layout.flow([("B", text) for _, text in inline_runs(block.text)], MARGIN, size)
+            layout.y += 1
+        elif block.kind == "paragraph":
+            layout.flow(inline_runs(block.text), MARGIN, BODY_SIZE)
+            layout.y += 1.5
+        elif block.kind == "item":
+            x = MARGIN + LIST_INDENT * (block.level + 1)
+            layout.flow(inline_runs(block.text), x, BODY_SIZE, first_prefix=block.marker)
+        elif block.kind == "code":
+            layout.code(block.lines)
+        elif block.kind == "table":
+            layout.table(block.rows)
+        elif block.kind == "rule":
+            layout.ensure(4)
+            layout.pdf.set_draw_color(180, 180, 180)
+            layout.pdf.line(MARGIN, layout.y + 2, PAGE_WIDTH - MARGIN, layout.y + 2)
+            layout.y += 4
+        elif block.kind == "blank":
+            layout.y += body_height * 0.4
+
+
+def render_pdf(document: Union[str, List[Block]]) -> bytes:
+    """Render markdown text, or its parsed blocks (see markdown_document), to PDF bytes"""
+    if isinstance(document, str):
+        document = parse_document(document)
+    if not any(block.kind != "blank" for block in document):
+        document = parse_document("No content to export")
+    pdf = copy.deepcopy(_template())
+    layout = _Layout(pdf)
+    _render(layout, document)
+    for font in pdf.fonts.values():
+        if getattr(font, "ttfont", None) is not None:
+            # Copies of the template share its fontTools font, and output() subsets the font in
+            # place; each document gets its own (lazily loaded, so this is cheap)
+            font.ttfont = ttLib.TTFont(font.ttffile, recalcTimestamp=False,
+                                       fontNumber=font.collection_font_number, lazy=True)
+    return bytes(pdf.output())
+
+
+def _warm_worker() -> None:
+    _template()
+
+
+def _worker_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS, initializer=_warm_worker)
+    return _pool
+
+
+async def render_pdf_async(document: Union[str, List[Block]], render: Callable[..., bytes] = render_pdf) -> bytes:
+    """render_pdf in a worker process; in-process (off the event loop) if the pool is unavailable"""
+    global _pool
+    loop = asyncio.get_running_loop()
+    if PDF_RENDER_WORKERS > 0:
+        try:
+            return await loop.run_in_executor(_worker_pool(), render, document)
+        except BrokenProcessPool:
+            print("PDF worker pool broke; rendering in-process")
+            _pool = None
+    return await asyncio.to_thread(render, document)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    section = "\n".join([
+        "## Section {n}: Überblick — résumé, naïve café, Ελληνικά, Русский",
+        "This paragraph mixes **bold findings**, *emphasis* and `inline_code()` across a line long enough "
+        "to wrap a few times on an A4 page, the way AI-generated reports usually look. 🚀 Emoji are dropped.",
+        "",
+        "- First point with **details** about the change",
+        "- Second point",
+        "  - Nested point, 1.5× faster",
+        "1. Numbered step",
+        "",
+        "```python",
+        "def analyze(items):",
+        "    return [item for item in items if item.risk > 3]  # keep risky ones",
+        "```",
+        "",
+        "| Metric | Before | After | Note |",
+        "|---|---|---|---|",
+        "| Latency | 120 ms | 45 ms | p95 over 24h |",
+        "| Errors | 0.4% | 0.1% | after the retry fix |",
+        "",
+    ])
+    # Roughly 3 sections per page
+    document = "# Benchmark report\n\n" + "\n".join(section.replace("{n}", str(n)) for n in range(pages * 3))
+
+    started = time.perf_counter()
+    output = render_pdf(document)
+    elapsed = time.perf_counter() - started
+    page_count = len(re.findall(rb"/Type\s*/Page\b(?!s)", output))
+    print(f"pdf_export: {len(document)} chars -> {len(output) / 1024:.0f} KB, ~{page_count} pages in {elapsed:.2f}s")
+
+    started = time.perf_counter()
+    render_pdf(document)
+    print(f"second render (fonts already loaded): {time.perf_counter() - started:.2f}s")
+
+    if "--legacy" in sys.argv:
+        # The previous approach: latin-1 text, one multi_cell per line
+        started = time.perf_counter()
+        legacy = FPDF()
+        legacy.add_page()
+        legacy.set_auto_page_break(auto=True, margin=15)
+        legacy.set_font("Helvetica", size=12)
+        for line in document.split("\n"):
+            if not line.strip():
+                legacy.ln(5)
+            else:
+                legacy.multi_cell(0, 10, line.encode("latin-1", "replace").decode("latin-1"), new_x="LMARGIN", new_y="NEXT")
+        legacy.output()
+        print(f"legacy multi_cell per line: {time.perf_counter() - started:.2f}s")
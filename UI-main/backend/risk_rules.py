@@ -0,0 +1,425 @@
+"""
+Risky-pattern rules for the impact analyzers, compiled once at import.
+
+Rules are grouped per language and scanned over the text in a single pass: literal rule
+prefixes are found with one character-trie regex, and only the rules starting at those
+positions are tried. Every position where any rule matches is reported with its line and
+column, including positions where several rules overlap.
+"""
+import re
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+JAVASCRIPT = ("javascript", "typescript")
+PYTHON = ("python",)
+# Occurrences reported per rule; the count is still exact
+MAX_OCCURRENCES_PER_RULE = 50
+SNIPPET_CHARS = 120
+_NEWLINE_RE = re.compile("\n")
+_ALTERNATION_RE = re.compile(r"(?<!\\)\|")
+_PLAIN_CHARS = " _=,:;'\"<>/!@#%&-"
+
+
+@dataclass(frozen=True)
+class RiskRule:
+    id: str
+    pattern: str
+    risk_level: str
+    description: str
+    alternative_suggestions: Tuple[str, ...]
+    search_terms: Tuple[str, ...]
+    languages: Tuple[str, ...]
+    deprecation_warning: Optional[str] = None
+
+
+RULES: Tuple[RiskRule, ...] = (
+    # JavaScript/Web patterns
+    RiskRule(
+        id="eval",
+        pattern=r"eval\(",
+        risk_level="high",
+        description="Use of eval() function is dangerous as it executes arbitrary code",
+        deprecation_warning="eval() is considered dangerous and should be avoided",
+        alternative_suggestions=(
+            "Use JSON.parse() for parsing JSON data",
+            "Use Function constructor for dynamic code execution",
+            "Implement proper input validation and sanitization",
+        ),
+        search_terms=("javascript eval function security risks", "eval() dangerous code execution"),
+        languages=JAVASCRIPT + PYTHON,
+    ),
+    RiskRule(
+        id="inner-html",
+        pattern=r"innerHTML\s*=",
+        risk_level="medium",
+        description="Direct innerHTML assignment can lead to XSS attacks",
+        deprecation_warning="innerHTML assignment without sanitization is risky",
+        alternative_suggestions=(
+            "Use textContent for text-only content",
+            "Use DOMPurify library for HTML sanitization",
+            "Use createElement and appendChild for DOM manipulation",
+        ),
+        search_terms=("innerHTML XSS security", "innerHTML vs textContent security"),
+        languages=JAVASCRIPT,
+    ),
+    RiskRule(
+        id="document-write",
+        pattern=r"document\.write\(",
+        risk_level="high",
+        description="document.write() can cause security issues and poor performance",
+        deprecation_warning="document.write() is deprecated and should not be used",
+        alternative_suggestions=(
+            "Use DOM manipulation methods like createElement",
+            "Use innerHTML with proper sanitization",
+            "Use modern frameworks like React, Vue, or Angular",
+        ),
+        search_terms=("document.write deprecated", "document.write security issues"),
+        languages=JAVASCRIPT,
+    ),
+    RiskRule(
+        id="set-timeout-zero",
+        pattern=r"setTimeout\(.*,\s*0\)",
+        risk_level="low",
+        description="setTimeout with 0 delay can indicate potential race conditions",
+        alternative_suggestions=(
+            "Use Promise.resolve().then() for microtasks",
+            "Use requestAnimationFrame for UI updates",
+            "Consider using async/await patterns",
+        ),
+        search_terms=("setTimeout 0 delay race condition", "setTimeout vs Promise microtask"),
+        languages=JAVASCRIPT,
+    ),
+    RiskRule(
+        id="console-log",
+        pattern=r"console\.log\(",
+        risk_level="low",
+        description="Console.log statements should be removed in production code",
+        alternative_suggestions=(
+            "Use proper logging framework",
+            "Remove console.log statements before production",
+            "Use environment-based logging",
+        ),
+        search_terms=("console.log production code", "remove console.log before deployment"),
+        languages=JAVASCRIPT,
+    ),
+    RiskRule(
+        id="var-declaration",
+        pattern=r"var\s+",
+        risk_level="medium",
+        description="var declarations have function scope and can cause hoisting issues",
+        deprecation_warning="var is considered outdated in modern JavaScript",
+        alternative_suggestions=(
+            "Use const for values that won't be reassigned",
+            "Use let for values that will be reassigned",
+            "Prefer block scope over function scope",
+        ),
+        search_terms=("javascript var vs let const", "var hoisting issues"),
+        languages=JAVASCRIPT,
+    ),
+    RiskRule(
+        id="var-in-for-loop",
+        pattern=r"\bfor\s*\([^)]*var\s+",
+        risk_level="medium",
+        description="var in for loops can cause closure issues",
+        alternative_suggestions=(
+            "Use let instead of var in for loops",
+            "Use forEach, map, or other array methods",
+            "Use for...of loops for iterables",
+        ),
+        search_terms=("var in for loop closure", "javascript for loop var let difference"),
+        languages=JAVASCRIPT,
+    ),
+    # Python-specific patterns
+    RiskRule(
+        id="exec",
+        pattern=r"exec\(",
+        risk_level="high",
+        description="Use of exec() function is dangerous as it executes arbitrary code",
+        deprecation_warning="exec() is considered dangerous and should be avoided",
+        alternative_suggestions=(
+            "Use ast.literal_eval() for safe evaluation",
+            "Use json.loads() for JSON data",
+            "Implement proper input validation and sanitization",
+        ),
+        search_terms=("python exec function security risks", "exec() dangerous code execution"),
+        languages=PYTHON,
+    ),
+    RiskRule(
+        id="pickle-load",
+        pattern=r"pickle\.load\(",
+        risk_level="high",
+        description="pickle.load() can execute arbitrary code and is unsafe for untrusted data",
+        deprecation_warning="pickle.load() is dangerous for untrusted data",
+        alternative_suggestions=(
+            "Use json.load() for safe data deserialization",
+            "Use ast.literal_eval() for simple data structures",
+            "Implement custom serialization for complex objects",
+        ),
+        search_terms=("python pickle security risks", "pickle.load dangerous"),
+        languages=PYTHON,
+    ),
+    RiskRule(
+        id="subprocess-shell",
+        pattern=r"subprocess\.run.*shell=True",
+        risk_level="medium",
+        description="subprocess.run with shell=True can execute arbitrary shell commands",
+        deprecation_warning="shell=True is dangerous with user input",
+        alternative_suggestions=(
+            "Use subprocess.run with shell=False and list arguments",
+            "Use specific command execution libraries",
+            "Validate and sanitize all command inputs",
+        ),
+        search_terms=("python subprocess shell=True security", "subprocess shell injection"),
+        languages=PYTHON,
+    ),
+    RiskRule(
+        id="input",
+        pattern=r"input\(",
+        risk_level="medium",
+        description="input() without validation can lead to injection attacks",
+        alternative_suggestions=(
+            "Validate and sanitize all user input",
+            "Use argparse for command-line arguments",
+            "Implement proper input validation",
+        ),
+        search_terms=("python input() security", "input validation python"),
+        languages=PYTHON,
+    ),
+    RiskRule(
+        id="print",
+        pattern=r"print\(",
+        risk_level="low",
+        description="print() statements should be replaced with proper logging in production",
+        alternative_suggestions=(
+            "Use logging module for proper logging",
+            "Remove print statements before production",
+            "Use environment-based logging configuration",
+        ),
+        search_terms=("python print vs logging", "remove print statements production"),
+        languages=PYTHON,
+    ),
+)
+
+
+@dataclass(frozen=True)
+class RiskHit:
+    rule: RiskRule
+    line: int
+    column: int
+    offset: int
+    match: str
+
+
+def literal_prefix(pattern: str) -> str:
+    """
+    The literal text every match of pattern starts with ("" if there is none).
+    Only plain characters and escaped punctuation are taken, up to the first metacharacter;
+    a leading \\b is skipped since the rule itself still checks it.
+    """
+    if _ALTERNATION_RE.search(pattern):
+        return ""
+    index = 2 if pattern.startswith(r"\b") else 0
+    prefix = []
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\" and index + 1 < len(pattern) and not pattern[index + 1].isalnum():
+            literal, step = pattern[index + 1], 2
+        elif char.isalnum() or char in _PLAIN_CHARS:
+            literal, step = char, 1
+        else:
+            break
+        following = pattern[index + step:index + step + 1]
+        if following and following in "?*{":
+            break
+        prefix.append(literal)
+        if following == "+":
+            break
+        index += step
+    return "".join(prefix)
+
+
+def _trie_pattern(words: Sequence[str]) -> str:
+    """A regex for a set of literals that branches per character, so it scales to hundreds of words"""
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class RuleScanner:
+    """
+    Scans text for a set of rules in one pass.
+
+    Rules are compiled once. Each rule's literal prefix goes into a single character trie
+    that finds candidate positions (on lowercased text for case-insensitive rules); only the
+    rules whose prefix starts there are then tried. Rules without a literal prefix share one
+    combined alternation.
+    """
+
+    def __init__(self, rules: Sequence[RiskRule], flags: int = re.IGNORECASE):
+        self.rules = tuple(rules)
+        self._ignore_case = bool(flags & re.IGNORECASE)
+        self._compiled = tuple(re.compile(rule.pattern, flags) for rule in self.rules)
+        # First character of a prefix -> [(prefix, rule index)]
+        self._by_first_char: Dict[str, List[Tuple[str, int]]] = {}
+        self._residual: List[int] = []
+        for index, rule in enumerate(self.rules):
+            prefix = literal_prefix(rule.pattern)
+            if self._ignore_case:
+                prefix = prefix.lower()
+            if prefix:
+                self._by_first_char.setdefault(prefix[0], []).append((prefix, index))
+            else:
+                self._residual.append(index)
+        prefixes = sorted({prefix for bucket in self._by_first_char.values() for prefix, _ in bucket})
+        # Zero-width lookahead so candidates that overlap (e.g. "var" inside "for (var") are all found
+        self._candidates = re.compile(f"(?={_trie_pattern(prefixes)})") if prefixes else None
+        self._candidates_ignore_case = re.compile(f"(?={_trie_pattern(prefixes)})", re.IGNORECASE) if prefixes else None
+        self._combined = re.compile(
+            "|".join(f"(?P<r{index}>{self.rules[index].pattern})" for index in self._residual), flags
+        ) if self._residual else None
+
+    def _prefixed_hits(self, text: str) -> List[Tuple[int, int, str]]:
+        if self._candidates is None:
+            return []
+        haystack, candidates, exact = text, self._candidates, True
+        if self._ignore_case:
+            haystack = text.lower()
+            if len(haystack) != len(text):
+                # A few characters change length when lowercased; offsets must stay aligned with text
+                haystack, candidates, exact = text, self._candidates_ignore_case, False
+        hits = []
+        for candidate in candidates.finditer(haystack):
+            start = candidate.start()
+            first_char = haystack[start] if exact else haystack[start].lower()[:1]
+            for prefix, index in self._by_first_char.get(first_char, ()):
+                if not exact or haystack.startswith(prefix, start):
+                    found = self._compiled[index].match(text, start)
+                    if found is not None:
+                        hits.append((start, index, found.group()))
+        return hits
+
+    def _residual_hits(self, text: str) -> List[Tuple[int, int, str]]:
+        if self._combined is None:
+            return []
+        hits = []
+        position = 0
+        while True:
+            found = self._combined.search(text, position)
+            if found is None:
+                break
+            start = found.start()
+            first = int(found.lastgroup[1:])
+            hits.append((start, first, found.group()))
+            # Alternation only reports the first rule matching here; later ones may match too
+            for index in self._residual[self._residual.index(first) + 1:]:
+                overlap = self._compiled[index].match(text, start)
+                if overlap is not None:
+                    hits.append((start, index, overlap.group()))
+            # Resume right after this start, not after the match, so overlapping matches are found too
+            position = start + 1
+        return hits
+
+    def scan(self, text: str) -> List[RiskHit]:
+        """Every (rule, position) match in document order"""
+        raw = self._prefixed_hits(text) + self._residual_hits(text)
+        if not raw:
+            return []
+        raw.sort(key=lambda hit: (hit[0], hit[1]))
+        newlines = [newline.start() for newline in _NEWLINE_RE.finditer(text)]
+        hits = []
+        for start, index, matched in raw:
+            line = bisect_right(newlines, start - 1)
+            column = start - (newlines[line - 1] + 1 if line else 0)
+            hits.append(RiskHit(self.rules[index], line + 1, column + 1, start, matched))
+        return hits
+
+
+_scanners: Dict[str, RuleScanner] = {
+    language: RuleScanner([rule for rule in RULES if language in rule.languages])
+    for language in sorted({language for rule in RULES for language in rule.languages})
+}
+_all_rules_scanner = RuleScanner(RULES)
+
+
+def scanner_for(language: Optional[str] = None) -> RuleScanner:
+    """The compiled scanner for a language, or for all rules when the language is unknown"""
+    return _scanners.get((language or "").lower(), _all_rules_scanner)
+
+
+def find_risks(text: str, language: Optional[str] = None) -> "OrderedDict[str, Tuple[RiskRule, List[RiskHit]]]":
+    """Hits grouped by rule id, in rule order; rules without hits are left out"""
+    scanner = scanner_for(language)
+    hits_by_rule: Dict[str, List[RiskHit]] = {}
+    for hit in scanner.scan(text):
+        hits_by_rule.setdefault(hit.rule.id, []).append(hit)
+    return OrderedDict((rule.id, (rule, hits_by_rule[rule.id])) for rule in scanner.rules if rule.id in hits_by_rule)
+
+
+def search_query(rule: RiskRule) -> str:
+    """The Stack Overflow query used for a rule's findings"""
+    return rule.search_terms[0] if rule.search_terms else rule.pattern.replace("\\", "")
+
+
+def occurrence(hit: RiskHit, text: str) -> Dict[str, object]:
+    """JSON-ready location of a hit, with the (trimmed) line it is on"""
+    line_start = text.rfind("\n", 0, hit.offset) + 1
+    line_end = text.find("\n", hit.offset)
+    line_text = text[line_start:line_end if line_end != -1 else len(text)]
+    return {"line": hit.line, "column": hit.column, "match": hit.match[:SNIPPET_CHARS], "snippet": line_text.strip()[:SNIPPET_CHARS]}
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    random.seed(7)
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    rule_count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    # Synthetic rule set: the built-in rules plus generated call patterns
+    rules = list(RULES) + [
+        RiskRule(id=f"generated-{i}", pattern=rf"{random.choice('abcdefghij')}{random.choice('klmnop')}_call_{i}\(",
+                 risk_level="low", description="", alternative_suggestions=(), search_terms=(), languages=PYTHON)
+        for i in range(rule_count)
+    ]
+    statements = ["value = compute(items)", "print(value)", "for (var i = 0; i < n; i++) {",
+                  "element.innerHTML = html", "result = eval(expression)", "logger.info('done')",
+                  "data = pickle.load(handle)", "    return total"]
+    lines = []
+    length = 0
+    while length < size_mb * 1024 * 1024:
+        if random.random() < 0.01:
+            lines.append(f"ak_call_{random.randrange(rule_count)}(x)")
+        else:
+            lines.append(random.choice(statements))
+        length += len(lines[-1]) + 1
+    text = "\n".join(lines)
+
+    started = time.perf_counter()
+    scanner = RuleScanner(rules)
+    compiled = time.perf_counter() - started
+    started = time.perf_counter()
+    hits = scanner.scan(text)
+    elapsed = time.perf_counter() - started
+    print(f"risk_rules: {len(rules)} rules compiled in {compiled:.2f}s; {len(text) / 1e6:.1f} MB, "
+          f"{len(hits)} hits in {elapsed:.2f}s")
+
+    if "--per-rule" in sys.argv:
+        started = time.perf_counter()
+        for rule in rules:
+            re.findall(rule.pattern, text, re.IGNORECASE)
+        print(f"one re.findall per rule: {time.perf_counter() - started:.2f}s")
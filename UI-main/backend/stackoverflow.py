@@ -0,0 +1,164 @@
+"""
+Stack Overflow search for the risk findings of the impact analyzers.
+
+Rule queries are static, so results are cached on disk by query with a TTL and survive
+restarts. Cache misses are fetched concurrently over one pooled session. The client
+honors the API's throttling: a `backoff` in a response pauses further calls for that many
+seconds, and calls stop when the daily quota runs low, until it resets at midnight UTC.
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from caching import JsonFileCache
+
+STACK_OVERFLOW_SEARCH_URL = "https://api.stackexchange.com/2.3/search/advanced"
+REQUEST_TIMEOUT = 10
+STACK_OVERFLOW_CONCURRENCY = int(os.getenv("STACK_OVERFLOW_CONCURRENCY", "4"))
+STACK_OVERFLOW_CACHE_TTL = float(os.getenv("STACK_OVERFLOW_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+STACK_OVERFLOW_CACHE_DIR = os.getenv("STACK_OVERFLOW_CACHE_DIR", os.path.join(tempfile.gettempdir(), "stackoverflow_cache"))
+# Requests left in the daily quota that are kept in reserve
+QUOTA_RESERVE = int(os.getenv("STACK_OVERFLOW_QUOTA_RESERVE", "10"))
+# A backoff this short is waited out; a longer one skips the call
+MAX_BACKOFF_WAIT = 5.0
+# Pause after a throttle violation that doesn't say for how long
+THROTTLE_PAUSE = 60.0
+
+_searches = JsonFileCache(os.path.join(STACK_OVERFLOW_CACHE_DIR, "searches.json"), ttl=STACK_OVERFLOW_CACHE_TTL)
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=STACK_OVERFLOW_CONCURRENCY))
+_throttle_lock = threading.Lock()
+_blocked_until = 0.0  # time.time() before which no call is made
+_quota_remaining: Optional[int] = None
+
+
+def _cache_key(query: str, num_results: int) -> str:
+    return f"{num_results}:{' '.join(query.lower().split())}"
+
+
+def _fallback_links(query: str) -> List[str]:
+    return [
+        f"https://stackoverflow.com/questions/mock-{query.replace(' ', '-').lower()}-1",
+        f"https://stackoverflow.com/questions/mock-{query.replace(' ', '-').lower()}-2"
+    ]
+
+
+def _next_quota_reset() -> float:
+    tomorrow = datetime.now(timezone.utc).date() + timedelta(days=1)
+    return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=timezone.utc).timestamp()
+
+
+def _block_for(seconds: float) -> None:
+    global _blocked_until
+    with _throttle_lock:
+        _blocked_until = max(_blocked_until, time.time() + seconds)
+
+
+def _record_throttling(data: Dict) -> None:
+    """Apply the backoff and quota fields of an API response (or error response)"""
+    global _quota_remaining
+    if "quota_remaining" in data:
+        with _throttle_lock:
+            _quota_remaining = data["quota_remaining"]
+        if data["quota_remaining"] <= QUOTA_RESERVE:
+            print(f"Stack Overflow quota nearly used up ({data['quota_remaining']} left); pausing until it resets")
+            _block_for(_next_quota_reset() - time.time())
+    if data.get("backoff"):
+        _block_for(float(data["backoff"]))
+    if data.get("error_name") == "throttle_violation":
+        # e.g. "too many requests from this IP, more requests available in 79000 seconds"
+        wait = re.search(r"available in (\d+) seconds", data.get("error_message", ""))
+        _block_for(float(wait.group(1)) if wait else THROTTLE_PAUSE)
+
+
+def _wait_for_throttle() -> bool:
+    """Wait out a short backoff; False when calls are paused for longer than that"""
+    remaining = _blocked_until - time.time()
+    if remaining <= 0:
+        return True
+    if remaining > MAX_BACKOFF_WAIT:
+        return False
+    time.sleep(remaining)
+    return True
+
+
+def _fetch(query: str, num_results: int) -> Optional[List[str]]:
+    """Question links for a query from the API, or None when the call was skipped or failed"""
+    if not _wait_for_throttle():
+        print(f"Stack Overflow API paused by backoff/quota; skipping search for '{query}'")
+        return None
+    api_key = os.getenv("STACK_OVERFLOW_API_KEY")
+    params = {
+        "site": "stackoverflow",
+        "q": query,
+        "sort": "votes",
+        "order": "desc",
+        "pagesize": num_results,
+        # Only question ids are used, so the bodies aren't requested
+        "filter": "default",
+    }
+    if api_key:
+        params["key"] = api_key
+    try:
+        response = _session.get(STACK_OVERFLOW_SEARCH_URL, params=params, timeout=REQUEST_TIMEOUT)
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        _record_throttling(data)
+        response.raise_for_status()
+    except Exception as e:
+        print(f"Stack Overflow API error: {e}")
+        return None
+    links = []
+    for item in data.get("items", []):
+        question_id = item.get("question_id")
+        if question_id:
+            links.append(f"https://stackoverflow.com/questions/{question_id}")
+    return links[:num_results]
+
+
+def search_many(queries: Iterable[str], num_results: int = 3,
+                concurrency: int = STACK_OVERFLOW_CONCURRENCY) -> Dict[str, List[str]]:
+    """
+    Links for each query: cached results first, the rest fetched concurrently.
+    Failed or skipped searches get placeholder links, which are not cached.
+    """
+    results: Dict[str, List[str]] = {}
+    misses = []
+    for query in dict.fromkeys(queries):
+        cached = _searches.get(_cache_key(query, num_results))
+        if cached is not None:
+            results[query] = cached
+        else:
+            misses.append(query)
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(misses)))) as pool:
+            fetched = list(pool.map(lambda query: _fetch(query, num_results), misses))
+        for query, links in zip(misses, fetched):
+            if links is None:
+                results[query] = _fallback_links(query)
+            else:
+                _searches.set(_cache_key(query, num_results), links)
+                results[query] = links
+    return results
+
+
+def quota_remaining() -> Optional[int]:
+    """Requests left in today's quota as last reported by the API (None before the first call)"""
+    return _quota_remaining
+
+
+def prewarm(queries: Iterable[str], num_results: int = 3) -> None:
+    """Fill the cache for queries that aren't cached yet (e.g. every risk rule's query at startup)"""
+    started = time.perf_counter()
+    results = search_many(queries, num_results)
+    print(f"Stack Overflow cache prewarmed with {len(results)} queries in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,198 @@
+"""
+One-pass parser for Confluence page markup.
+
+Pages are parsed once per version with lxml (storage format as recovering XML,
+export_view as HTML) into a ParsedPage that every endpoint reads from, instead of
+each endpoint re-parsing the same markup with BeautifulSoup.
+"""
+import re
+from dataclasses import dataclass
+from html.entities import name2codepoint
+from typing import Hashable, List, Optional, Tuple
+
+from lxml import etree
+from lxml import html as lxml_html
+
+from caching import LRUCache
+
+AC_NS = "http://atlassian.com/content"
+RI_NS = "http://atlassian.com/resource/identifier"
+AT_NS = "http://atlassian.com/template"
+
+_STORAGE_ROOT_OPEN = f'<ac:confluence xmlns:ac="{AC_NS}" xmlns:ri="{RI_NS}" xmlns:at="{AT_NS}">'
+_STORAGE_ROOT_CLOSE = "</ac:confluence>"
+_XML_ENTITIES = {"amp", "lt", "gt", "quot", "apos"}
+_ENTITY_RE = re.compile(r"&([A-Za-z][A-Za-z0-9]*);")
+_NS_DECLARATION_RE = re.compile(r'\s+xmlns:\w+="[^"]*"')
+
+_HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+_LEAF_BLOCK_TAGS = {"p", "pre"} | _HEADING_TAGS
+_CONTAINER_BLOCK_TAGS = {"li", "td", "th", "blockquote"}
+_SKIPPED_TEXT_TAGS = {"script", "style"}
+
+_MACRO = f"{{{AC_NS}}}structured-macro"
+_MACRO_NAME = f"{{{AC_NS}}}name"
+_PARAMETER = f"{{{AC_NS}}}parameter"
+_PLAIN_TEXT_BODY = f"{{{AC_NS}}}plain-text-body"
+_AC_IMAGE = f"{{{AC_NS}}}image"
+_RI_ATTACHMENT = f"{{{RI_NS}}}attachment"
+_RI_FILENAME = f"{{{RI_NS}}}filename"
+_RI_URL = f"{{{RI_NS}}}url"
+_RI_VALUE = f"{{{RI_NS}}}value"
+
+_storage_parser = etree.XMLParser(recover=True, resolve_entities=False, remove_comments=True, huge_tree=True)
+_parsed_pages = LRUCache(max_entries=256)
+
+
+@dataclass(frozen=True)
+class CodeBlock:
+    code: str
+    language: str = ""
+
+
+@dataclass(frozen=True)
+class ParsedPage:
+    markup: str
+    text: str
+    text_blocks: Tuple[str, ...] = ()
+    code_blocks: Tuple[CodeBlock, ...] = ()
+    preformatted: Tuple[str, ...] = ()
+    tables: Tuple[str, ...] = ()
+    images: Tuple[str, ...] = ()
+    attachment_links: Tuple[str, ...] = ()
+
+    def code_text(self) -> str:
+        """Code macro bodies joined together, or the page text when there are none"""
+        if self.code_blocks:
+            return "\n".join(block.code for block in self.code_blocks)
+        return self.text.strip()
+
+
+def _numeric_entities(markup: str) -> str:
+    """Rewrite HTML named entities (&nbsp; etc.) as numeric references the XML parser understands"""
+    def replace(match):
+        name = match.group(1)
+        if name in _XML_ENTITIES or name not in name2codepoint:
+            return match.group(0)
+        return f"&#{name2codepoint[name]};"
+    return _ENTITY_RE.sub(replace, markup)
+
+
+def _parse_tree(markup: str, rendered: bool):
+    if rendered:
+        return lxml_html.document_fromstring(markup)
+    wrapped = _STORAGE_ROOT_OPEN + _numeric_entities(markup) + _STORAGE_ROOT_CLOSE
+    return etree.fromstring(wrapped.encode("utf-8"), _storage_parser)
+
+
+def _local_name(element) -> str:
+    tag = element.tag
+    if not isinstance(tag, str):
+        return ""
+    return tag.rsplit("}", 1)[-1].lower()
+
+
+def _collapse(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _macro_parameter(macro, name: str) -> str:
+    for parameter in macro.iterchildren(_PARAMETER):
+        if parameter.get(_MACRO_NAME) == name:
+            return (parameter.text or "").strip()
+    return ""
+
+
+def _build(markup: str, rendered: bool) -> ParsedPage:
+    if not markup or not markup.strip():
+        return ParsedPage(markup=markup or "", text="")
+    root = _parse_tree(markup, rendered)
+    if root is None:
+        return ParsedPage(markup=markup, text="")
+
+    text_nodes: List[str] = []
+    text_blocks: List[str] = []
+    code_blocks: List[CodeBlock] = []
+    preformatted: List[str] = []
+    tables: List[str] = []
+    images: List[str] = []
+    attachment_links: List[str] = []
+
+    for event, element in etree.iterwalk(root, events=("start", "end")):
+        tag = element.tag
+        if not isinstance(tag, str):
+            if event == "end" and element.tail and element.tail.strip():
+                text_nodes.append(element.tail)
+            continue
+        name = _local_name(element)
+        parent = element.getparent()
+        if event == "end":
+            # Tail text follows the element's whole subtree in document order
+            if element.tail and element.tail.strip():
+                text_nodes.append(element.tail)
+            continue
+        if name in _SKIPPED_TEXT_TAGS:
+            continue
+        if element.text and element.text.strip():
+            text_nodes.append(element.text)
+
+        if tag == _MACRO:
+            if element.get(_MACRO_NAME) == "code":
+                body = element.find(_PLAIN_TEXT_BODY)
+                if body is not None:
+                    code_blocks.append(CodeBlock(code=body.text or "", language=_macro_parameter(element, "language")))
+        elif tag == _RI_ATTACHMENT:
+            filename = element.get(_RI_FILENAME)
+            if filename:
+                attachment_links.append(filename)
+                if parent is not None and parent.tag == _AC_IMAGE:
+                    images.append(filename)
+        elif tag == _RI_URL:
+            if parent is not None and parent.tag == _AC_IMAGE and element.get(_RI_VALUE):
+                images.append(element.get(_RI_VALUE))
+        elif name == "img":
+            if element.get("src"):
+                images.append(element.get("src"))
+        elif name == "a":
+            href = element.get("href") or ""
+            if "/download/attachments/" in href:
+                attachment_links.append(href)
+        elif name == "table":
+            table_html = etree.tostring(element, encoding="unicode", method="html", with_tail=False)
+            tables.append(_NS_DECLARATION_RE.sub("", table_html))
+
+        if name == "pre" or (name == "code" and (parent is None or _local_name(parent) != "pre")):
+            code_text = "".join(element.itertext())
+            if code_text.strip():
+                preformatted.append(code_text)
+        if name in _LEAF_BLOCK_TAGS or (name in _CONTAINER_BLOCK_TAGS and element.find(".//p") is None):
+            block_text = _collapse("".join(element.itertext()))
+            if block_text:
+                text_blocks.append(block_text)
+
+    return ParsedPage(
+        markup=markup,
+        text="\n".join(text_nodes),
+        text_blocks=tuple(text_blocks),
+        code_blocks=tuple(code_blocks),
+        preformatted=tuple(preformatted),
+        tables=tuple(tables),
+        images=tuple(dict.fromkeys(images)),
+        attachment_links=tuple(dict.fromkeys(attachment_links)),
+    )
+
+
+def parse_page(markup: str, cache_key: Optional[Hashable] = None, rendered: bool = False) -> ParsedPage:
+    """
+    Parse Confluence markup into a ParsedPage.
+    Storage format is parsed as XML (ac:/ri: macros, CDATA code bodies); pass
+    rendered=True for export_view/view HTML. Results are cached under cache_key,
+    which should identify an immutable page version, e.g. (page_id, version, representation).
+    """
+    if cache_key is None:
+        return _build(markup, rendered)
+    parsed = _parsed_pages.get(cache_key)
+    if parsed is None:
+        parsed = _build(markup, rendered)
+        _parsed_pages.set(cache_key, parsed)
+    return parsed
@@ -0,0 +1,134 @@
+"""
+Local passage index over AssemblyAI transcripts for time-aligned video Q&A.
+
+Transcripts are cut into overlapping windows of words that keep their start/end
+times, and the windows are ranked with BM25. A question only sends the best matching
+moments to Gemini, so the prompt stays the same size however long the recording is.
+"""
+import hashlib
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+from caching import LRUCache
+
+WINDOW_CHARS = int(os.getenv("TRANSCRIPT_WINDOW_CHARS", "600"))
+# Consecutive windows overlap by this fraction so an answer spanning a window edge is still found
+WINDOW_OVERLAP = 0.5
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by did do does for from had has have he her his how i if in into is it its "
+    "me my no not of on or our she so than that the their them then there these they this to us was we "
+    "were what when where which who why will with you your".split()
+)
+
+_transcript_indexes = LRUCache(max_entries=64)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+@dataclass(frozen=True)
+class Passage:
+    start_ms: int
+    end_ms: int
+    text: str
+    speakers: Tuple[str, ...] = ()
+
+
+def _transcript_words(transcript: Dict[str, Any]) -> List[Dict[str, Any]]:
+    words = transcript.get("words") or []
+    if words:
+        return words
+    return [word for utterance in transcript.get("utterances") or [] for word in utterance.get("words") or []]
+
+
+def build_passages(transcript: Dict[str, Any], window_chars: int = WINDOW_CHARS) -> List[Passage]:
+    """Cut a transcript into overlapping, time-aligned windows of roughly window_chars"""
+    words = _transcript_words(transcript)
+    if not words:
+        text = transcript.get("text", "") or ""
+        step = max(1, int(window_chars * (1 - WINDOW_OVERLAP)))
+        return [Passage(0, 0, text[i:i + window_chars]) for i in range(0, len(text), step) if text[i:i + window_chars].strip()]
+
+    passages = []
+    start = 0
+    while start < len(words):
+        end, length = start, 0
+        while end < len(words) and (length < window_chars or end == start):
+            length += len(words[end].get("text", "")) + 1
+            end += 1
+        window = words[start:end]
+        passages.append(Passage(
+            start_ms=window[0].get("start", 0),
+            end_ms=window[-1].get("end", 0),
+            text=" ".join(word.get("text", "") for word in window),
+            speakers=tuple(dict.fromkeys(word["speaker"] for word in window if word.get("speaker"))),
+        ))
+        if end >= len(words):
+            break
+        start = max(start + 1, start + int((end - start) * (1 - WINDOW_OVERLAP)))
+    return passages
+
+
+class TranscriptIndex:
+    """BM25 index over the passages of one transcript"""
+
+    def __init__(self, passages: Sequence[Passage]):
+        self.passages = list(passages)
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._lengths: List[int] = []
+        for position, passage in enumerate(self.passages):
+            counts = Counter(tokenize(passage.text))
+            self._lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self._postings[term].append((position, frequency))
+        self._average_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+    @classmethod
+    def from_transcript(cls, transcript: Dict[str, Any], window_chars: int = WINDOW_CHARS) -> "TranscriptIndex":
+        return cls(build_passages(transcript, window_chars))
+
+    def _idf(self, term: str) -> float:
+        matches = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self.passages) - matches + 0.5) / (matches + 0.5))
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[Passage, float]]:
+        """Return up to top_k (passage, score) pairs, best first; passages without query terms are skipped"""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for position, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self._lengths[position] / (self._average_length or 1)
+                scores[position] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.passages[position], score) for position, score in ranked]
+
+
+def transcript_key(transcript: Dict[str, Any]) -> str:
+    """Stable identity for a transcript: its AssemblyAI id(s), or a hash of its text"""
+    if transcript.get("id"):
+        return str(transcript["id"])
+    if transcript.get("segment_ids"):
+        return "+".join(transcript["segment_ids"])
+    return hashlib.sha1((transcript.get("text") or "").encode("utf-8")).hexdigest()
+
+
+def get_transcript_index(transcript: Dict[str, Any]) -> TranscriptIndex:
+    """The passage index for a transcript, built once and cached by transcript identity"""
+    key = transcript_key(transcript)
+    index = _transcript_indexes.get(key)
+    if index is None:
+        index = TranscriptIndex.from_transcript(transcript)
+        _transcript_indexes.set(key, index)
+    return index
@@ -0,0 +1,365 @@
+"""
+Full-length transcript processing for the video summarizer.
+
+AssemblyAI transcripts are segmented locally (chapters, then utterances, then raw words),
+every segment is summarized concurrently and the results are reduced into one summary.
+Timestamps come from AssemblyAI's word timings rather than from the LLM.
+"""
+import asyncio
+import itertools
+import json
+import math
+import os
+import re
+import string
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SEGMENT_MAX_CHARS = int(os.getenv("TRANSCRIPT_SEGMENT_MAX_CHARS", "6000"))
+SUMMARY_CONCURRENCY = int(os.getenv("TRANSCRIPT_SUMMARY_CONCURRENCY", "4"))
+MAX_QUOTES = 5
+# A speaker who talks up to a segment cut and resumes within this gap is treated as the same person
+SPEAKER_CONTINUATION_GAP_MS = 1500
+
+_WORD_RE = re.compile(r"[\w']+")
+
+
+@dataclass
+class TranscriptSegment:
+    start_ms: int
+    end_ms: int
+    text: str
+    headline: str = ""
+    speakers: List[str] = field(default_factory=list)
+    words: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def format_timestamp(ms: Optional[int]) -> str:
+    """Format milliseconds as MM:SS, or H:MM:SS for recordings over an hour"""
+    total_seconds = max(0, int(ms or 0) // 1000)
+    hours, remainder = divmod(total_seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def format_range(start_ms: Optional[int], end_ms: Optional[int]) -> str:
+    return f"[{format_timestamp(start_ms)}-{format_timestamp(end_ms)}]"
+
+
+def _words_text(words: Sequence[Dict[str, Any]]) -> str:
+    return " ".join(word.get("text", "") for word in words).strip()
+
+
+def _segment_from_words(words: List[Dict[str, Any]], headline: str = "") -> TranscriptSegment:
+    speakers = list(dict.fromkeys(word["speaker"] for word in words if word.get("speaker")))
+    return TranscriptSegment(
+        start_ms=words[0].get("start", 0),
+        end_ms=words[-1].get("end", 0),
+        text=_words_text(words),
+        headline=headline,
+        speakers=speakers,
+        words=words,
+    )
+
+
+def _split_words(words: List[Dict[str, Any]], max_chars: int) -> List[List[Dict[str, Any]]]:
+    """Split a run of words into pieces of at most max_chars, preferring sentence ends"""
+    pieces: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    length = 0
+    for word in words:
+        current.append(word)
+        length += len(word.get("text", "")) + 1
+        sentence_end = word.get("text", "").endswith((".", "?", "!"))
+        if length >= max_chars or (sentence_end and length >= max_chars * 0.8):
+            pieces.append(current)
+            current, length = [], 0
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def segment_transcript(transcript: Dict[str, Any], max_chars: int = SEGMENT_MAX_CHARS) -> List[TranscriptSegment]:
+    """
+    Split a completed AssemblyAI transcript into time-aligned segments.
+    Uses chapters when auto_chapters ran, otherwise groups utterances (or raw words)
+    into windows of at most max_chars.
+    """
+    words = transcript.get("words") or []
+    chapters = transcript.get("chapters") or []
+    utterances = transcript.get("utterances") or []
+    segments: List[TranscriptSegment] = []
+
+    if chapters and words:
+        index = 0
+        for chapter in chapters:
+            chapter_words = []
+            while index < len(words) and words[index].get("start", 0) < chapter.get("end", 0):
+                chapter_words.append(words[index])
+                index += 1
+            for piece in _split_words(chapter_words, max_chars):
+                segments.append(_segment_from_words(piece, headline=chapter.get("headline") or chapter.get("gist", "")))
+        if index < len(words):
+            segments.extend(_segment_from_words(piece) for piece in _split_words(words[index:], max_chars))
+        return segments
+
+    if utterances:
+        window: List[Dict[str, Any]] = []
+        length = 0
+        for utterance in utterances:
+            utterance_words = utterance.get("words") or [{
+                "text": utterance.get("text", ""), "start": utterance.get("start", 0),
+                "end": utterance.get("end", 0), "speaker": utterance.get("speaker")
+            }]
+            utterance_length = len(utterance.get("text", ""))
+            if window and length + utterance_length > max_chars:
+                segments.extend(_segment_from_words(piece) for piece in _split_words(window, max_chars))
+                window, length = [], 0
+            window.extend(utterance_words)
+            length += utterance_length
+        if window:
+            segments.extend(_segment_from_words(piece) for piece in _split_words(window, max_chars))
+        return segments
+
+    if words:
+        return [_segment_from_words(piece) for piece in _split_words(words, max_chars)]
+
+    # No timing information at all: fall back to fixed-size text chunks
+    text = transcript.get("text", "") or ""
+    return [
+        TranscriptSegment(start_ms=0, end_ms=0, text=text[i:i + max_chars])
+        for i in range(0, len(text), max_chars)
+    ]
+
+
+def _speaker_labels() -> "itertools.chain[str]":
+    """A, B, ..., Z, AA, AB, ... (the labelling AssemblyAI uses)"""
+    return itertools.chain.from_iterable(
+        ("".join(letters) for letters in itertools.product(string.ascii_uppercase, repeat=size))
+        for size in itertools.count(1)
+    )
+
+
+def reconcile_speakers(parts: Sequence[Tuple[int, Dict[str, Any]]]) -> List[Dict[str, str]]:
+    """
+    Map each segment's local speaker labels onto labels that are consistent across the
+    whole recording. Segments are transcribed independently, so "A" in one segment need
+    not be "A" in the next. Heuristic: a speaker still talking across a cut keeps its
+    label, then the remaining local speakers are matched to global speakers by talk time
+    rank; leftovers get fresh labels.
+    """
+    mappings: List[Dict[str, str]] = []
+    global_talk: Counter = Counter()
+    previous_last: Optional[Tuple[str, int]] = None
+    for offset, transcript in parts:
+        utterances = [u for u in transcript.get("utterances") or [] if u.get("speaker")]
+        talk: Counter = Counter()
+        for utterance in utterances:
+            talk[utterance["speaker"]] += max(0, utterance.get("end", 0) - utterance.get("start", 0))
+        mapping: Dict[str, str] = {}
+        if not mappings:
+            mapping = {speaker: speaker for speaker in talk}
+        else:
+            if utterances and previous_last is not None:
+                gap = utterances[0].get("start", 0) + offset - previous_last[1]
+                if gap <= SPEAKER_CONTINUATION_GAP_MS:
+                    mapping[utterances[0]["speaker"]] = previous_last[0]
+            local_ranked = [speaker for speaker, _ in talk.most_common() if speaker not in mapping]
+            global_ranked = [speaker for speaker, _ in global_talk.most_common() if speaker not in mapping.values()]
+            for local, known in zip(local_ranked, global_ranked):
+                mapping[local] = known
+            used = set(global_talk) | set(mapping.values())
+            fresh = (label for label in _speaker_labels() if label not in used)
+            for local in local_ranked[len(global_ranked):]:
+                mapping[local] = next(fresh)
+        for speaker, duration in talk.items():
+            global_talk[mapping[speaker]] += duration
+        if utterances:
+            last = utterances[-1]
+            previous_last = (mapping[last["speaker"]], last.get("end", 0) + offset)
+        mappings.append(mapping)
+    return mappings
+
+
+def _shift(item: Dict[str, Any], offset: int, mapping: Dict[str, str]) -> Dict[str, Any]:
+    shifted = dict(item)
+    for key in ("start", "end"):
+        if shifted.get(key) is not None:
+            shifted[key] = shifted[key] + offset
+    if shifted.get("speaker") is not None:
+        shifted["speaker"] = mapping.get(shifted["speaker"], shifted["speaker"])
+    if shifted.get("words"):
+        shifted["words"] = [_shift(word, offset, mapping) for word in shifted["words"]]
+    return shifted
+
+
+def stitch_transcripts(parts: Sequence[Tuple[int, Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Join transcripts of consecutive audio segments into one transcript.
+    parts is [(segment_offset_ms, transcript), ...] in playback order; word, utterance
+    and chapter times are shifted by the offset and speaker labels reconciled.
+    """
+    mappings = reconcile_speakers(parts)
+    stitched: Dict[str, Any] = {
+        "status": "completed", "text": "", "words": [], "utterances": [], "chapters": [],
+        "auto_highlights_result": {"status": "success", "results": []}, "audio_duration": 0,
+        "segment_ids": []
+    }
+    texts = []
+    for (offset, transcript), mapping in zip(parts, mappings):
+        texts.append((transcript.get("text") or "").strip())
+        stitched["words"].extend(_shift(word, offset, mapping) for word in transcript.get("words") or [])
+        stitched["utterances"].extend(_shift(u, offset, mapping) for u in transcript.get("utterances") or [])
+        stitched["chapters"].extend(_shift(chapter, offset, {}) for chapter in transcript.get("chapters") or [])
+        highlights = (transcript.get("auto_highlights_result") or {}).get("results") or []
+        for highlight in highlights:
+            highlight = dict(highlight)
+            highlight["timestamps"] = [_shift(span, offset, {}) for span in highlight.get("timestamps") or []]
+            stitched["auto_highlights_result"]["results"].append(highlight)
+        stitched["audio_duration"] = max(
+            stitched["audio_duration"], offset / 1000 + (transcript.get("audio_duration") or 0)
+        )
+        if transcript.get("id"):
+            stitched["segment_ids"].append(transcript["id"])
+    stitched["text"] = " ".join(text for text in texts if text)
+    return stitched
+
+
+def _tokens(text: str) -> List[str]:
+    """Lowercase word tokens; hyphens and punctuation split words, curly apostrophes count as straight ones"""
+    tokens = (token.strip("'") for token in _WORD_RE.findall(text.lower().replace("\u2019", "'")))
+    return [token for token in tokens if token]
+
+
+def locate_quote(quote: str, words: Sequence[Dict[str, Any]]) -> Optional[Tuple[int, int]]:
+    """Find a verbatim quote in the word list and return its (start_ms, end_ms)"""
+    quote_tokens = _tokens(quote)
+    if not quote_tokens or not words:
+        return None
+    # Both sides are tokenized the same way, so "well-known," in the transcript is the two tokens
+    # the quote has; owners maps each token back to the word it came from
+    word_tokens: List[str] = []
+    owners: List[int] = []
+    for index, word in enumerate(words):
+        for token in _tokens(word.get("text", "")):
+            word_tokens.append(token)
+            owners.append(index)
+    anchor = quote_tokens[:min(4, len(quote_tokens))]
+    for i in range(len(word_tokens) - len(anchor) + 1):
+        if word_tokens[i:i + len(anchor)] == anchor:
+            end_index = owners[min(len(owners) - 1, i + len(quote_tokens) - 1)]
+            return words[owners[i]].get("start", 0), words[end_index].get("end", 0)
+    return None
+
+
+def _parse_json_response(text: str) -> Dict[str, Any]:
+    cleaned = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    try:
+        result = json.loads(cleaned)
+        return result if isinstance(result, dict) else {}
+    except json.JSONDecodeError:
+        return {}
+
+
+async def _summarize_segment(ai_model, segment: TranscriptSegment, semaphore: asyncio.Semaphore,
+                             quotes: int = 1) -> Dict[str, Any]:
+    prompt = (
+        "You are summarizing one part of a longer video transcript.\n"
+        "Return ONLY a JSON object with these keys:\n"
+        "  \"headline\": a short title for this part (max 12 words),\n"
+        "  \"summary\": 2-4 sentences summarizing this part,\n"
+        f"  \"quotes\": a list of up to {quotes} powerful or interesting sentences, each copied VERBATIM "
+        "from the transcript part.\n"
+        "Do not include timestamps.\n\n"
+        f"Transcript part:\n{segment.text}"
+    )
+    async with semaphore:
+        response = await ai_model.generate_content_async(prompt)
+    result = _parse_json_response(response.text)
+    if not result:
+        result = {"summary": response.text.strip()}
+    return result
+
+
+def _partial_quotes(partial: Dict[str, Any]) -> List[str]:
+    """The "quotes" list of a segment summary, tolerating a single string in its place"""
+    quotes = partial.get("quotes") or []
+    if isinstance(quotes, str):
+        quotes = [quotes]
+    cleaned = (str(quote).strip().strip('"') for quote in quotes if quote)
+    return [quote for quote in cleaned if quote]
+
+
+async def summarize_transcript(transcript: Dict[str, Any], ai_model, concurrency: int = SUMMARY_CONCURRENCY) -> Dict[str, Any]:
+    """
+    Map-reduce summary of a whole transcript.
+    Returns the overall summary, verbatim quotes and "[MM:SS-MM:SS] headline" moments,
+    with every time taken from AssemblyAI word timings.
+    """
+    segments = [segment for segment in segment_transcript(transcript) if segment.text.strip()]
+    if not segments:
+        return {"summary": "", "quotes": [], "quote_timestamps": [], "timestamps": [], "segments": []}
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # Enough quotes from each part to fill MAX_QUOTES, spread over the recording
+    quotes_per_segment = math.ceil(MAX_QUOTES / len(segments))
+    partials = await asyncio.gather(*(
+        _summarize_segment(ai_model, segment, semaphore, quotes_per_segment) for segment in segments
+    ))
+
+    segment_details = []
+    segment_quotes = []
+    for segment, partial in zip(segments, partials):
+        headline = segment.headline or str(partial.get("headline", "")).strip()
+        segment_details.append({
+            "start": format_timestamp(segment.start_ms),
+            "end": format_timestamp(segment.end_ms),
+            "start_ms": segment.start_ms,
+            "end_ms": segment.end_ms,
+            "headline": headline,
+            "summary": str(partial.get("summary", "")).strip(),
+            "speakers": segment.speakers
+        })
+        segment_quotes.append([
+            (segment, quote) for quote in _partial_quotes(partial)[:quotes_per_segment]
+        ])
+
+    # Take the first quote of every part, then the second, ... and list the chosen ones in playback order
+    chosen = []
+    seen = set()
+    rounds = itertools.zip_longest(*segment_quotes, fillvalue=(None, None))
+    for segment, quote in itertools.chain.from_iterable(rounds):
+        if quote is None or quote.lower() in seen or len(chosen) >= MAX_QUOTES:
+            continue
+        seen.add(quote.lower())
+        located = locate_quote(quote, segment.words) or (segment.start_ms, segment.end_ms)
+        chosen.append((located, quote))
+    chosen.sort(key=lambda entry: entry[0])
+    quotes = [quote for _, quote in chosen]
+    quote_timestamps = [f"{format_range(*located)} {quote}" for located, quote in chosen]
+
+    if len(segment_details) == 1:
+        summary = segment_details[0]["summary"]
+    else:
+        reduce_prompt = (
+            "The following are summaries of consecutive parts of one video.\n"
+            "Write a detailed paragraph summarizing the whole video.\n"
+            "Do NOT include any timestamps in the summary.\n\n"
+            + "\n".join(f"- {detail['headline']}: {detail['summary']}" for detail in segment_details)
+        )
+        summary = (await ai_model.generate_content_async(reduce_prompt)).text.strip()
+
+    timestamps = [
+        f"{format_range(detail['start_ms'], detail['end_ms'])} {detail['headline'] or detail['summary'][:120]}"
+        for detail in segment_details
+    ]
+    return {
+        "summary": summary,
+        "quotes": quotes,
+        "quote_timestamps": quote_timestamps,
+        "timestamps": timestamps,
+        "segments": segment_details
+    }
@@ -0,0 +1,315 @@
+"""
+AssemblyAI transcription client used by the video summarizer.
+
+Uploads stream from a generator, and waiting for a transcript never blocks the event
+loop: status checks run in worker threads, back off exponentially with jitter under an
+overall deadline, and wake up early when AssemblyAI calls our webhook. Long recordings
+can be cut on silences and transcribed as concurrent segments that are stitched back together.
+Encoded audio is hashed, so identical audio is never uploaded or transcribed twice.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import tempfile
+from typing import IO, Any, Dict, Iterable, Optional, Tuple
+
+import requests
+
+from audio_pipeline import (
+    CHUNK_SIZE, AudioExtractionError, analyze_silences, plan_segments, stream_speech_audio_segment
+)
+from caching import JsonFileCache
+from transcript_processing import stitch_transcripts
+
+ASSEMBLYAI_BASE_URL = "https://api.assemblyai.com/v2"
+# (connect, read) timeouts; uploads stream for as long as ffmpeg keeps producing audio
+UPLOAD_TIMEOUT = (10, 600)
+REQUEST_TIMEOUT = 30
+
+TRANSCRIPTION_DEADLINE = float(os.getenv("TRANSCRIPTION_DEADLINE_SECONDS", "1800"))
+POLL_INITIAL_DELAY = 2.0
+POLL_MAX_DELAY = 30.0
+# With a webhook configured polling is only a fallback, so it can back off further
+WEBHOOK_POLL_MAX_DELAY = 120.0
+WEBHOOK_SECRET_HEADER = "X-Webhook-Secret"
+
+# Segmented transcription: target segment length and how many segments run at once
+SEGMENT_SECONDS = float(os.getenv("TRANSCRIPTION_SEGMENT_SECONDS", "600"))
+SEGMENT_CONCURRENCY = int(os.getenv("TRANSCRIPTION_SEGMENT_CONCURRENCY", "4"))
+
+DEFAULT_TRANSCRIPT_OPTIONS = {
+    "speaker_labels": True,
+    "auto_chapters": True,
+    "auto_highlights": True,
+    "entity_detection": True,
+    "sentiment_analysis": True
+}
+
+# Audio content hash -> upload_url / transcript_id, persisted so reruns and restarts reuse them.
+# AssemblyAI upload URLs are short-lived; transcripts are kept until deleted.
+ASSEMBLYAI_CACHE_DIR = os.getenv("ASSEMBLYAI_CACHE_DIR", os.path.join(tempfile.gettempdir(), "assemblyai_cache"))
+UPLOAD_CACHE_TTL = float(os.getenv("ASSEMBLYAI_UPLOAD_TTL_SECONDS", str(24 * 3600)))
+TRANSCRIPT_CACHE_TTL = float(os.getenv("ASSEMBLYAI_TRANSCRIPT_TTL_SECONDS", str(30 * 24 * 3600)))
+AUDIO_SPOOL_SIZE = 32 * 1024 * 1024
+_upload_urls = JsonFileCache(os.path.join(ASSEMBLYAI_CACHE_DIR, "uploads.json"), ttl=UPLOAD_CACHE_TTL)
+_transcript_ids = JsonFileCache(os.path.join(ASSEMBLYAI_CACHE_DIR, "transcripts.json"), ttl=TRANSCRIPT_CACHE_TTL)
+# Source identity (e.g. Confluence attachment id + version) -> audio hash, to skip downloading known media
+_source_audio_hashes = JsonFileCache(os.path.join(ASSEMBLYAI_CACHE_DIR, "sources.json"), ttl=TRANSCRIPT_CACHE_TTL)
+
+# Transcript id -> (loop, future) for jobs currently waiting on a webhook callback
+_webhook_waiters: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+
+
+class TranscriptionError(Exception):
+    """Raised when AssemblyAI rejects an upload or a transcription job"""
+
+
+class TranscriptionTimeout(TranscriptionError):
+    """Raised when a transcript is not ready before the deadline"""
+
+
+def webhook_url() -> Optional[str]:
+    return os.getenv("ASSEMBLYAI_WEBHOOK_URL")
+
+
+def webhook_secret() -> Optional[str]:
+    return os.getenv("ASSEMBLYAI_WEBHOOK_SECRET")
+
+
+def upload_audio(audio_chunks: Iterable[bytes], api_key: str) -> str:
+    """
+    Upload audio to AssemblyAI as a chunked request body and return its upload_url.
+    audio_chunks can be a generator (e.g. ffmpeg output), so nothing is buffered here.
+    """
+    response = requests.post(
+        f"{ASSEMBLYAI_BASE_URL}/upload",
+        headers={"authorization": api_key, "content-type": "application/octet-stream"},
+        data=audio_chunks,
+        timeout=UPLOAD_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise TranscriptionError(f"Failed to upload audio to AssemblyAI (HTTP {response.status_code})")
+    return response.json()["upload_url"]
+
+
+async def submit_transcription(audio_url: str, api_key: str, **options: Any) -> str:
+    """Submit an uploaded file for transcription and return the transcript id"""
+    payload = {"audio_url": audio_url, **DEFAULT_TRANSCRIPT_OPTIONS, **options}
+    if webhook_url():
+        payload["webhook_url"] = webhook_url()
+        if webhook_secret():
+            payload["webhook_auth_header_name"] = WEBHOOK_SECRET_HEADER
+            payload["webhook_auth_header_value"] = webhook_secret()
+    response = await asyncio.to_thread(
+        requests.post,
+        f"{ASSEMBLYAI_BASE_URL}/transcript",
+        json=payload,
+        headers={"authorization": api_key, "content-type": "application/json"},
+        timeout=REQUEST_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise TranscriptionError("Failed to submit audio for transcription")
+    return response.json()["id"]
+
+
+async def fetch_transcript(transcript_id: str, api_key: str) -> Dict[str, Any]:
+    response = await asyncio.to_thread(
+        requests.get,
+        f"{ASSEMBLYAI_BASE_URL}/transcript/{transcript_id}",
+        headers={"authorization": api_key},
+        timeout=REQUEST_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise TranscriptionError("Failed to get transcription status")
+    return response.json()
+
+
+async def wait_for_transcript(transcript_id: str, api_key: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Wait until a transcript is completed and return it.
+    Polls with exponential backoff and full jitter, returning early when the webhook
+    reports the job finished, and raises TranscriptionTimeout after `deadline` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + (deadline if deadline is not None else TRANSCRIPTION_DEADLINE)
+    notified = None
+    if webhook_url():
+        notified = loop.create_future()
+        _webhook_waiters[transcript_id] = (loop, notified)
+    max_delay = WEBHOOK_POLL_MAX_DELAY if notified is not None else POLL_MAX_DELAY
+    delay = POLL_INITIAL_DELAY
+    try:
+        while True:
+            transcript = await fetch_transcript(transcript_id, api_key)
+            status = transcript.get("status")
+            if status == "completed":
+                return transcript
+            if status == "error":
+                raise TranscriptionError(f"Transcription failed: {transcript.get('error', 'unknown error')}")
+            remaining = expires_at - loop.time()
+            if remaining <= 0:
+                raise TranscriptionTimeout(f"Transcript {transcript_id} was not ready within the deadline (status: {status})")
+            sleep_for = min(random.uniform(POLL_INITIAL_DELAY / 2, delay), remaining)
+            if notified is not None and not notified.done():
+                await asyncio.wait({notified}, timeout=sleep_for)
+            else:
+                await asyncio.sleep(sleep_for)
+            delay = min(delay * 2, max_delay)
+    finally:
+        _webhook_waiters.pop(transcript_id, None)
+
+
+def notify_transcript_webhook(transcript_id: str, status: str) -> bool:
+    """
+    Wake the job waiting on transcript_id after an AssemblyAI webhook call.
+    Returns False when no job in this process is waiting for it (e.g. another worker
+    owns it); that job still completes through polling.
+    """
+    waiter = _webhook_waiters.get(transcript_id)
+    if waiter is None:
+        return False
+    loop, future = waiter
+
+    def resolve():
+        if not future.done():
+            future.set_result(status)
+
+    loop.call_soon_threadsafe(resolve)
+    return True
+
+
+async def transcribe(audio_url: str, api_key: str, deadline: Optional[float] = None, **options: Any) -> Dict[str, Any]:
+    """Submit an uploaded file and wait for the finished transcript"""
+    transcript_id = await submit_transcription(audio_url, api_key, **options)
+    return await wait_for_transcript(transcript_id, api_key, deadline=deadline)
+
+
+def spool_audio(audio_chunks: Iterable[bytes]) -> Tuple[IO[bytes], str]:
+    """Write encoded audio to a spooled temporary file while hashing it; returns (file, sha256 hex)"""
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=AUDIO_SPOOL_SIZE)
+    try:
+        for chunk in audio_chunks:
+            digest.update(chunk)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, digest.hexdigest()
+
+
+def _cache_key(audio_hash: str, options: Dict[str, Any]) -> str:
+    if not options:
+        return audio_hash
+    return f"{audio_hash}:{hashlib.sha1(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()[:12]}"
+
+
+def remember_source_audio(source_key: str, audio_hash: str) -> None:
+    _source_audio_hashes.set(source_key, audio_hash)
+
+
+def source_audio_hash(source_key: str) -> Optional[str]:
+    return _source_audio_hashes.get(source_key)
+
+
+async def find_cached_transcript(audio_hash: str, api_key: str, deadline: Optional[float] = None,
+                                 **options: Any) -> Optional[Dict[str, Any]]:
+    """Return the transcript already made for this audio, waiting for it if still running"""
+    key = _cache_key(audio_hash, options)
+    transcript_id = _transcript_ids.get(key)
+    if not transcript_id:
+        return None
+    try:
+        transcript = await fetch_transcript(transcript_id, api_key)
+        if transcript.get("status") == "completed":
+            print(f"Reusing AssemblyAI transcript {transcript_id} for identical audio")
+            return transcript
+        if transcript.get("status") != "error":
+            return await wait_for_transcript(transcript_id, api_key, deadline=deadline)
+    except TranscriptionTimeout:
+        raise
+    except TranscriptionError:
+        pass
+    # Deleted or failed transcripts are forgotten and redone
+    _transcript_ids.pop(key)
+    return None
+
+
+async def transcribe_audio_file(audio_file: IO[bytes], audio_hash: str, api_key: str,
+                                deadline: Optional[float] = None, **options: Any) -> Dict[str, Any]:
+    """
+    Transcribe spooled, encoded audio, skipping work already done for the same audio hash:
+    a known transcript is returned directly, and a known upload_url is not uploaded again.
+    """
+    cached = await find_cached_transcript(audio_hash, api_key, deadline=deadline, **options)
+    if cached is not None:
+        return cached
+
+    upload_url = _upload_urls.get(audio_hash)
+    reused_upload = upload_url is not None
+    for attempt in range(2):
+        if upload_url is None:
+            audio_file.seek(0)
+            upload_url = await asyncio.to_thread(upload_audio, iter(lambda: audio_file.read(CHUNK_SIZE), b""), api_key)
+            _upload_urls.set(audio_hash, upload_url)
+        try:
+            transcript_id = await submit_transcription(upload_url, api_key, **options)
+            _transcript_ids.set(_cache_key(audio_hash, options), transcript_id)
+            return await wait_for_transcript(transcript_id, api_key, deadline=deadline)
+        except TranscriptionTimeout:
+            raise
+        except TranscriptionError:
+            if not reused_upload or attempt:
+                raise
+            # The cached upload may have expired on AssemblyAI's side; upload again once
+            _upload_urls.pop(audio_hash)
+            _transcript_ids.pop(_cache_key(audio_hash, options))
+            upload_url, reused_upload = None, False
+
+
+async def transcribe_in_segments(audio_path: str, api_key: str, segment_seconds: float = SEGMENT_SECONDS,
+                                 concurrency: int = SEGMENT_CONCURRENCY, deadline: Optional[float] = None,
+                                 **options: Any) -> Dict[str, Any]:
+    """
+    Transcribe a local audio file as segments cut on silence boundaries.
+    Segments are encoded, uploaded and transcribed concurrently (at most `concurrency`
+    at a time, skipping segments whose audio was transcribed before), then stitched into one transcript with corrected offsets and speakers.
+    If any segment fails, the others are cancelled (and their ffmpeg readers finish) before the error is raised,
+    so the caller can remove audio_path.
+    """
+    duration, silences = await asyncio.to_thread(analyze_silences, audio_path)
+    segments = plan_segments(duration, silences, segment_seconds)
+    if not segments:
+        raise AudioExtractionError("The recording has no audio to transcribe")
+    print(f"Transcribing {duration:.0f}s of audio as {len(segments)} segment(s)")
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def transcribe_segment(start: float, end: float) -> Dict[str, Any]:
+        async with semaphore:
+            encoding = asyncio.ensure_future(asyncio.to_thread(
+                spool_audio, stream_speech_audio_segment(audio_path, start, end)
+            ))
+            try:
+                audio_file, audio_hash = await asyncio.shield(encoding)
+            except asyncio.CancelledError:
+                # A thread can't be cancelled: let ffmpeg finish reading audio_path, then drop its output
+                spooled = (await asyncio.gather(encoding, return_exceptions=True))[0]
+                if isinstance(spooled, tuple):
+                    spooled[0].close()
+                raise
+            with audio_file:
+                return await transcribe_audio_file(audio_file, audio_hash, api_key, deadline=deadline, **options)
+
+    tasks = [asyncio.create_task(transcribe_segment(start, end)) for start, end in segments]
+    try:
+        transcripts = await asyncio.gather(*tasks)
+    except BaseException:
+        # Stop uploading and polling for the other segments
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return stitch_transcripts([(int(start * 1000), transcript) for (start, _), transcript in zip(segments, transcripts)])
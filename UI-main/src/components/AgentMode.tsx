@@ -1120,6 +1120,44 @@ ${isHistoryExport ? `*Historical Entry ID: ${currentHistoryId}*` : ''}`;
     a.click();
   };
 
+  const exportAllOutputs = async () => {
+    // Every tool output as PDF and DOCX in one ZIP, instead of one export per output and format
+    const outputs: { name: string; content: string }[] = [];
+    outputTabs.forEach(tab => {
+      if (tab.id === 'per-page-results' && tab.results) {
+        tab.results.forEach((result: any) => {
+          result.results?.forEach((r: any) => {
+            if (r.formattedOutput?.trim()) {
+              outputs.push({ name: `${result.page} - ${r.instruction}`.slice(0, 80), content: r.formattedOutput });
+            }
+          });
+        });
+      } else if (tab.content?.trim()) {
+        outputs.push({ name: tab.label, content: tab.content });
+      }
+    });
+    if (outputs.length === 0) return;
+    try {
+      const blob = await apiService.exportBatch({
+        items: outputs.flatMap(output => ['pdf', 'docx'].map(format => ({
+          content: output.content,
+          format,
+          filename: output.name.replace(/[\\/:*?"<>|]+/g, '-'),
+        }))),
+        archive_name: 'ai-agent-outputs',
+      });
+      const url = URL.createObjectURL(blob);
+      const a = document.createElement('a');
+      a.href = url;
+      a.download = 'ai-agent-outputs.zip';
+      a.click();
+      URL.revokeObjectURL(url);
+    } catch (err) {
+      setError('Failed to export outputs. Please try again.');
+      console.error('Error exporting outputs:', err);
+    }
+  };
+
   const backToChat = () => {
     setPlanSteps([]);
     setCurrentStep(0);
@@ -1780,6 +1818,13 @@ ${isHistoryExport ? `*Historical Entry ID: ${currentHistoryId}*` : ''}`;
                     <Download className="w-5 h-5 inline-block mr-2" />
                     Export Plan
                   </button>
+                  <button
+                    onClick={exportAllOutputs}
+                    className="px-6 py-3 bg-orange-500/90 text-white rounded-lg hover:bg-orange-600 transition-colors font-semibold shadow-md border border-white/10"
+                  >
+                    <Download className="w-5 h-5 inline-block mr-2" />
+                    Export All Outputs
+                  </button>
                   <button
                     onClick={backToChat}
                     className="px-6 py-3 bg-white/80 text-orange-600 rounded-lg hover:bg-orange-100 transition-colors font-semibold shadow-md border border-orange-200/50"
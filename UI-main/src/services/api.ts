@@ -15,16 +15,44 @@ export interface CodeRequest {
 
 export interface ImpactRequest {
   space_key: string;
-  old_page_title: string;
-  new_page_title: string;
+  old_page_title?: string;
+  new_page_title?: string;
+  page_title?: string;
+  old_version?: number;
+  new_version?: number;
+  history_depth?: number;
   question?: string;
   enable_stack_overflow_check?: boolean;
 }
 
+export interface BatchImpactRequest {
+  space_key?: string;
+  since: string;
+  until?: string;
+  max_pages?: number;
+  concurrency?: number;
+  resume?: boolean;
+}
+
+export interface CodeFileChange {
+  path: string;
+  old_code?: string;
+  new_code?: string;
+  language?: string;
+}
+
 export interface DirectCodeImpactRequest {
-  old_code: string;
-  new_code: string;
+  old_code?: string;
+  new_code?: string;
+  files?: CodeFileChange[];
+  patch?: string;
+  repo_path?: string;
+  base_ref?: string;
+  head_ref?: string;
+  paths?: string[];
   question?: string;
+  structural?: boolean;
+  language?: string;
   enable_stack_overflow_check?: boolean;
 }
 
@@ -103,6 +131,12 @@ export interface ExportRequest {
   content: string;
   format: string;
   filename: string;
+  download?: boolean;
+}
+
+export interface BatchExportRequest {
+  items: ExportRequest[];
+  archive_name?: string;
 }
 
 export interface Space {
@@ -140,6 +174,65 @@ export interface ImpactResponse {
   answer?: string;
   diff: string;
   stack_overflow_risks?: StackOverflowRisk[];
+  version_history?: PageVersionStep[];
+  structure?: string | null;
+  files?: FileImpact[] | null;
+}
+
+export interface FileImpact {
+  path: string;
+  old_path: string | null;
+  status: 'added' | 'deleted' | 'modified' | 'renamed';
+  language: string;
+  lines_added: number;
+  lines_removed: number;
+  percentage_change: number;
+  impact_analysis: string;
+  risk_score: number;
+  risk_level: 'low' | 'medium' | 'high';
+  risk_factors: string[];
+  structure: string | null;
+}
+
+export interface BatchImpactPageReport {
+  page_id: string;
+  title: string;
+  url: string;
+  from_version: number | null; // Last version before the window; null for pages created in it
+  to_version: number;
+  edits: number; // Versions published in the window
+  when: string;
+  author: string;
+  message: string;
+  lines_added: number;
+  lines_removed: number;
+  percentage_change: number;
+  impact_analysis: string;
+  risk_factors: string[];
+  risk_score: number;
+  risk_level: 'low' | 'medium' | 'high';
+}
+
+export interface BatchImpactResponse {
+  space_key: string;
+  since: string;
+  until: string | null;
+  pages_found: number;
+  pages_analyzed: number;
+  pages_resumed: number;
+  risk_counts: { high: number; medium: number; low: number };
+  report: BatchImpactPageReport[];
+  failed: { page_id: string; title: string; error: string }[];
+}
+
+export interface PageVersionStep {
+  from_version: number;
+  to_version: number;
+  when: string;
+  author: string;
+  message: string;
+  lines_added: number;
+  lines_removed: number;
 }
 
 export interface StackOverflowRisk {
@@ -149,6 +242,16 @@ export interface StackOverflowRisk {
   stack_overflow_links: string[];
   alternative_suggestions: string[];
   deprecation_warning?: string;
+  occurrence_count?: number;
+  occurrences?: RiskOccurrence[];
+}
+
+export interface RiskOccurrence {
+  path?: string;
+  line: number;
+  column: number;
+  match: string;
+  snippet: string;
 }
 
 export interface TestResponse {
@@ -169,6 +272,30 @@ export interface VideoRequest {
   space_key: string;
   page_title: string;
   question?: string;
+  segmented?: boolean;
+  all_media?: boolean;
+}
+
+export interface VideoSummary {
+  filename: string;
+  video_url: string;
+  summary?: string;
+  quotes?: string[];
+  quote_timestamps?: string[];
+  timestamps?: string[];
+  transcript?: string;
+  error?: string;
+}
+
+export interface VideoSource {
+  filename: string;
+  start: string;
+  end: string;
+  start_ms: number;
+  end_ms: number;
+  url: string;
+  speakers: string[];
+  text: string;
 }
 
 export interface VideoResponse {
@@ -178,6 +305,9 @@ export interface VideoResponse {
   qa: Array<{question: string, answer: string}>;
   page_title: string;
   answer?: string;
+  sources?: VideoSource[];
+  digest?: string;
+  videos?: VideoSummary[];
 }
 
 export interface ImageRequest {
@@ -203,6 +333,8 @@ export interface ChartRequest {
   chart_type: string;
   filename: string;
   format: string;
+  dpi?: number; // Raster resolution, 50-600 (default 100; pptx reuses a cached PNG, else 300)
+  download?: boolean;
 }
 
 export interface ImageResponse {
@@ -219,6 +351,28 @@ export interface ChartResponse {
   filename: string;
 }
 
+// Chart.js configuration ({ type, data, options }) for format "spec"
+export interface ChartSpec {
+  type: 'bar' | 'line' | 'pie';
+  data: {
+    labels: string[];
+    datasets: Array<{
+      label: string;
+      data: Array<number | null>;
+      backgroundColor: string | string[];
+      borderColor?: string;
+      [option: string]: unknown;
+    }>;
+  };
+  options: Record<string, unknown>;
+}
+
+export interface ChartSpecResponse {
+  chart_spec: ChartSpec;
+  mime_type: string;
+  filename: string;
+}
+
 export interface SaveToConfluenceRequest {
   space_key: string;
   page_title: string;
@@ -334,6 +488,13 @@ class ApiService {
     });
   }
 
+  async batchImpactAnalyzer(request: BatchImpactRequest): Promise<BatchImpactResponse> {
+    return this.makeRequest<BatchImpactResponse>('/batch-impact-analyzer', {
+      method: 'POST',
+      body: JSON.stringify(request),
+    });
+  }
+
   async directCodeImpactAnalyzer(request: DirectCodeImpactRequest): Promise<ImpactResponse> {
     return this.makeRequest<ImpactResponse>('/direct-code-impact-analyzer', {
       method: 'POST',
@@ -395,37 +556,44 @@ class ApiService {
   }
 
   async exportContent(request: ExportRequest): Promise<Blob> {
+    // download: the backend streams the file itself instead of base64 inside JSON
+    return this.downloadFile('/export', { ...request, download: true }, 'Export failed');
+  }
+
+  async exportBatch(request: BatchExportRequest): Promise<Blob> {
+    // One ZIP for every item, streamed while the backend renders the files
+    return this.downloadFile('/export-batch', request, 'Batch export failed');
+  }
+
+  async createChartSpec(request: Omit<ChartRequest, 'format' | 'dpi' | 'download'>): Promise<ChartSpecResponse> {
+    // The chart's data and config for the browser to draw; the server renders nothing
+    return this.makeRequest<ChartSpecResponse>('/create-chart', {
+      method: 'POST',
+      body: JSON.stringify({ ...request, format: 'spec' }),
+    });
+  }
+
+  async createChartFile(request: ChartRequest): Promise<Blob> {
+    return this.downloadFile('/create-chart', { ...request, download: true }, 'Chart creation failed');
+  }
+
+  private async downloadFile(endpoint: string, body: object, errorMessage: string): Promise<Blob> {
     const apiKey = this.getSelectedApiKey();
-    const response = await fetch(`${API_BASE_URL}/export`, {
+    const response = await fetch(`${API_BASE_URL}${endpoint}`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
         'x-api-key': apiKey || '',
       },
-      body: JSON.stringify(request),
+      body: JSON.stringify(body),
     });
 
     if (!response.ok) {
       const error = await response.json();
-      throw new Error(error.detail || 'Export failed');
+      throw new Error(error.detail || errorMessage);
     }
 
-    const result = await response.json();
-    
-    // Handle binary files (PDF, DOCX) that are base64 encoded
-    if (request.format === 'pdf' || request.format === 'docx' || request.format === 'pptx') {
-      const binaryString = atob(result.file);
-      const bytes = new Uint8Array(binaryString.length);
-      for (let i = 0; i < binaryString.length; i++) {
-        bytes[i] = binaryString.charCodeAt(i);
-      }
-      return new Blob([bytes], { type: result.mime });
-    } else {
-      // Handle text files
-      const encoder = new TextEncoder();
-      const bytes = encoder.encode(result.file);
-      return new Blob([bytes], { type: result.mime });
-    }
+    return response.blob();
   }
 
   async saveToConfluence(request: SaveToConfluenceRequest): Promise<SaveToConfluenceResponse> {